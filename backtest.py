@@ -0,0 +1,164 @@
+import argparse
+import sqlite3
+import time
+
+import numpy as np
+import pandas as pd
+
+from columnstore import open_store
+from db import connect
+
+DB_NAME = 'tradeapp.db'
+
+HORIZONS = (1, 5, 10, 20) # Forward returns, in sessions after the match's last bar
+DISTANCE_BUCKETS = 5 # Distance quantiles per template; bucket 0 holds every match
+DAY_MS = 86_400_000
+
+def ensure_backtest_results(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS backtest_results (
+            template TEXT,
+            horizon INTEGER,
+            bucket INTEGER,
+            min_distance REAL,
+            max_distance REAL,
+            matches INTEGER,
+            mean_return REAL,
+            median_return REAL,
+            hit_rate REAL,
+            computed_at TEXT,
+            PRIMARY KEY (template, horizon, bucket)
+        )
+        """
+    )
+    conn.commit()
+
+# --- Price Matrix ---
+def close_matrix(conn: sqlite3.Connection, tickers=None) -> tuple[np.ndarray, dict, np.ndarray]:
+    """(dates, ticker_index, closes): a sessions x tickers Close matrix with NaN where a ticker has no bar.
+
+    The column store is used as is when it is current; otherwise the matrix is
+    pivoted from one grouped_daily_data read.
+    """
+    store = open_store(conn)
+    if store is not None:
+        return store.dates, store.ticker_index, store.field('Close')
+
+    if tickers is None:
+        where, params = "", []
+    else:
+        tickers = list(tickers)
+        where, params = f"WHERE Ticker IN ({','.join(['?'] * len(tickers))})", tickers
+    df = pd.read_sql_query(f"SELECT Ticker, Timestamp, Close FROM grouped_daily_data {where}", conn, params=params)
+    dates = np.unique(df['Timestamp'].to_numpy(dtype=np.int64))
+    ticker_index = {ticker: i for i, ticker in enumerate(sorted(df['Ticker'].unique()))}
+    closes = np.full((len(dates), len(ticker_index)), np.nan)
+    closes[np.searchsorted(dates, df['Timestamp'].to_numpy(dtype=np.int64)), df['Ticker'].map(ticker_index).to_numpy()] = df['Close'].to_numpy(dtype=float)
+    return dates, ticker_index, closes
+
+# --- Forward Returns ---
+def forward_returns(conn: sqlite3.Connection, matches: pd.DataFrame, horizons=HORIZONS) -> pd.DataFrame:
+    """Add Return_<h>d columns to (Ticker, Template, End, Distance) matches.
+
+    End is the match's last bar (a date or datetime); the entry is that session's
+    Close, or the last session before it. Each return is the Close h sessions
+    later over the entry Close, NaN where either bar is missing or the horizon
+    runs past the data. Every lookup is one fancy-index into the price matrix.
+    """
+    dates, ticker_index, closes = close_matrix(conn, matches['Ticker'].unique())
+    result = matches.copy()
+    end_days = pd.to_datetime(result['End']).to_numpy(dtype='datetime64[D]').astype(np.int64)
+    rows = np.searchsorted(dates // DAY_MS, end_days, side='right') - 1
+    columns = result['Ticker'].map(ticker_index).fillna(-1).to_numpy(dtype=np.int64)
+    known = (rows >= 0) & (columns >= 0)
+
+    entry = np.full(len(result), np.nan)
+    entry[known] = closes[rows[known], columns[known]]
+    for horizon in horizons:
+        exits = np.full(len(result), np.nan)
+        ahead = known & (rows + horizon < len(dates))
+        exits[ahead] = closes[rows[ahead] + horizon, columns[ahead]]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result[f'Return_{horizon}d'] = exits / entry - 1
+    return result
+
+def summarize(returns: pd.DataFrame, horizons=HORIZONS, buckets: int = DISTANCE_BUCKETS) -> pd.DataFrame:
+    """Per template, horizon and distance bucket: match count, mean and median return, and hit rate (share > 0).
+
+    Buckets are distance quantiles within each template (1 = closest); bucket 0 is all matches.
+    """
+    frame = returns.copy()
+    frame['Bucket'] = frame.groupby('Template')['Distance'].transform(
+        lambda distance: pd.qcut(distance.rank(method='first'), min(buckets, len(distance)), labels=False) + 1
+    )
+    frame = pd.concat([frame.assign(Bucket=0), frame])
+
+    summaries = []
+    for horizon in horizons:
+        column = f'Return_{horizon}d'
+        valid = frame.dropna(subset=[column])
+        grouped = valid.groupby(['Template', 'Bucket'])
+        summary = grouped.agg(
+            MinDistance=('Distance', 'min'),
+            MaxDistance=('Distance', 'max'),
+            Matches=(column, 'size'),
+            MeanReturn=(column, 'mean'),
+            MedianReturn=(column, 'median'),
+            HitRate=(column, lambda values: (values > 0).mean()),
+        ).reset_index()
+        summary.insert(1, 'Horizon', horizon)
+        summaries.append(summary)
+    columns = ['Template', 'Horizon', 'Bucket', 'MinDistance', 'MaxDistance', 'Matches', 'MeanReturn', 'MedianReturn', 'HitRate']
+    if not summaries:
+        return pd.DataFrame(columns=columns)
+    return pd.concat(summaries, ignore_index=True)[columns].sort_values(['Template', 'Horizon', 'Bucket'], ignore_index=True)
+
+# --- Storage ---
+def save_backtest(conn: sqlite3.Connection, summary: pd.DataFrame) -> int:
+    """Replace the stored statistics of every template in the summary. Returns rows stored."""
+    computed_at = time.strftime('%Y-%m-%d %H:%M:%S')
+    with conn:
+        conn.executemany("DELETE FROM backtest_results WHERE template = ?", [(name,) for name in summary['Template'].unique()])
+        conn.executemany(
+            """
+            INSERT INTO backtest_results (template, horizon, bucket, min_distance, max_distance, matches, mean_return, median_return, hit_rate, computed_at)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """,
+            [(*row, computed_at) for row in summary.itertuples(index=False, name=None)],
+        )
+    return len(summary)
+
+def load_backtest(conn: sqlite3.Connection, template: str | None = None) -> pd.DataFrame:
+    where, params = ("WHERE template = ?", (template,)) if template else ("", ())
+    return pd.read_sql_query(f"SELECT * FROM backtest_results {where} ORDER BY template, horizon, bucket", conn, params=params)
+
+def scan_result_matches(conn: sqlite3.Connection, mode: str = 'template') -> pd.DataFrame:
+    """Every stored nightly match of a template mode as (Ticker, Template, End, Distance)."""
+    return pd.read_sql_query(
+        "SELECT ticker AS Ticker, reference AS Template, scan_date AS End, distance AS Distance FROM scan_results WHERE mode = ?",
+        conn, params=(mode,),
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Forward-return backtest of template matches, stored per template in backtest_results")
+    parser.add_argument('--matches', default=None, help="CSV of matches with Ticker, Template, End, Distance (e.g. from historysearch.py)")
+    parser.add_argument('--scan-mode', default='template', help="Without --matches, backtest the nightly scan_results of this mode")
+    parser.add_argument('--db', default=DB_NAME)
+    args = parser.parse_args()
+
+    start_time = time.time()
+    with connect(args.db) as conn:
+        ensure_backtest_results(conn)
+        matches = pd.read_csv(args.matches) if args.matches else scan_result_matches(conn, args.scan_mode)
+        if matches.empty:
+            print("No matches to backtest")
+            return
+        summary = summarize(forward_returns(conn, matches))
+        stored = save_backtest(conn, summary)
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary[summary['Bucket'] == 0].to_string(index=False))
+    print(f"Backtested {len(matches)} matches, stored {stored} rows in {time.time() - start_time:.1f} seconds")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,214 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timedelta
+from types import SimpleNamespace
+
+from db import connect
+from syntheticdb import DB_NAME, END_DATE, build_database, close_timestamps, session_bars, stock_rows, ticker_names
+from tradingcalendar import trading_days
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+def git_commit() -> dict:
+    """HEAD of the checkout being measured and whether tracked files have local changes."""
+    def git(*args):
+        result = subprocess.run(['git', *args], cwd=REPO_DIR, capture_output=True, text=True)
+        return result.stdout.strip() if result.returncode == 0 else None
+    status = git('status', '--porcelain', '--untracked-files=no')
+    return {'commit': git('rev-parse', 'HEAD'), 'dirty': bool(status) if status is not None else None}
+
+def timed(function, repeat: int = 1, before=None) -> dict:
+    """Median and individual wall times of `repeat` calls; before() runs untimed ahead of each call.
+
+    If the function returns a dict, the last call's is merged into the result
+    (e.g. rows returned), so a change in output is visible next to the timing.
+    """
+    runs, extra = [], None
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        extra = function()
+        runs.append(time.perf_counter() - start)
+    return {'seconds': statistics.median(runs), 'runs': runs, **(extra if isinstance(extra, dict) else {})}
+
+def skipped(reason: str) -> dict:
+    return {'seconds': None, 'skipped': reason}
+
+# --- Benchmarks ---
+# The scans open tradeapp.db in the working directory, so they only run once
+# the benchmark has moved into its own directory.
+def scan_benchmarks(repeat: int, processes: int | None) -> dict:
+    """Every DTW scan mode, cold (empty dtw_cache) and again with the cache warm from the cold run."""
+    import scanner
+    from scanpool import get_pool
+    conn = scanner.open_database(DB_NAME)
+
+    def clear_cache():
+        conn.execute("DELETE FROM dtw_cache")
+        conn.commit()
+
+    def rows(result):
+        return {'rows': len(result[0] if isinstance(result, tuple) else result)}
+
+    results = {}
+    results['get_all_tickers'] = timed(lambda: {'rows': len(scanner.get_all_tickers(conn))}, repeat)
+    universe = scanner.get_all_tickers(conn)
+    if not universe:
+        return results
+    patterns = scanner.pattern_template_arrays
+    template = next(iter(patterns))
+    all_templates = scanner.get_all_templates(conn)
+    scans = [
+        (patterns, 'scan.template', lambda: scanner.calculate_dtw_distances_to_selected_template(conn, patterns, universe, template, processes)),
+        (patterns, 'scan.template_variable', lambda: scanner.calculate_dtw_distances_to_selected_template(conn, patterns, universe, template, processes, variable_length=True)),
+        (patterns, 'scan.template_topk', lambda: scanner.calculate_dtw_distances_to_selected_template(conn, patterns, universe, template, processes, top_k=100)),
+        (patterns, 'scan.stocks', lambda: scanner.calculate_dtw_distances_to_stocks(conn, patterns, universe[0], universe, processes)),
+        (all_templates, 'scan.all_templates', lambda: scanner.calculate_dtw_distances_to_all_templates(conn, all_templates, universe, processes)),
+        (all_templates, 'scan.all_templates_variable', lambda: scanner.calculate_dtw_distances_to_all_templates(conn, all_templates, universe, processes, variable_length=True)),
+        (all_templates, 'scan.all_templates_topk', lambda: scanner.calculate_dtw_distances_to_all_templates(conn, all_templates, universe, processes, top_k=100)),
+    ]
+    for templates, name, scan in scans:
+        # Pool start-up is paid once per app session, not per scan
+        get_pool(templates, processes)
+        logging.info(f"Timing {name}")
+        results[name] = timed(lambda: rows(scan()), repeat, before=clear_cache)
+        results[f'{name}.cached'] = timed(lambda: rows(scan()), repeat)
+    return results
+
+def ingest_benchmarks(repeat: int, tickers: list[str], seed: int) -> dict:
+    """The ingest writers on synthetic payloads: one new session of grouped daily bars per call, and a stock_data upsert."""
+    results = {}
+    try:
+        import dailydata
+    except ImportError as error:
+        results['ingest.grouped_daily'] = skipped(f"dailydata.py not importable: {error}")
+    else:
+        # Each call stores a new session, as a nightly run would
+        days = trading_days(END_DATE + timedelta(days=1), END_DATE + timedelta(days=366))
+        sessions = iter(zip(days, close_timestamps(days).tolist()))
+
+        def store_session():
+            day, timestamp = next(sessions)
+            bars = session_bars(tickers, timestamp, seed)
+            response = [
+                SimpleNamespace(ticker=t, close=c, high=h, low=l, transactions=n, open=o, timestamp=ts, volume=v, vwap=w)
+                for t, c, h, l, n, o, ts, v, w in bars
+            ]
+            dailydata.store_grouped_daily_data(response, day.isoformat())
+            return {'rows': len(response)}
+        dailydata.create_tables()
+        results['ingest.grouped_daily'] = timed(store_session, repeat)
+
+    try:
+        import companydata
+    except ImportError as error:
+        results['ingest.stock_data'] = skipped(f"companydata.py not importable: {error}")
+    else:
+        rows = stock_rows(tickers, seed + 1)
+
+        def upsert():
+            with connect(DB_NAME) as conn:
+                companydata.write_stock_data(conn, rows)
+            return {'rows': len(rows)}
+        results['ingest.stock_data'] = timed(upsert, repeat)
+    return results
+
+def indicator_benchmarks(repeat: int) -> dict:
+    from rollingretun import calculate_indicators
+    return {
+        'calculate_indicators.full': timed(lambda: calculate_indicators(full_rebuild=True), repeat),
+        # Runs after the ingest benchmarks, so there are new sessions to append the first time
+        'calculate_indicators.incremental': timed(calculate_indicators, repeat),
+    }
+
+def feature_benchmarks(repeat: int) -> dict:
+    from featurevector import encode_all
+    return {'encode_all': timed(lambda: encode_all(DB_NAME), repeat)}
+
+def run(tickers: int, years: float, templates: int, seed: int, repeat: int, processes: int | None, workdir: str) -> dict:
+    """Build the synthetic database in `workdir` and time every stage against it."""
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+    start = time.perf_counter()
+    scale = build_database(DB_NAME, tickers, years, templates, seed, overwrite=True)
+    benchmarks = {'build_database': {'seconds': time.perf_counter() - start}}
+
+    from dtwengine import engine_name
+    from scanpool import default_workers, shutdown_pool
+    try:
+        benchmarks.update(scan_benchmarks(repeat, processes))
+    finally:
+        shutdown_pool()
+    benchmarks.update(ingest_benchmarks(repeat, ticker_names(tickers), seed))
+    benchmarks.update(indicator_benchmarks(repeat))
+    benchmarks.update(feature_benchmarks(repeat))
+
+    return {
+        **git_commit(),
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'cpus': os.cpu_count(),
+        'engine': engine_name(),
+        'scale': {**scale, 'years': years, 'seed': seed, 'repeat': repeat, 'processes': processes or default_workers()},
+        'benchmarks': benchmarks,
+    }
+
+def compare(before: dict, after: dict) -> str:
+    """Side-by-side median seconds of two result files, with after / before for every benchmark in both."""
+    lines = [f"{'benchmark':<36} {'before':>10} {'after':>10} {'ratio':>7}"]
+    for name, result in after['benchmarks'].items():
+        previous = before['benchmarks'].get(name, {}).get('seconds')
+        current = result.get('seconds')
+        if previous is None or current is None:
+            continue
+        lines.append(f"{name:<36} {previous:>10.4f} {current:>10.4f} {current / previous if previous else float('inf'):>7.2f}")
+    if before.get('scale') != after.get('scale'):
+        lines.append("Note: the two runs used different scales")
+    return '\n'.join(lines)
+
+def main():
+    parser = argparse.ArgumentParser(description="Time the scans, indicators, feature encoding and ingest writers on a synthetic tradeapp.db")
+    parser.add_argument('--tickers', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--templates', type=int, default=50, help="Rows in the synthetic template_bank")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3, help="Timed calls per benchmark (the median is reported)")
+    parser.add_argument('--processes', type=int, default=None, help="Scan pool size (default: SCAN_WORKERS or the core count)")
+    parser.add_argument('--workdir', default=None, help="Where to build the database (default: a temporary directory, removed afterwards)")
+    parser.add_argument('--output', default='benchmark.json')
+    parser.add_argument('--compare', default=None, help="Earlier result file to compare this run with")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    output = os.path.abspath(args.output)
+    baseline = os.path.abspath(args.compare) if args.compare else None
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix='tradeapp-bench-')
+    cwd = os.getcwd()
+    try:
+        results = run(args.tickers, args.years, args.templates, args.seed, args.repeat, args.processes, workdir)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    for name, result in results['benchmarks'].items():
+        print(f"  {name:<36} " + (f"{result['seconds']:.4f} s" if result['seconds'] is not None else f"skipped ({result['skipped']})"))
+    print(f"Results written to {output}")
+    if baseline:
+        with open(baseline) as f:
+            print(compare(json.load(f), results))
+
+if __name__ == '__main__':
+    main()
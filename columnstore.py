@@ -0,0 +1,289 @@
+import argparse
+import json
+import os
+import shutil
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+from db import connect
+from schema import table_version
+
+DB_NAME = 'tradeapp.db'
+STORE_DIR = 'columnstore'
+
+# One (date_capacity x ticker_capacity) float32 file per field; missing bars are NaN
+FIELDS = ['Open', 'High', 'Low', 'Close', 'Volume', 'VWAP']
+GROWTH = 1.25 # Spare capacity when a dimension has to grow
+
+# Reader cache, keyed on the meta file's mtime so a sync by dailydata is picked up
+_cache: dict = {'key': None, 'store': None}
+
+class ColumnStore:
+    """Memory-mapped date x ticker OHLCV arrays with a JSON ticker/date index.
+
+    Rows are sessions in ascending Timestamp order, columns are tickers in the
+    order they were first seen. A bar is present where Close is not NaN.
+    """
+
+    def __init__(self, path: str = STORE_DIR, mode: str = 'r'):
+        self.path = path
+        self.mode = mode
+        with open(os.path.join(path, 'meta.json')) as f:
+            meta = json.load(f)
+        self.tickers = meta['tickers']
+        self.dates = np.array(meta['dates'], dtype=np.int64)
+        self.date_capacity = meta['date_capacity']
+        self.ticker_capacity = meta['ticker_capacity']
+        self.generation = meta.get('generation', 0)
+        self.version = meta.get('version') # grouped_daily_data's change counter when the store last matched it
+        self.ticker_index = {ticker: i for i, ticker in enumerate(self.tickers)}
+        self._stale = [] # Files of a replaced generation, removed once save() has published the new one
+        self._map()
+
+    def _field_path(self, field: str, generation: int | None = None) -> str:
+        generation = self.generation if generation is None else generation
+        return os.path.join(self.path, f'{field}.f32' if generation == 0 else f'{field}.{generation}.f32')
+
+    def _map(self) -> None:
+        shape = (self.date_capacity, self.ticker_capacity)
+        self.arrays = {
+            field: np.memmap(self._field_path(field), dtype=np.float32, mode=self.mode, shape=shape)
+            for field in FIELDS
+        }
+
+    def field(self, name: str) -> np.ndarray:
+        """Zero-copy (dates x tickers) view of one field."""
+        return self.arrays[name][:len(self.dates), :len(self.tickers)]
+
+    def tail(self, name: str, rows: int) -> np.ndarray:
+        """Zero-copy view of the last `rows` sessions of one field."""
+        n_dates = len(self.dates)
+        return self.arrays[name][max(0, n_dates - rows):n_dates, :len(self.tickers)]
+
+    def columns(self, tickers) -> tuple[np.ndarray, np.ndarray]:
+        """Store columns of the given tickers, and which of them the store knows at all."""
+        columns = np.array([self.ticker_index.get(ticker, -1) for ticker in tickers], dtype=np.int64)
+        return np.maximum(columns, 0), columns >= 0
+
+    # --- Writer ---
+    def write_bars(self, rows, versions: tuple | None = None) -> None:
+        """Write dailydata rows (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP).
+
+        `versions` is grouped_daily_data's change counter (before, after) the
+        commit that stored the rows. The store only takes on `after` if it
+        matched `before`; otherwise it stays stale until rebuilt.
+        """
+        if not rows:
+            return
+        before, after = versions or (None, None)
+        self.version = after if before is not None and self.version == before else None
+        frame = pd.DataFrame(rows, columns=['Ticker', 'Close', 'High', 'Low', 'Transactions', 'Open', 'Timestamp', 'Volume', 'VWAP'])
+        new_tickers = [ticker for ticker in frame['Ticker'].unique() if ticker not in self.ticker_index]
+        new_dates = np.setdiff1d(frame['Timestamp'].to_numpy(dtype=np.int64), self.dates)
+        dates = np.union1d(self.dates, new_dates)
+        n_tickers = len(self.tickers) + len(new_tickers)
+        date_capacity = self.date_capacity if len(dates) <= self.date_capacity else int(len(dates) * GROWTH) + 1
+        ticker_capacity = self.ticker_capacity if n_tickers <= self.ticker_capacity else int(n_tickers * GROWTH) + 1
+
+        appended = not len(new_dates) or not len(self.dates) or new_dates[0] > self.dates[-1]
+        if appended and (date_capacity, ticker_capacity) == (self.date_capacity, self.ticker_capacity):
+            # New sessions and tickers go into spare rows and columns that readers don't cover yet
+            for array in self.arrays.values():
+                array[len(self.dates):len(dates)] = np.nan
+            self.dates = dates
+        else:
+            self._rewrite(dates, date_capacity, ticker_capacity)
+        for ticker in new_tickers:
+            self.ticker_index[ticker] = len(self.tickers)
+            self.tickers.append(ticker)
+
+        rows_at = np.searchsorted(self.dates, frame['Timestamp'].to_numpy(dtype=np.int64))
+        columns_at = frame['Ticker'].map(self.ticker_index).to_numpy()
+        for field in FIELDS:
+            self.arrays[field][rows_at, columns_at] = frame[field].to_numpy(dtype=np.float32, na_value=np.nan)
+        self.save()
+
+    def _rewrite(self, dates: np.ndarray, date_capacity: int, ticker_capacity: int) -> None:
+        """Copy every field into a new generation of files laid out for `dates`, a superset of the current sessions.
+
+        The current files are never modified: open readers keep their mapping,
+        and new readers keep opening them until save() publishes the new
+        generation by renaming meta.json into place.
+        """
+        n_dates, n_tickers = len(self.dates), len(self.tickers)
+        rows_at = np.searchsorted(dates, self.dates)
+        generation = self.generation + 1
+        for field in FIELDS:
+            rewritten = np.memmap(self._field_path(field, generation), dtype=np.float32, mode='w+', shape=(date_capacity, ticker_capacity))
+            rewritten[:] = np.nan
+            rewritten[rows_at, :n_tickers] = self.arrays[field][:n_dates, :n_tickers]
+            rewritten.flush()
+            del rewritten
+        self._stale += [self._field_path(field) for field in FIELDS]
+        self.generation = generation
+        self.dates = dates
+        self.date_capacity, self.ticker_capacity = date_capacity, ticker_capacity
+        self._map()
+
+    def save(self) -> None:
+        """Flush the arrays, then publish the index; readers only see rows the meta file covers."""
+        for array in self.arrays.values():
+            array.flush()
+        meta = {
+            'tickers': self.tickers,
+            'dates': self.dates.tolist(),
+            'date_capacity': self.date_capacity,
+            'ticker_capacity': self.ticker_capacity,
+            'generation': self.generation,
+            'version': self.version,
+        }
+        with open(os.path.join(self.path, 'meta.json.tmp'), 'w') as f:
+            json.dump(meta, f)
+        os.replace(os.path.join(self.path, 'meta.json.tmp'), os.path.join(self.path, 'meta.json'))
+        # Readers still mapping the old files keep their pages after the unlink
+        for path in self._stale:
+            os.remove(path)
+        self._stale = []
+
+def store_exists(path: str = STORE_DIR) -> bool:
+    return os.path.exists(os.path.join(path, 'meta.json'))
+
+def create_store(path: str, tickers: list[str], dates: np.ndarray, version: int | None = None) -> ColumnStore:
+    """Lay out empty (NaN) field files with spare capacity for the given tickers and sessions."""
+    os.makedirs(path, exist_ok=True)
+    date_capacity = int(len(dates) * GROWTH) + 1
+    ticker_capacity = int(len(tickers) * GROWTH) + 1
+    for field in FIELDS:
+        array = np.memmap(os.path.join(path, f'{field}.f32'), dtype=np.float32, mode='w+', shape=(date_capacity, ticker_capacity))
+        array[:] = np.nan
+        array.flush()
+        del array
+    with open(os.path.join(path, 'meta.json'), 'w') as f:
+        json.dump({
+            'tickers': list(tickers),
+            'dates': [int(d) for d in dates],
+            'date_capacity': date_capacity,
+            'ticker_capacity': ticker_capacity,
+            'version': version,
+        }, f)
+    return ColumnStore(path, mode='r+')
+
+def build_from_sqlite(conn: sqlite3.Connection, path: str = STORE_DIR, chunk_rows: int = 500_000) -> ColumnStore:
+    """Build the store from grouped_daily_data in bounded chunks and swap it in over any existing one."""
+    # Read before the bars: a write landing in between leaves the store looking stale, never current
+    version = table_version(conn, 'grouped_daily_data')
+    tickers = [row[0] for row in conn.execute("SELECT DISTINCT Ticker FROM grouped_daily_data ORDER BY Ticker")]
+    dates = np.array([row[0] for row in conn.execute("SELECT DISTINCT Timestamp FROM grouped_daily_data ORDER BY Timestamp")], dtype=np.int64)
+    building = path + '.building'
+    shutil.rmtree(building, ignore_errors=True)
+    store = create_store(building, tickers, dates, version)
+
+    cursor = conn.execute(f"SELECT Ticker, Timestamp, {', '.join(FIELDS)} FROM grouped_daily_data")
+    while True:
+        chunk = cursor.fetchmany(chunk_rows)
+        if not chunk:
+            break
+        frame = pd.DataFrame(chunk, columns=['Ticker', 'Timestamp', *FIELDS])
+        rows_at = np.searchsorted(store.dates, frame['Timestamp'].to_numpy(dtype=np.int64))
+        columns_at = frame['Ticker'].map(store.ticker_index).to_numpy()
+        for field in FIELDS:
+            store.arrays[field][rows_at, columns_at] = frame[field].to_numpy(dtype=np.float32, na_value=np.nan)
+    store.save()
+    del store
+
+    if os.path.exists(path):
+        shutil.rmtree(path + '.old', ignore_errors=True)
+        os.replace(path, path + '.old')
+        os.replace(building, path)
+        shutil.rmtree(path + '.old', ignore_errors=True)
+    else:
+        os.replace(building, path)
+    _cache['key'] = None
+    return ColumnStore(path)
+
+def open_store(conn: sqlite3.Connection | None = None, path: str = STORE_DIR) -> ColumnStore | None:
+    """The read-only store, or None when it is absent or behind grouped_daily_data (callers fall back to SQLite).
+
+    The store is current when it mirrored grouped_daily_data's change counter
+    at its last write, so backfilled or corrected sessions count as well as new ones.
+    """
+    meta_path = os.path.join(path, 'meta.json')
+    try:
+        key = (os.path.abspath(path), os.stat(meta_path).st_mtime_ns)
+    except FileNotFoundError:
+        return None
+    if _cache['key'] != key:
+        try:
+            _cache['store'] = ColumnStore(path)
+        except FileNotFoundError:
+            return None # A writer replaced the files between reading meta.json and mapping them
+        _cache['key'] = key
+    store = _cache['store']
+    if conn is not None:
+        version = table_version(conn, 'grouped_daily_data')
+        if version is None or store.version != version:
+            return None
+    return store
+
+def last_bars(store: ColumnStore, tickers, bars: int) -> tuple[np.ndarray, np.ndarray]:
+    """Each ticker's last `bars` present bars as (tickers x bars x fields) float values plus a presence mask.
+
+    Bars are packed to the front of each row, oldest first, like the SQLite
+    window query. Only the trailing sessions needed are touched.
+    """
+    columns, known = store.columns(tickers)
+    n_dates = len(store.dates)
+    rows = min(n_dates, bars * 2)
+    while True:
+        # Gaps mean a ticker's last `bars` bars can reach further back; widen until they fit
+        present = ~np.isnan(store.tail('Close', rows)[:, columns])
+        present[:, ~known] = False
+        counts = present.sum(axis=0)
+        if rows >= n_dates or (counts[known] >= bars).all():
+            break
+        rows = min(n_dates, rows * 2)
+
+    # Rank present bars newest-first per ticker and keep the last `bars` of them
+    rank = np.cumsum(present[::-1], axis=0)[::-1]
+    take = present & (rank <= bars)
+    source_rows, slots = np.nonzero(take)
+    kept = np.minimum(counts, bars)
+    positions = kept[slots] - rank[source_rows, slots]
+
+    values = np.full((len(columns), bars, len(FIELDS)), np.nan)
+    mask = np.zeros((len(columns), bars), dtype=bool)
+    for i, field in enumerate(FIELDS):
+        values[slots, positions, i] = store.tail(field, rows)[source_rows, columns[slots]]
+    mask[slots, positions] = True
+    return values, mask
+
+def bars_since(store: ColumnStore, tickers, start_ts: dict) -> pd.DataFrame:
+    """Long (Ticker, Timestamp, field...) rows for each ticker from its start timestamp (all history if absent)."""
+    columns, known = store.columns(tickers)
+    starts = np.array([start_ts.get(ticker) or 0 for ticker in tickers], dtype=np.int64)
+    first_row = np.searchsorted(store.dates, starts).min() if len(starts) else 0
+    present = ~np.isnan(store.field('Close')[first_row:, columns])
+    present &= store.dates[first_row:, None] >= starts[None, :]
+    present[:, ~known] = False
+    rows, slots = np.nonzero(present)
+    frame = pd.DataFrame({
+        'Ticker': np.asarray(tickers, dtype=object)[slots],
+        'Timestamp': store.dates[first_row + rows],
+    })
+    for field in FIELDS:
+        frame[field] = store.field(field)[first_row + rows, columns[slots]].astype(float)
+    return frame
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the memory-mapped columnar OHLCV store from SQLite")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--path', default=STORE_DIR)
+    args = parser.parse_args()
+    with connect(args.db) as conn:
+        store = build_from_sqlite(conn, args.path)
+    print(f"Built {args.path}: {len(store.dates)} sessions x {len(store.tickers)} tickers")
+
+if __name__ == '__main__':
+    main()
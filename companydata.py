@@ -1,15 +1,23 @@
 import yfinance as yf
-import sqlite3
 import requests
 from concurrent.futures import ThreadPoolExecutor, as_completed
+from datetime import datetime, timedelta
+import argparse
 import logging
-import time  # Import the time module
+
+import instrument
+from db import connect
+from ratelimit import AdaptiveRateLimiter
+from featureindex import ensure_version_triggers
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 
 url = 'https://raw.githubusercontent.com/rreichel3/US-Stock-Symbols/main/all/all_tickers.txt'
 DB_NAME = 'tradeapp.db'
+REQUESTS_PER_MINUTE = 60 # Starting rate; the limiter adapts to what Yahoo tolerates
+WRITE_BATCH_SIZE = 100 # Rows per commit from the writer
+MAX_RETRIES = 3
 # Removed API key as it's not used and should not be in code.
 
 
@@ -40,10 +48,15 @@ def create_table(conn):
         revenue_growth REAL,
         earnings_growth REAL,
         feature_vector TEXT,
+        last_updated TEXT,
         PRIMARY KEY (Ticker)
     )
     ''')
+    columns = {row[1] for row in cursor.execute("PRAGMA table_info(stock_data)")}
+    if 'last_updated' not in columns:
+        cursor.execute("ALTER TABLE stock_data ADD COLUMN last_updated TEXT")
     conn.commit()
+    ensure_version_triggers(conn)
 
 def safe_get(info, key, default=None):
     try:
@@ -52,22 +65,40 @@ def safe_get(info, key, default=None):
     except:
         return default
 
-def ticker_exists(conn, ticker_symbol):
-    cursor = conn.cursor()
-    cursor.execute("SELECT 1 FROM stock_data WHERE Ticker = ?", (ticker_symbol,))
-    return cursor.fetchone() is not None
-
-def insert_stock_data(ticker_symbol):
-    try:
-        with sqlite3.connect(DB_NAME) as conn:
-            if ticker_exists(conn, ticker_symbol):
-                logging.info(f"Ticker {ticker_symbol} already exists in database. Skipping.")
-                return ticker_symbol, None
-
-            tick = yf.Ticker(ticker_symbol)
-            time.sleep(10)  # Add a delay to avoid rate limiting
-            info = tick.info
+def existing_tickers(conn, stale_before=None):
+    """Tickers already in stock_data, read in one query.
 
+    With stale_before (ISO timestamp), rows last updated before it (or never) are
+    left out so they get fetched again.
+    """
+    cursor = conn.cursor()
+    if stale_before is None:
+        cursor.execute("SELECT Ticker FROM stock_data")
+    else:
+        cursor.execute("SELECT Ticker FROM stock_data WHERE last_updated >= ?", (stale_before,))
+    return {row[0] for row in cursor.fetchall()}
+
+def is_rate_limited(error):
+    message = str(error)
+    return type(error).__name__ == 'YFRateLimitError' or '429' in message or 'Too Many Requests' in message
+
+@instrument.stage('fetch')
+def fetch_stock_data(ticker_symbol, limiter):
+    """Fetch one ticker's fundamentals, throttled by the shared limiter. Runs on a fetch thread."""
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire()
+        instrument.count('api_calls')
+        try:
+            info = yf.Ticker(ticker_symbol).info
+        except Exception as e:
+            if is_rate_limited(e):
+                limiter.throttled()
+                logging.warning(f"Rate limited on {ticker_symbol}; backing off to {limiter.rate:.1f} requests/min")
+                continue
+            return ticker_symbol, None, str(e)
+        limiter.succeeded()
+
+        try:
             data = {
                 'Ticker': ticker_symbol,
                 'short_interest': safe_get(info, 'shortPercentOfFloat', 0) * 100,
@@ -80,43 +111,79 @@ def insert_stock_data(ticker_symbol):
                 'share_float': safe_get(info, 'floatShares', 0),
                 'revenue_growth': safe_get(info, 'revenueGrowth', 0) * 100,
                 'earnings_growth': safe_get(info, 'earningsGrowth', 0) * 100,
+                'last_updated': datetime.now().isoformat(timespec='seconds'),
             }
-
-            columns = ', '.join(data.keys())
-            placeholders = ':' + ', :'.join(data.keys())
-
-            cursor = conn.cursor()
-            cursor.execute(f'''
-            INSERT OR REPLACE INTO stock_data
-            ({columns})
+        except Exception as e:
+            return ticker_symbol, None, str(e)
+        return ticker_symbol, data, None
+    return ticker_symbol, None, "rate limited"
+
+STOCK_COLUMNS = [
+    'Ticker', 'short_interest', 'Industry', 'Sector', 'market_cap', 'company_name', 'summary',
+    'analyst_opinions', 'share_float', 'revenue_growth', 'earnings_growth', 'last_updated',
+]
+
+def write_stock_data(conn, rows):
+    """Upsert a batch of rows in one transaction, keeping columns we don't fetch (feature_vector)."""
+    columns = ', '.join(STOCK_COLUMNS)
+    placeholders = ':' + ', :'.join(STOCK_COLUMNS)
+    updates = ', '.join(f"{column} = excluded.{column}" for column in STOCK_COLUMNS[1:])
+    instrument.count('rows_written', len(rows))
+    with instrument.stage('write'), conn:
+        conn.executemany(f'''
+            INSERT INTO stock_data ({columns})
             VALUES ({placeholders})
-            ''', data)
-            conn.commit()
-
-        logging.info(f"Data for {ticker_symbol} inserted successfully.")
-        return ticker_symbol, None
-    except Exception as e:
-        logging.error(f"Error inserting data for {ticker_symbol}: {str(e)}")
-        return ticker_symbol, str(e)
+            ON CONFLICT(Ticker) DO UPDATE SET {updates}
+        ''', rows)
 
 def main():
+    parser = argparse.ArgumentParser(description="Collect company fundamentals into stock_data")
+    parser.add_argument('--refresh-days', type=float, default=None,
+                        help="Also re-fetch tickers whose data is older than this many days")
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--requests-per-minute', type=float, default=REQUESTS_PER_MINUTE)
+    args = parser.parse_args()
+
     tickers = get_tickers()
     if not tickers:
         return
 
-    with sqlite3.connect(DB_NAME) as conn:
-        create_table(conn)
+    conn = connect(DB_NAME)
+    create_table(conn)
+
+    stale_before = None
+    if args.refresh_days is not None:
+        stale_before = (datetime.now() - timedelta(days=args.refresh_days)).isoformat(timespec='seconds')
+    present = existing_tickers(conn, stale_before)
+    pending = [ticker for ticker in tickers if ticker not in present]
+    logging.info(f"{len(present)} tickers up to date, {len(pending)} to fetch")
+
+    limiter = AdaptiveRateLimiter(args.requests_per_minute, per=60)
+    batch = []
+    written = 0
 
-    # Use ThreadPoolExecutor for concurrent execution
-    with ThreadPoolExecutor(max_workers=10) as executor:
-        future_to_ticker = {executor.submit(insert_stock_data, ticker): ticker for ticker in tickers}
+    # Fetch threads only talk to Yahoo; this thread is the single writer
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        futures = [executor.submit(fetch_stock_data, ticker, limiter) for ticker in pending]
 
-        for future in as_completed(future_to_ticker):
-            ticker, error = future.result()
+        for future in as_completed(futures):
+            ticker, data, error = future.result()
             if error:
                 logging.error(f"Failed to process {ticker}: {error}")
-            else:
-                logging.info(f"Successfully processed {ticker}")
+                continue
+            batch.append(data)
+            if len(batch) >= WRITE_BATCH_SIZE:
+                write_stock_data(conn, batch)
+                written += len(batch)
+                logging.info(f"Wrote {written}/{len(pending)} tickers ({limiter.rate:.1f} requests/min)")
+                batch = []
+
+    if batch:
+        write_stock_data(conn, batch)
+        written += len(batch)
+    logging.info(f"Wrote {written}/{len(pending)} tickers")
+    conn.close()
 
 if __name__ == "__main__":
-    main()
+    with instrument.run('ingest.company'):
+        main()
@@ -1,75 +1,162 @@
 import pandas as pd
 import numpy as np
 from polygon import RESTClient
-import sqlite3
 import pprint
+import argparse
 
-from datetime import datetime, timedelta
-import time
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import instrument
+from db import connect
+from ratelimit import TokenBucket
+from tradingcalendar import trading_days, session_date, market_today
+from schema import migrate, upsert_bars, table_version
+from columnstore import ColumnStore, STORE_DIR, store_exists, build_from_sqlite
 
 
 client = RESTClient(api_key="YOUR_POLYGON_API_KEY_HERE")
 
-conn = sqlite3.connect('tradeapp.db')
+DEFAULT_START = "2024-01-01" # Backfill start if the database is empty
+CALLS_PER_MINUTE = 5 # Polygon free-tier quota
+MAX_IN_FLIGHT = 4 # Bound on concurrent requests (and days buffered for the writer)
+MAX_RETRIES = 3
+
+conn = connect(check_same_thread=False)
 c = conn.cursor()
 
-def store_grouped_daily_data(response):
+def create_tables():
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS grouped_daily_data (
+            Ticker TEXT,
+            Close REAL,
+            High REAL,
+            Low REAL,
+            Transactions INTEGER,
+            Open REAL,
+            Timestamp INTEGER,
+            Volume REAL,
+            VWAP REAL,
+            PRIMARY KEY (Ticker, Timestamp)
+        )
+    ''')
+    # One row per session already stored, so an interrupted backfill resumes where it left off
+    c.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='ingest_checkpoint'")
+    seed = c.fetchone() is None
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS ingest_checkpoint (
+            Date TEXT PRIMARY KEY,
+            Rows INTEGER,
+            FetchedAt TEXT
+        )
+    ''')
+    if seed:
+        # Sessions ingested before checkpoints existed count as done
+        c.execute("SELECT DISTINCT Timestamp FROM grouped_daily_data")
+        dates = {session_date(row[0]).strftime('%Y-%m-%d') for row in c.fetchall()}
+        c.executemany(
+            "INSERT OR IGNORE INTO ingest_checkpoint (Date, Rows, FetchedAt) VALUES (?, NULL, NULL)",
+            [(d,) for d in sorted(dates)],
+        )
+    conn.commit()
+    migrate(conn)
+
+def store_grouped_daily_data(response, date_str, store=None):
     """
     Store the response from the Polygon API to pull grouped daily data into the database.
+    All rows for the day and its checkpoint are written in one transaction, then
+    mirrored into the column store if one is open.
     """
     if isinstance(response, list):
-        c.execute('''
-            CREATE TABLE IF NOT EXISTS grouped_daily_data (
-                Ticker TEXT,
-                Close REAL,
-                High REAL,
-                Low REAL,
-                Transactions INTEGER,
-                Open REAL,
-                Timestamp INTEGER,
-                Volume REAL,
-                VWAP REAL,
-                PRIMARY KEY (Ticker, Timestamp)
-            )
-        ''')
-        conn.commit()
-
-        for result in response:
-            c.execute('''
+        rows = [
+            (result.ticker, result.close, result.high, result.low, result.transactions, result.open, result.timestamp, result.volume, result.vwap)
+            for result in response
+        ]
+        with instrument.stage('write'), conn:
+            c.executemany('''
                 INSERT OR IGNORE INTO grouped_daily_data (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP)
                 VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
-            ''', (result.ticker, result.close, result.high, result.low, result.transactions, result.open, result.timestamp, result.volume, result.vwap))
-        conn.commit()
-        print('ok')
+            ''', rows)
+            # The change counter went up once per inserted row, all inside this transaction
+            after = table_version(conn, 'grouped_daily_data')
+            versions = (after - max(c.rowcount, 0), after) if after is not None else None
+            upsert_bars(conn, rows)
+            # Today's bars may not be published yet; only checkpoint an empty day once it has passed
+            if rows or date_str < market_today().strftime('%Y-%m-%d'):
+                c.execute(
+                    "INSERT OR REPLACE INTO ingest_checkpoint (Date, Rows, FetchedAt) VALUES (?, ?, ?)",
+                    (date_str, len(rows), datetime.now().isoformat(timespec='seconds')),
+                )
+        instrument.count('rows_written', len(rows))
+        if store is not None:
+            with instrument.stage('store_write'):
+                store.write_bars(rows, versions)
+        print(f"{date_str}: stored {len(rows)} rows")
     else:
         print(f"Failed to retrieve data: {response}")
 
-c.execute("SELECT MAX(Timestamp) FROM grouped_daily_data")
-last_timestamp = c.fetchone()[0]
+@instrument.stage('fetch')
+def fetch_grouped_daily(date_str, limiter):
+    """Fetch one day's grouped aggregates, waiting on the shared rate limiter before every call."""
+    for attempt in range(MAX_RETRIES):
+        limiter.acquire()
+        instrument.count('api_calls')
+        try:
+            return client.get_grouped_daily_aggs(date_str)
+        except Exception as e:
+            print(f"Fetch for {date_str} failed ({e}); retry {attempt + 1} of {MAX_RETRIES}")
+    return None
+
+def pending_days(start_date, end_date):
+    """Trading sessions between start and end that have no checkpoint yet."""
+    c.execute("SELECT Date FROM ingest_checkpoint")
+    done = {row[0] for row in c.fetchall()}
+    days = [d.strftime('%Y-%m-%d') for d in trading_days(start_date, end_date)]
+    return [d for d in days if d not in done]
+
+@instrument.run('ingest.daily')
+def backfill(start_date, end_date, calls_per_minute=CALLS_PER_MINUTE, max_in_flight=MAX_IN_FLIGHT, store=None):
+    """Fetch every pending session concurrently under the rate limit; the calling thread does all writes."""
+    days = pending_days(start_date, end_date)
+    if not days:
+        print("Database is up to date.")
+        return
 
-if last_timestamp:
-    # Convert milliseconds timestamp to datetime object
-    last_datetime = datetime.fromtimestamp(last_timestamp / 1000)
-    start_date = last_datetime + timedelta(days=1) # Start from the day after the last timestamp
-    print(f"Starting data fetch from: {start_date.strftime('%Y-%m-%d')}")
-else:
-    start_date = datetime.strptime("2024-01-01", "%Y-%m-%d") # Default start date if table is empty
-    print(f"No existing data found. Starting data fetch from default start date: {start_date.strftime('%Y-%m-%d')}")
+    print(f"Fetching {len(days)} sessions from {days[0]} to {days[-1]}")
+    limiter = TokenBucket(calls_per_minute, per=60)
+    queue = iter(days)
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        in_flight = {}
+        for date_str in queue:
+            in_flight[executor.submit(fetch_grouped_daily, date_str, limiter)] = date_str
+            if len(in_flight) >= max_in_flight:
+                break
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                date_str = in_flight.pop(future)
+                store_grouped_daily_data(future.result(), date_str, store)
+                next_date = next(queue, None)
+                if next_date is not None:
+                    in_flight[executor.submit(fetch_grouped_daily, next_date, limiter)] = next_date
 
-end_date = datetime.now()
-delta = end_date - start_date
+def main():
+    parser = argparse.ArgumentParser(description="Backfill grouped daily bars from Polygon")
+    parser.add_argument('--start', default=DEFAULT_START, help="First date to backfill (YYYY-MM-DD)")
+    parser.add_argument('--end', default=None, help="Last date to backfill (YYYY-MM-DD), default today")
+    parser.add_argument('--calls-per-minute', type=float, default=CALLS_PER_MINUTE)
+    parser.add_argument('--max-in-flight', type=int, default=MAX_IN_FLIGHT)
+    parser.add_argument('--columnstore', action='store_true',
+                        help=f"Build the memory-mapped column store in {STORE_DIR}/ if missing (it is kept in sync once it exists)")
+    args = parser.parse_args()
 
-if delta.days >= 0: # Only fetch if start_date is before end_date
-    api_call_count = 0
-    for i in range(delta.days + 1):
-        date_str = (start_date + timedelta(days=i)).strftime("%Y-%m-%d")
-        print(f"Fetching data for: {date_str}")
-        grouped = client.get_grouped_daily_aggs(date_str)
-        store_grouped_daily_data(grouped)
-        api_call_count += 1
-        if api_call_count % 5 == 0 and i != delta.days:
-            print("Pausing for 60 seconds to respect API rate limits...")
-            time.sleep(60)
-else:
-    print("Database is up to date.")
+    create_tables()
+    if args.columnstore and not store_exists():
+        build_from_sqlite(conn)
+    store = ColumnStore(STORE_DIR, mode='r+') if store_exists() else None
+    start_date = datetime.strptime(args.start, "%Y-%m-%d").date()
+    end_date = datetime.strptime(args.end, "%Y-%m-%d").date() if args.end else market_today()
+    backfill(start_date, end_date, args.calls_per_minute, args.max_in_flight, store)
 
+if __name__ == "__main__":
+    main()
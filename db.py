@@ -0,0 +1,89 @@
+import contextlib
+import os
+import sqlite3
+import threading
+
+DB_NAME = 'tradeapp.db'
+
+BUSY_TIMEOUT = 30.0 # Seconds a connection waits on another process's write lock before "database is locked"
+CACHE_SIZE_KIB = 64 * 1024 # Page cache per connection
+MMAP_SIZE = 1 << 30 # Bytes of the file read through the memory map instead of read() calls
+CACHED_STATEMENTS = 256 # Prepared statements kept per connection
+
+# Paths already switched to WAL by this process
+_wal_paths: set = set()
+# Per-thread read-only handles, keyed by (pid, path) so a forked worker never reuses its parent's
+_readers = threading.local()
+# The process's single writable handle per path, and the lock that serializes its users
+_writers: dict = {}
+_writers_lock = threading.Lock()
+
+def _tune(conn: sqlite3.Connection, read_only: bool) -> None:
+    conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute(f"PRAGMA mmap_size = {MMAP_SIZE}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+    if not read_only:
+        # In WAL mode NORMAL only syncs at checkpoints; a power loss can drop the last commits but not corrupt the file
+        conn.execute("PRAGMA synchronous = NORMAL")
+
+def connect(path: str = DB_NAME, read_only: bool = False, check_same_thread: bool = True) -> sqlite3.Connection:
+    """A tuned connection to the database; writable ones also switch the file to WAL.
+
+    WAL lets readers run while a writer commits, so scans don't wait on ingest.
+    Only another writer does, for up to BUSY_TIMEOUT.
+    """
+    if read_only:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread, cached_statements=CACHED_STATEMENTS)
+    else:
+        conn = sqlite3.connect(path, timeout=BUSY_TIMEOUT, check_same_thread=check_same_thread, cached_statements=CACHED_STATEMENTS)
+        key = os.path.abspath(path)
+        if key not in _wal_paths:
+            # journal_mode is stored in the file, so this only changes anything the first time
+            conn.execute("PRAGMA journal_mode = WAL")
+            _wal_paths.add(key)
+    _tune(conn, read_only)
+    return conn
+
+def reader(path: str = DB_NAME) -> sqlite3.Connection:
+    """This thread's read-only handle, opened on first use in each process (pool workers get their own)."""
+    key = (os.getpid(), os.path.abspath(path))
+    handles = getattr(_readers, 'handles', None)
+    if handles is None:
+        handles = _readers.handles = {}
+    if key not in handles:
+        handles[key] = connect(path, read_only=True)
+    return handles[key]
+
+@contextlib.contextmanager
+def writer(path: str = DB_NAME, timeout: float | None = None):
+    """The process's single writable handle, held by one thread at a time for one transaction.
+
+    `with writer() as conn:` commits on exit (rolls back on an exception). The
+    transaction starts IMMEDIATE so a competing writer waits here rather than
+    failing midway. `timeout` overrides BUSY_TIMEOUT for writes that would
+    rather be skipped than wait, e.g. cache updates during an ingest.
+    """
+    key = (os.getpid(), os.path.abspath(path))
+    with _writers_lock:
+        if key not in _writers:
+            _writers[key] = (connect(path, check_same_thread=False), threading.RLock())
+        conn, lock = _writers[key]
+    with lock:
+        if timeout is not None:
+            conn.execute(f"PRAGMA busy_timeout = {int(timeout * 1000)}")
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.rollback()
+                raise
+            conn.commit()
+        finally:
+            if timeout is not None:
+                conn.execute(f"PRAGMA busy_timeout = {int(BUSY_TIMEOUT * 1000)}")
+
+def database_path(conn: sqlite3.Connection) -> str:
+    """File behind a connection's main database."""
+    return next(row[2] for row in conn.execute("PRAGMA database_list") if row[1] == 'main')
@@ -0,0 +1,173 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import time
+
+import numpy as np
+
+import instrument
+from db import writer, database_path
+from lowerbound import TopK
+
+# Eviction limits: entries unused for MAX_AGE_DAYS go, then the least recently used beyond MAX_ROWS
+MAX_ROWS = 500_000
+MAX_AGE_DAYS = 7
+# Cache writes give up after this long rather than stall a scan behind an ingest's write lock,
+# then aren't attempted again for WRITE_BACKOFF seconds
+WRITE_TIMEOUT = 1.0
+WRITE_BACKOFF = 30.0
+_skip_writes_until = [0.0]
+
+def ensure_dtw_cache(conn: sqlite3.Connection) -> None:
+    """Distances keyed by the ticker's last bar, what it was compared with and how.
+
+    exact = 1 rows hold the distance; exact = 0 rows hold a lower bound left by a
+    pruned top-k scan, enough to prune the ticker again without any DTW.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS dtw_cache (
+            ticker TEXT,
+            last_ts INTEGER,
+            key TEXT,
+            params TEXT,
+            distance REAL,
+            template TEXT,
+            exact INTEGER,
+            used_at REAL,
+            PRIMARY KEY (ticker, last_ts, key, params)
+        )
+        """
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_dtw_cache_used ON dtw_cache (used_at)")
+    conn.commit()
+
+def array_key(array: np.ndarray) -> str:
+    """Hash of one window (e.g. the target ticker's)."""
+    array = np.ascontiguousarray(array, dtype=float)
+    return hashlib.sha1(str(array.shape).encode() + array.tobytes()).hexdigest()
+
+def params_key(**params) -> str:
+    return json.dumps(params, sort_keys=True)
+
+def last_timestamps(conn: sqlite3.Connection, tickers) -> dict[str, int]:
+    """Each ticker's newest bar Timestamp, which identifies its current window."""
+    rows = conn.execute("SELECT Ticker, Timestamp FROM latest_snapshot").fetchall()
+    wanted = set(tickers)
+    return {ticker: ts for ticker, ts in rows if ticker in wanted and ts is not None}
+
+@instrument.stage('cache_lookup')
+def lookup(conn: sqlite3.Connection, last_ts: dict[str, int], key: str, params: str) -> dict[str, tuple]:
+    """Cached (distance, template, exact) per ticker for its current last bar, read in one join.
+
+    The tickers are bound as one JSON object, so the lookup is a plain read that
+    leaves any transaction open on `conn` alone. Hits are marked used so they
+    survive LRU eviction (skipped if the database is busy).
+    """
+    rows = conn.execute(
+        """
+        SELECT c.ticker, c.distance, c.template, c.exact FROM json_each(?) p
+        JOIN dtw_cache c ON c.ticker = p.key AND c.last_ts = p.value AND c.key = ? AND c.params = ?
+        """,
+        (json.dumps(last_ts), key, params),
+    ).fetchall()
+    now = time.time()
+    _write(conn, "UPDATE dtw_cache SET used_at = ? WHERE ticker = ? AND last_ts = ? AND key = ? AND params = ?",
+           [(now, ticker, last_ts[ticker], key, params) for ticker, distance, template, exact in rows])
+    return {ticker: (distance if distance is not None else float('inf'), template, bool(exact)) for ticker, distance, template, exact in rows}
+
+@instrument.stage('cache_store')
+def store(conn: sqlite3.Connection, last_ts: dict[str, int], key: str, params: str, rows) -> None:
+    """Save (ticker, template, distance, exact) rows for the tickers' current last bars."""
+    now = time.time()
+    _write(
+        conn,
+        """
+        INSERT OR REPLACE INTO dtw_cache (ticker, last_ts, key, params, distance, template, exact, used_at)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        [
+            (ticker, last_ts[ticker], key, params, distance, template, int(exact), now)
+            for ticker, template, distance, exact in rows if ticker in last_ts
+        ],
+    )
+
+def _write(conn: sqlite3.Connection, sql: str, rows) -> bool:
+    """Run a cache write on the process's writer handle; the cache is best effort, so a busy database skips it."""
+    rows = list(rows)
+    if not rows or time.time() < _skip_writes_until[0]:
+        return not rows
+    try:
+        with writer(database_path(conn), timeout=WRITE_TIMEOUT) as handle:
+            handle.executemany(sql, rows)
+    except sqlite3.OperationalError as error:
+        _skip_writes_until[0] = time.time() + WRITE_BACKOFF
+        logging.warning(f"Skipped writing {len(rows)} dtw_cache rows ({error}); cache writes paused for {WRITE_BACKOFF:.0f}s")
+        return False
+    return True
+
+def evict(conn: sqlite3.Connection, max_rows: int = MAX_ROWS, max_age_days: float = MAX_AGE_DAYS) -> int:
+    """Drop stale entries, then the least recently used beyond max_rows. Returns rows deleted (0 if the database is busy)."""
+    if time.time() < _skip_writes_until[0]:
+        return 0
+    try:
+        with writer(database_path(conn), timeout=WRITE_TIMEOUT) as handle:
+            deleted = handle.execute("DELETE FROM dtw_cache WHERE used_at < ?", (time.time() - max_age_days * 86400,)).rowcount
+            excess = handle.execute("SELECT COUNT(*) FROM dtw_cache").fetchone()[0] - max_rows
+            if excess > 0:
+                deleted += handle.execute(
+                    "DELETE FROM dtw_cache WHERE rowid IN (SELECT rowid FROM dtw_cache ORDER BY used_at LIMIT ?)", (excess,)
+                ).rowcount
+    except sqlite3.OperationalError as error:
+        _skip_writes_until[0] = time.time() + WRITE_BACKOFF
+        logging.warning(f"Skipped dtw_cache eviction: {error}")
+        return 0
+    return deleted
+
+def cached_results(conn: sqlite3.Connection, stock_list, key: str, params: str, compute, top_k=None, on_progress=None, stats=None):
+    """Exhaustive scan through the cache: look every ticker up, compute only the misses.
+
+    `compute(tickers)` yields lists of (ticker, template, distance) rows as chunks
+    finish; each list is stored as it arrives. Without top_k every ticker's row is
+    returned in stock_list order. With top_k only the top_k finite distances are
+    kept, in a bounded heap, and returned closest first (ties in stock_list order).
+    on_progress(done, total, top) is called after the lookup and after every chunk;
+    stats, if given, counts tickers served from the cache and computed.
+    """
+    last_ts = last_timestamps(conn, stock_list)
+    hits = {ticker: hit for ticker, hit in lookup(conn, last_ts, key, params).items() if hit[2]}
+    misses = [ticker for ticker in stock_list if ticker not in hits]
+    position = {ticker: i for i, ticker in enumerate(stock_list)}
+    ranking = TopK(top_k) if top_k else None
+    rows = {}
+
+    def add(batch):
+        for ticker, template, distance in batch:
+            if ranking is None:
+                rows[ticker] = (template, distance)
+            elif distance != float('inf'):
+                ranking.push((distance, position[ticker], ticker, template))
+
+    def report(done):
+        if on_progress is not None:
+            top = [(ticker, template, distance) for distance, index, ticker, template in ranking.rows()] if ranking else []
+            on_progress(done, len(stock_list), top)
+
+    add((ticker, template, distance) for ticker, (distance, template, exact) in hits.items())
+    done = len(hits)
+    report(done)
+    if misses:
+        for batch in compute(misses):
+            store(conn, last_ts, key, params, [(ticker, template, distance, True) for ticker, template, distance in batch])
+            add(batch)
+            done += len(batch)
+            report(done)
+    if stats is not None:
+        stats['candidates'] += len(stock_list)
+        stats['cached'] += len(hits)
+        stats['full_dtw'] += done - len(hits)
+
+    if ranking is not None:
+        return [(ticker, template, distance) for distance, index, ticker, template in ranking.rows()]
+    return [(ticker, *rows[ticker]) for ticker in stock_list if ticker in rows]
@@ -0,0 +1,175 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+from dtaidistance import dtw_ndim
+
+import instrument
+from subsequence import open_begin_distance
+from windowloader import suffix_window
+
+# dtaidistance logs every matrix call at INFO, which floods the batch jobs' logs
+logging.getLogger('be.kuleuven.dtai.distance').setLevel(logging.WARNING)
+
+# dtaidistance ships its C extension as an optional build; without it every call takes the Python path
+try:
+    from dtaidistance import dtw_cc # noqa: F401
+    C_AVAILABLE = True
+except ImportError:
+    C_AVAILABLE = False
+
+def dtw_options(window: int = 0, max_dist: float = 0, psi: int = 0) -> dict:
+    """Scan options for dtaidistance; zero means unset. An empty dict is plain DTW.
+
+    window: Sakoe-Chiba band in bars. max_dist: distances beyond it come back inf.
+    psi: bars at either end that may be skipped for free (psi-relaxation).
+    """
+    options = {'window': int(window), 'max_dist': float(max_dist), 'psi': int(psi)}
+    return {name: value for name, value in options.items() if value}
+
+def engine_name() -> str:
+    return "dtaidistance C (batched)" if C_AVAILABLE else "dtaidistance Python (C extension not built)"
+
+def _valid(series) -> bool:
+    return len(series) >= 2
+
+def distance(a: np.ndarray, b: np.ndarray, **options) -> float:
+    """One multivariate DTW distance, in C when available; inf if either series has fewer than 2 bars."""
+    if not _valid(a) or not _valid(b):
+        return float('inf')
+    # Called once per candidate by the top-k cascade, so only counted; its caller times the search
+    instrument.count('dtw_calls')
+    a, b = np.ascontiguousarray(a, dtype=np.double), np.ascontiguousarray(b, dtype=np.double)
+    if C_AVAILABLE:
+        return dtw_ndim.distance_fast(a, b, **options)
+    return dtw_ndim.distance(a, b, **options)
+
+def many_to_many(queries: list, series: list, parallel: bool = False, **options) -> np.ndarray:
+    """(queries x series) DTW distances from one batched call; inf where either side has fewer than 2 bars.
+
+    Only the queries-by-series block of the matrix is computed. Leave parallel
+    off inside pool workers so OpenMP threads don't oversubscribe the cores.
+    """
+    result = np.full((len(queries), len(series)), np.inf)
+    rows = [i for i, query in enumerate(queries) if _valid(query)]
+    columns = [j for j, item in enumerate(series) if _valid(item)]
+    if not rows or not columns:
+        return result
+    batch = [np.ascontiguousarray(queries[i], dtype=np.double) for i in rows]
+    batch += [np.ascontiguousarray(series[j], dtype=np.double) for j in columns]
+    block = ((0, len(rows)), (len(rows), len(batch)))
+    instrument.count('dtw_calls')
+    instrument.count('dtw_pairs', len(rows) * len(columns))
+    # compact returns just the block, row by row, instead of the full square matrix
+    with instrument.stage('dtw'):
+        if C_AVAILABLE:
+            block_values = dtw_ndim.distance_matrix_fast(batch, block=block, compact=True, parallel=parallel, **options)
+        else:
+            block_values = dtw_ndim.distance_matrix(batch, block=block, compact=True, **options)
+    result[np.ix_(rows, columns)] = np.asarray(block_values).reshape(len(rows), len(columns))
+    return result
+
+def one_to_many(query: np.ndarray, series: list, parallel: bool = False, **options) -> np.ndarray:
+    """DTW distances from one query to every series, in one batched call."""
+    return many_to_many([query], series, parallel, **options)[0]
+
+def best_suffixes(query: np.ndarray, tails: list, min_length: int, max_length: int, parallel: bool = False, **options) -> list:
+    """open_begin_distance for every tail: (distance, length) of its best-matching suffix.
+
+    In C, every candidate suffix of every tail (first bar reset, as the window
+    loader would load it) is scored against the query in one batched call; the
+    shortest length wins ties, as in the single-pass DP. The Python fallback
+    keeps the single-pass DP unless options are set, which it does not support.
+    """
+    if not C_AVAILABLE and not options:
+        instrument.count('dtw_calls', len(tails))
+        with instrument.stage('dtw'):
+            return [open_begin_distance(query, tail, min_length, max_length) for tail in tails]
+
+    windows, owners, lengths = [], [], []
+    for i, tail in enumerate(tails):
+        m = min(len(tail), max_length)
+        for length in range(max(min(min_length, m), 2), m + 1):
+            windows.append(suffix_window(tail, length))
+            owners.append(i)
+            lengths.append(length)
+    best = [(float('inf'), 0)] * len(tails)
+    if not _valid(query) or not windows:
+        return best
+    for owner, length, dist in zip(owners, lengths, one_to_many(query, windows, parallel, **options)):
+        if dist < best[owner][0]:
+            best[owner] = (float(dist), length)
+    return best
+
+# --- Benchmark ---
+def _max_error(a, b) -> float:
+    """Largest absolute difference, counting matching infinities (max_dist cut-offs) as agreement."""
+    a, b = np.asarray(a, dtype=float), np.asarray(b, dtype=float)
+    differ = a != b
+    return float(np.max(np.abs(a[differ] - b[differ]), initial=0))
+
+def _python_suffixes(query, tails, min_length, max_length, **options) -> list:
+    """Per-suffix Python DTW with the given options: (distance, length) of each tail's best suffix, shortest first on ties."""
+    best = []
+    for tail in tails:
+        m = min(len(tail), max_length)
+        candidates = [(dtw_ndim.distance(query, suffix_window(tail, length), **options), length) for length in range(max(min(min_length, m), 2), m + 1)]
+        best.append(min(candidates, default=(float('inf'), 0)))
+    return best
+
+def benchmark(n_series: int = 2000, bars: int = 9, tail_bars: int = 15, seed: int = 0, **options) -> dict:
+    """Seconds taken by the per-pair Python path, per-pair C calls and the batched engine on random windows.
+
+    Also checks that every path returns the same distances. Every path runs
+    with the given options. The suffix search's reference is the single-pass
+    DP for plain DTW, and the per-suffix Python path otherwise (the DP
+    supports no options).
+    """
+    rng = np.random.default_rng(seed)
+    query = rng.normal(0, 0.03, (bars, 6))
+    windows = [rng.normal(0, 0.03, (bars, 6)) for _ in range(n_series)]
+    tails = [rng.normal(0, 0.03, (tail_bars, 6)) for _ in range(n_series)]
+
+    timings = {}
+    start = time.perf_counter()
+    python = np.array([dtw_ndim.distance(query, window, **options) for window in windows])
+    timings['python_pairs'] = time.perf_counter() - start
+    if C_AVAILABLE:
+        start = time.perf_counter()
+        pairs = np.array([dtw_ndim.distance_fast(query, window, **options) for window in windows])
+        timings['c_pairs'] = time.perf_counter() - start
+        timings['c_pairs_max_error'] = _max_error(pairs, python)
+    start = time.perf_counter()
+    batched = one_to_many(query, windows, **options)
+    timings['batched'] = time.perf_counter() - start
+    timings['batched_max_error'] = _max_error(batched, python)
+
+    start = time.perf_counter()
+    if options:
+        reference = _python_suffixes(query, tails, 7, tail_bars, **options)
+        timings['suffix_python'] = time.perf_counter() - start
+    else:
+        reference = [open_begin_distance(query, tail, 7, tail_bars) for tail in tails]
+        timings['suffix_single_pass'] = time.perf_counter() - start
+    start = time.perf_counter()
+    suffixes = best_suffixes(query, tails, 7, tail_bars, **options)
+    timings['suffix_batched'] = time.perf_counter() - start
+    timings['suffix_max_error'] = _max_error([a[0] for a in reference], [b[0] for b in suffixes])
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the batched DTW engine against the per-pair path")
+    parser.add_argument('--series', type=int, default=2000, help="Windows compared with one query")
+    parser.add_argument('--window', type=int, default=0)
+    parser.add_argument('--max-dist', type=float, default=0)
+    parser.add_argument('--psi', type=int, default=0)
+    args = parser.parse_args()
+
+    options = dtw_options(args.window, args.max_dist, args.psi)
+    print(f"Engine: {engine_name()}; options: {options or 'plain DTW'}")
+    for name, value in benchmark(args.series, **options).items():
+        print(f"  {name:<20} {value:.6f}" + ("" if 'error' in name else " s"))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+import sqlite3
+
+import numpy as np
+
+from schema import ensure_table_version, table_version
+from featurevector import FEATURE_NAMES, CATEGORICAL_ENCODERS, load_feature_vectors, load_vocabulary
+
+# Bucketed features are ordinal, so "within ±n buckets" is meaningful; categorical ones only match exactly
+ORDINAL_FEATURES = ['short_interest', 'market_cap', 'share_float']
+
+MARKET_CAP_LABELS = {0: 'Unknown', 1: '< $1B', 2: '$1B-10B', 3: '$10B-50B', 4: '$50B-200B', 5: '> $200B'}
+
+_cache: dict = {'version': None, 'index': None}
+
+def ensure_version_triggers(conn: sqlite3.Connection) -> None:
+    """Maintain a change counter for stock_data so cached indexes know when to rebuild."""
+    ensure_table_version(conn, 'stock_data')
+    conn.commit()
+
+def _stock_data_version(conn: sqlite3.Connection) -> int | None:
+    """The stock_data change counter, or None when the triggers are not installed."""
+    return table_version(conn, 'stock_data')
+
+class FeatureIndex:
+    """In-memory index over the encoded stock_data feature vectors."""
+
+    def __init__(self, tickers: list[str], vectors: np.ndarray, vocabulary: dict[str, dict[str, int]]):
+        self.tickers = np.array(tickers, dtype=object)
+        self.vectors = vectors
+        self.rows = {ticker: i for i, ticker in enumerate(tickers)}
+        self.vocabulary = vocabulary
+        self.column = {name: i for i, name in enumerate(FEATURE_NAMES)}
+
+    def __contains__(self, ticker: str) -> bool:
+        return ticker in self.rows
+
+    def vector(self, ticker: str) -> dict[str, int]:
+        return dict(zip(FEATURE_NAMES, self.vectors[self.rows[ticker]].tolist()))
+
+    def mask(self, like: str | None = None, same: tuple = (), near: dict | None = None, **codes) -> np.ndarray:
+        """Rows matching every condition.
+
+        `same` lists features that must equal the `like` ticker's; `near` maps
+        ordinal features to a bucket tolerance around `like`'s; keyword codes
+        (e.g. Sector=3 or Sector=[3, 5]) match explicit values.
+        """
+        mask = np.ones(len(self.tickers), dtype=bool)
+        reference = self.vectors[self.rows[like]] if like is not None else None
+        for name in same:
+            mask &= self.vectors[:, self.column[name]] == reference[self.column[name]]
+        for name, tolerance in (near or {}).items():
+            if name not in ORDINAL_FEATURES:
+                raise ValueError(f"{name} is categorical; use same= instead of near=")
+            mask &= np.abs(self.vectors[:, self.column[name]] - reference[self.column[name]]) <= tolerance
+        for name, values in codes.items():
+            mask &= np.isin(self.vectors[:, self.column[name]], np.atleast_1d(values))
+        return mask
+
+    def query(self, **conditions) -> list[str]:
+        """Tickers matching the conditions (see mask)."""
+        return self.tickers[self.mask(**conditions)].tolist()
+
+    def restrict(self, tickers: list[str], **conditions) -> list[str]:
+        """Keep the tickers (in their original order) that match; unencoded tickers are dropped."""
+        allowed = set(self.query(**conditions))
+        return [ticker for ticker in tickers if ticker in allowed]
+
+    def rank(self, tickers: list[str], like: str) -> list[str]:
+        """Order tickers by fundamental closeness to `like`: categorical mismatches, then bucket distance."""
+        reference = self.vectors[self.rows[like]].astype(int)
+        known = [ticker for ticker in tickers if ticker in self.rows]
+        vectors = self.vectors[[self.rows[ticker] for ticker in known]].astype(int)
+        categorical = [self.column[name] for name in CATEGORICAL_ENCODERS]
+        ordinal = [self.column[name] for name in ORDINAL_FEATURES]
+        mismatches = (vectors[:, categorical] != reference[categorical]).sum(axis=1)
+        distance = np.abs(vectors[:, ordinal] - reference[ordinal]).sum(axis=1)
+        order = np.lexsort((distance, mismatches))
+        unknown = [ticker for ticker in tickers if ticker not in self.rows]
+        return [known[i] for i in order] + unknown
+
+def get_feature_index(conn: sqlite3.Connection) -> FeatureIndex:
+    """Return the cached index, rebuilding it only when stock_data has changed since the last build.
+
+    Without the version triggers there is nothing to compare, so the index is rebuilt on every call.
+    """
+    version = _stock_data_version(conn)
+    if _cache['index'] is not None and version is not None and _cache['version'] == version:
+        return _cache['index']
+
+    if conn.execute("SELECT 1 FROM sqlite_master WHERE type='table' AND name='stock_data'").fetchone() is None:
+        tickers, vectors = [], np.empty((0, len(FEATURE_NAMES)), dtype=np.int16)
+    else:
+        tickers, vectors = load_feature_vectors(conn)
+    load_vocabulary(conn)
+    vocabulary = {kind: dict(mapping) for kind, mapping in CATEGORICAL_ENCODERS.items()}
+    _cache['index'] = FeatureIndex(tickers, vectors, vocabulary)
+    _cache['version'] = version
+    return _cache['index']
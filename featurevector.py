@@ -1,11 +1,20 @@
 import sqlite3
 import json
 
+import numpy as np
+import pandas as pd
+
+from db import connect
+
 DB_NAME = 'tradeapp.db'
 
 industry_encoder: dict[str, int] = {}
 sector_encoder: dict[str, int] = {}
 
+# Order of the encoded vector; also the column order of load_feature_vectors
+FEATURE_NAMES = ['short_interest', 'Industry', 'Sector', 'market_cap', 'share_float']
+CATEGORICAL_ENCODERS = {'Industry': industry_encoder, 'Sector': sector_encoder}
+
 def _encode_categorical(value: str, mapping: dict[str, int]) -> int:
     if value not in mapping:
         mapping[value] = len(mapping) + 1
@@ -56,31 +65,101 @@ def encode_fundamentals(data: dict, buckets: dict) -> list[int]:
         _encode_bucket(data.get('share_float', 0), buckets.get('share_float', [])),
     ]
 
-def encode_all(db_path: str = DB_NAME) -> None:
-    with sqlite3.connect(db_path) as conn:
-        cursor = conn.cursor()
-        cursor.execute(
+def _encode_bucket_column(values: np.ndarray, buckets: list[tuple[float, float, int]]) -> np.ndarray:
+    """Vectorized _encode_bucket for contiguous, ascending buckets."""
+    edges = np.array([low for low, high, code in buckets] + [buckets[-1][1]], dtype=float)
+    codes = np.array([0] + [code for low, high, code in buckets] + [0])
+    # digitize gives 0 below the first bucket and len(edges) at/above the last edge or for NaN
+    return codes[np.digitize(values, edges)]
+
+def create_vocabulary(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS feature_vocab (
+            kind TEXT,
+            value TEXT,
+            code INTEGER,
+            PRIMARY KEY (kind, value)
+        )
+        """
+    )
+
+def load_vocabulary(conn: sqlite3.Connection) -> None:
+    """Fill the categorical encoders from the persisted vocabulary."""
+    create_vocabulary(conn)
+    for kind, mapping in CATEGORICAL_ENCODERS.items():
+        mapping.clear()
+        mapping.update(conn.execute("SELECT value, code FROM feature_vocab WHERE kind = ?", (kind,)).fetchall())
+
+def _encode_categorical_column(conn: sqlite3.Connection, kind: str, values: pd.Series) -> np.ndarray:
+    """Map a column to its persisted codes, appending unseen values (sorted, so codes never depend on row order)."""
+    mapping = CATEGORICAL_ENCODERS[kind]
+    new_values = sorted(set(values) - mapping.keys())
+    if new_values:
+        start = max(mapping.values(), default=0) + 1
+        added = {value: start + i for i, value in enumerate(new_values)}
+        conn.executemany(
+            "INSERT INTO feature_vocab (kind, value, code) VALUES (?, ?, ?)",
+            [(kind, value, code) for value, code in added.items()],
+        )
+        mapping.update(added)
+    return values.map(mapping).to_numpy()
+
+def encode_all(db_path: str = DB_NAME, store_blob: bool = True) -> None:
+    """Encode every stock_data row in one pass and write all vectors with one executemany.
+
+    feature_vector keeps the JSON list; with store_blob the same codes are also
+    written to feature_blob as int16 bytes for load_feature_vectors.
+    """
+    with connect(db_path) as conn:
+        load_vocabulary(conn)
+        if store_blob:
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(stock_data)")}
+            if 'feature_blob' not in columns:
+                conn.execute("ALTER TABLE stock_data ADD COLUMN feature_blob BLOB")
+
+        df = pd.read_sql_query(
             """
             SELECT Ticker, short_interest, Industry, Sector, market_cap, share_float
             FROM stock_data
-            """
+            """,
+            conn,
         )
-        rows = cursor.fetchall()
-        for row in rows:
-            ticker, short_int, industry, sector, market_cap, share_float = row
-            data = {
-                'short_interest': short_int or 0,
-                'Industry': industry or '',
-                'Sector': sector or '',
-                'market_cap': market_cap or 0,
-                'share_float': share_float or 0,
-            }
-            vector = encode_fundamentals(data, BUCKETS)
-            cursor.execute(
-                "UPDATE stock_data SET feature_vector = ? WHERE Ticker = ?",
-                (json.dumps(vector), ticker),
-            )
+        for column in ['short_interest', 'market_cap', 'share_float']:
+            df[column] = pd.to_numeric(df[column], errors='coerce').fillna(0)
+        for column in ['Industry', 'Sector']:
+            df[column] = df[column].fillna('').astype(str)
+
+        vectors = np.column_stack([
+            _encode_bucket_column(df['short_interest'].to_numpy(dtype=float), BUCKETS['short_interest']),
+            _encode_categorical_column(conn, 'Industry', df['Industry']),
+            _encode_categorical_column(conn, 'Sector', df['Sector']),
+            _encode_bucket_column(df['market_cap'].to_numpy(dtype=float), BUCKETS['market_cap']),
+            _encode_bucket_column(df['share_float'].to_numpy(dtype=float), BUCKETS['share_float']),
+        ]).astype(np.int16)
+
+        if store_blob:
+            rows = [(json.dumps(v.tolist()), v.tobytes(), t) for v, t in zip(vectors, df['Ticker'])]
+            conn.executemany("UPDATE stock_data SET feature_vector = ?, feature_blob = ? WHERE Ticker = ?", rows)
+        else:
+            rows = [(json.dumps(v.tolist()), t) for v, t in zip(vectors, df['Ticker'])]
+            conn.executemany("UPDATE stock_data SET feature_vector = ? WHERE Ticker = ?", rows)
         conn.commit()
 
+def load_feature_vectors(conn: sqlite3.Connection) -> tuple[list[str], np.ndarray]:
+    """Every encoded ticker and its vector as one (tickers x len(FEATURE_NAMES)) int16 array.
+
+    Reads feature_blob with a single frombuffer; falls back to parsing the JSON
+    column when the blobs have not been written.
+    """
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(stock_data)")}
+    if 'feature_blob' in columns:
+        rows = conn.execute("SELECT Ticker, feature_blob FROM stock_data WHERE feature_blob IS NOT NULL").fetchall()
+        vectors = np.frombuffer(b''.join(row[1] for row in rows), dtype=np.int16)
+    else:
+        rows = conn.execute("SELECT Ticker, feature_vector FROM stock_data WHERE feature_vector IS NOT NULL").fetchall()
+        vectors = np.array([json.loads(row[1]) for row in rows], dtype=np.int16)
+    return [row[0] for row in rows], vectors.reshape(len(rows), len(FEATURE_NAMES))
+
 if __name__ == '__main__':
     encode_all()
@@ -0,0 +1,208 @@
+import argparse
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from columnstore import open_store, bars_since
+from lowerbound import empty_stats, merge_stats
+from scanpool import get_pool, imap_chunks, default_workers, shutdown_pool, worker_conn, worker_templates, worker_envelopes
+from windowloader import PRICE_COLUMNS, transform_windows
+
+# Same rounding allowance as the top-k cascade: never prune a window that ties the threshold
+_SLACK = 1 + 1e-9
+
+# --- History Features ---
+def load_history(conn, ticker, store=None):
+    """A ticker's full bar history as (timestamps, features), oldest first.
+
+    Features are the scan's log returns + Vdiff computed over the whole series;
+    bars without a Vdiff are dropped, as the window loader drops them.
+    """
+    if store is not None:
+        frame = bars_since(store, [ticker], {})
+        timestamps = frame['Timestamp'].to_numpy(dtype=np.int64)
+        prices = frame[PRICE_COLUMNS].to_numpy(dtype=float)
+    else:
+        rows = conn.execute(
+            f"SELECT Timestamp, {', '.join(PRICE_COLUMNS)} FROM grouped_daily_data WHERE Ticker = ? ORDER BY Timestamp",
+            (ticker,),
+        ).fetchall()
+        bars = np.array(rows, dtype=float).reshape(len(rows), len(PRICE_COLUMNS) + 1)
+        timestamps, prices = bars[:, 0].astype(np.int64), bars[:, 1:]
+    if len(prices) == 0:
+        return timestamps, np.empty((0, len(PRICE_COLUMNS) + 1))
+    features, mask = transform_windows(prices[None], np.ones((1, len(prices)), dtype=bool))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        keep = ~np.isnan((prices[:, 4] - prices[:, 3]) / prices[:, 3])
+    return timestamps[keep], features[0][mask[0]]
+
+def _envelope_cost(series, lower, upper):
+    """Squared distance of every bar to a template envelope."""
+    above = np.clip(series - upper, 0, None)
+    below = np.clip(lower - series, 0, None)
+    return (above ** 2).sum(axis=1) + (below ** 2).sum(axis=1)
+
+def window_bounds(features, template, lower, upper, bars):
+    """LB_Kim and LB_Keogh of every `bars`-long window of the series, in O(len(series)).
+
+    A window starting at s is bars s..s+bars-1 with the first bar's log returns
+    reset to 0 (the window a LIMIT `bars` load would see). Per-bar envelope costs
+    are computed once and shared by every window covering the bar through a
+    running sum; only the reset first bar is costed separately.
+    """
+    n_windows = len(features) - bars + 1
+    reset = features.copy()
+    reset[:, :len(PRICE_COLUMNS)] = 0
+
+    cost = _envelope_cost(features, lower, upper)
+    running = np.concatenate([[0.0], np.cumsum(cost)])
+    # Bars s+1..s+bars-1 at their own cost, bar s at its reset cost
+    keogh = running[bars:bars + n_windows] - running[1:1 + n_windows] + _envelope_cost(reset[:n_windows], lower, upper)
+
+    first = ((reset[:n_windows] - template[0]) ** 2).sum(axis=1)
+    last = ((features[bars - 1:] - template[-1]) ** 2).sum(axis=1)
+    return np.sqrt(first + last), np.sqrt(keogh)
+
+def window_distances(features, template, starts, bars, threshold=float('inf')):
+    """DTW distances of the windows starting at `starts` to the template, all windows at once.
+
+    The DTW matrix is filled row by row for every window together. A bar's cost
+    against each template bar is computed once and reused by all the
+    overlapping windows that contain it. Windows whose whole row already
+    exceeds the threshold are abandoned, as every warping path crosses every row.
+
+    Returns (starts, distances) of the windows that were not abandoned.
+    """
+    limit = (threshold * _SLACK) ** 2
+    cost = ((features[:, None, :] - template[None, :, :]) ** 2).sum(axis=2)
+    reset = features[starts].copy()
+    reset[:, :len(PRICE_COLUMNS)] = 0
+
+    previous = None
+    for i in range(bars):
+        if i == 0:
+            row_cost = ((reset[:, None, :] - template[None, :, :]) ** 2).sum(axis=2)
+        else:
+            row_cost = cost[starts + i]
+        current = np.empty_like(row_cost)
+        current[:, 0] = row_cost[:, 0] + (previous[:, 0] if i else 0)
+        for j in range(1, len(template)):
+            best = current[:, j - 1] if i == 0 else np.minimum(np.minimum(previous[:, j - 1], previous[:, j]), current[:, j - 1])
+            current[:, j] = row_cost[:, j] + best
+        alive = current.min(axis=1) <= limit
+        if not alive.all():
+            starts, current = starts[alive], current[alive]
+        previous = current
+    return starts, np.sqrt(previous[:, -1])
+
+def search_series(features, template, lower, upper, threshold, bars=None):
+    """Start, end and distance of every window closer than `threshold` to the template, plus stage counts.
+
+    Windows are screened by their lower bounds, then the survivors' DTW runs
+    together and drops windows as soon as they exceed the threshold. Distances
+    equal dtw_ndim.distance on the reset window.
+    """
+    bars = bars or len(template)
+    stats = empty_stats()
+    if bars < 2 or len(template) < 2 or len(features) < bars:
+        return [], stats
+
+    kim, keogh = window_bounds(features, template, lower, upper, bars)
+    passed_kim = kim <= threshold * _SLACK
+    survivors = np.flatnonzero(passed_kim & (keogh <= threshold * _SLACK))
+    stats['candidates'] = len(kim)
+    stats['pruned_kim'] = len(kim) - int(passed_kim.sum())
+    stats['pruned_keogh'] = int(passed_kim.sum()) - len(survivors)
+
+    starts, distances = window_distances(features, template, survivors, bars, threshold)
+    stats['abandoned'] = len(survivors) - len(starts)
+    stats['full_dtw'] = len(starts)
+    return [(int(start), int(start) + bars - 1, float(distance)) for start, distance in zip(starts, distances) if distance < threshold], stats
+
+def non_overlapping(matches):
+    """Best match of every run of overlapping windows: take the closest, drop what overlaps it, repeat."""
+    taken = []
+    for start, end, distance in sorted(matches, key=lambda match: match[2]):
+        if all(end < other_start or start > other_end for other_start, other_end, d in taken):
+            taken.append((start, end, distance))
+    return sorted(taken)
+
+# --- Worker ---
+def search_ticker(ticker, template_names, threshold, bars=None):
+    """Search one ticker's history for the resident templates (runs in a pool worker)."""
+    conn = worker_conn()
+    timestamps, features = load_history(conn, ticker, open_store(conn))
+    templates, envelopes = worker_templates(), worker_envelopes()
+    rows, stats_list = [], []
+    for name in template_names:
+        lower, upper = envelopes[name]
+        matches, stats = search_series(features, templates[name], lower, upper, threshold, bars)
+        stats_list.append(stats)
+        rows += [(ticker, name, int(timestamps[start]), int(timestamps[end]), distance) for start, end, distance in non_overlapping(matches)]
+    return rows, merge_stats(stats_list)
+
+def search_history(conn, templates, template_names, threshold, tickers=None, processes=None, bars=None, on_progress=None):
+    """Every non-overlapping past window of each ticker within `threshold` of each named template.
+
+    Windows are `bars` long (each template's own length by default). Tickers are
+    searched in parallel on the scan pool; on_progress(done, total, top) receives
+    the closest (ticker, template, distance) rows found so far.
+
+    Returns (matches, stats): a DataFrame of Ticker, Template, Start, End and
+    Distance sorted by distance, and the summed per-stage window counts.
+    """
+    if tickers is None:
+        tickers = [row[0] for row in conn.execute("SELECT Ticker FROM latest_snapshot ORDER BY Ticker")]
+    pool = get_pool(templates, processes)
+    tasks = [(ticker, list(template_names), threshold, bars) for ticker in tickers]
+
+    rows, stats_list, done = [], [], 0
+    for results in imap_chunks(pool, search_ticker, tasks, processes):
+        for ticker_rows, stats in results:
+            rows += ticker_rows
+            stats_list.append(stats)
+        done += len(results)
+        if on_progress is not None:
+            best = sorted(rows, key=lambda row: row[4])[:100]
+            on_progress(done, len(tasks), [(ticker, name, distance) for ticker, name, start, end, distance in best])
+
+    matches = pd.DataFrame(rows, columns=['Ticker', 'Template', 'Start', 'End', 'Distance'])
+    for column in ('Start', 'End'):
+        matches[column] = pd.to_datetime(matches[column], unit='ms').dt.date
+    return matches.sort_values(['Distance', 'Ticker', 'End'], ignore_index=True), merge_stats(stats_list)
+
+def main():
+    parser = argparse.ArgumentParser(description="Find every past occurrence of the templates across all ticker history")
+    parser.add_argument('--threshold', type=float, required=True, help="Report windows with a DTW distance below this")
+    parser.add_argument('--templates', nargs='*', default=None, help="Template names (default: all, including the template bank)")
+    parser.add_argument('--tickers', nargs='*', default=None, help="Tickers to search (default: every ticker in latest_snapshot)")
+    parser.add_argument('--bars', type=int, default=None, help="Window length (default: each template's length)")
+    parser.add_argument('--processes', type=int, default=default_workers())
+    parser.add_argument('--output', default='history_matches.csv')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from scanner import open_database, get_all_templates
+    conn = open_database()
+    templates = get_all_templates(conn)
+    names = args.templates or list(templates)
+    unknown = [name for name in names if name not in templates]
+    if unknown:
+        parser.error(f"Unknown templates: {', '.join(unknown)}")
+
+    start_time = time.time()
+    matches, stats = search_history(conn, templates, names, args.threshold, args.tickers, args.processes, args.bars)
+    shutdown_pool()
+    matches.to_csv(args.output, index=False)
+    logging.info(
+        f"{len(matches)} matches saved to {args.output} in {time.time() - start_time:.1f} seconds "
+        f"({stats['candidates']} windows, {stats['pruned_kim']} pruned by LB_Kim, {stats['pruned_keogh']} by LB_Keogh, "
+        f"{stats['abandoned']} abandoned early, {stats['full_dtw']} full DTW)"
+    )
+
+if __name__ == '__main__':
+    with instrument.run('historysearch'):
+        main()
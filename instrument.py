@@ -0,0 +1,169 @@
+import contextlib
+import cProfile
+import json
+import logging
+import os
+import threading
+import time
+
+# Environment switches: a JSON-lines file every run record is appended to, and a
+# directory for cProfile dumps of each run (and of each pool worker)
+LOG_ENV = 'INSTRUMENT_LOG'
+PROFILE_ENV = 'INSTRUMENT_PROFILE'
+
+logger = logging.getLogger('instrument')
+
+class Recorder:
+    """Calls, wall and CPU seconds per stage, free-form counters, and the same per pool worker."""
+
+    def __init__(self):
+        self.stages: dict[str, list] = {}
+        self.counters: dict[str, int] = {}
+        self.workers: dict[int, 'Recorder'] = {}
+
+    def add_stage(self, name: str, calls: int, wall: float, cpu: float) -> None:
+        totals = self.stages.setdefault(name, [0, 0.0, 0.0])
+        totals[0] += calls
+        totals[1] += wall
+        totals[2] += cpu
+
+    def count(self, name: str, n: int = 1) -> None:
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def merge(self, snapshot: dict) -> None:
+        for name, totals in snapshot.get('stages', {}).items():
+            self.add_stage(name, totals['calls'], totals['wall'], totals['cpu'])
+        for name, n in snapshot.get('counters', {}).items():
+            self.count(name, n)
+        for pid, worker in snapshot.get('workers', {}).items():
+            self.workers.setdefault(int(pid), Recorder()).merge(worker)
+
+    def snapshot(self) -> dict:
+        return {
+            'stages': {name: {'calls': calls, 'wall': round(wall, 6), 'cpu': round(cpu, 6)} for name, (calls, wall, cpu) in self.stages.items()},
+            'counters': dict(self.counters),
+            'workers': {pid: worker.snapshot() for pid, worker in self.workers.items()},
+        }
+
+# The process-wide recorder sits at the bottom; each open run() pushes its own.
+# The stack is shared by every thread, so an ingest's fetch threads record into
+# the run that started them (and concurrent runs in other threads interleave).
+_lock = threading.Lock()
+_stack = [Recorder()]
+_profiling = [False]
+_worker_profile: dict = {}
+
+def reset() -> None:
+    """Start from an empty recorder (in a freshly forked worker, which inherits the parent's open runs)."""
+    global _lock, _stack
+    _lock = threading.Lock()
+    _stack = [Recorder()]
+    _profiling[0] = False
+    _worker_profile.clear()
+
+@contextlib.contextmanager
+def stage(name: str):
+    """Time a block (wall, and CPU of the calling thread) into the innermost open run."""
+    wall, cpu = time.perf_counter(), time.thread_time()
+    try:
+        yield
+    finally:
+        wall, cpu = time.perf_counter() - wall, time.thread_time() - cpu
+        with _lock:
+            _stack[-1].add_stage(name, 1, wall, cpu)
+
+def count(name: str, n: int = 1) -> None:
+    """Add n to a counter (queries issued, rows read, DTW calls, ...) of the innermost open run."""
+    with _lock:
+        _stack[-1].count(name, n)
+
+def add_worker(pid: int, snapshot: dict) -> None:
+    """Fold the metrics a pool worker sent back with a chunk into the innermost open run."""
+    with _lock:
+        _stack[-1].workers.setdefault(pid, Recorder()).merge(snapshot)
+
+def _emit(record: dict) -> None:
+    line = json.dumps(record, default=str)
+    logger.info(line)
+    path = os.environ.get(LOG_ENV)
+    if path:
+        with _lock, open(path, 'a') as f:
+            f.write(line + '\n')
+
+def _worker_totals(workers: dict) -> dict:
+    totals = Recorder()
+    for worker in workers.values():
+        totals.merge({'stages': worker['stages'], 'counters': worker['counters']})
+    snapshot = totals.snapshot()
+    del snapshot['workers']
+    return snapshot
+
+@contextlib.contextmanager
+def run(name: str, **fields):
+    """Scope of one scan / indicator pass / ingest: its stages and counters, emitted as one JSON record.
+
+    The record holds the run's wall and CPU time, the parent process's stages and
+    counters, each pool worker's, and the workers' totals. Runs nest; an inner
+    run's metrics also count toward the outer one. With INSTRUMENT_PROFILE set to
+    a directory, the outermost run is profiled and dumped there as a .prof file.
+    Also usable as a decorator.
+    """
+    recorder = Recorder()
+    directory = os.environ.get(PROFILE_ENV)
+    profiler = None
+    with _lock:
+        _stack.append(recorder)
+        if directory and not _profiling[0]:
+            _profiling[0] = True
+            profiler = cProfile.Profile()
+    wall, cpu = time.perf_counter(), time.process_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        if profiler is not None:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f"{name}-{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}.prof"))
+        with _lock:
+            _stack.remove(recorder)
+            snapshot = recorder.snapshot()
+            _stack[-1].merge(snapshot)
+            if profiler is not None:
+                _profiling[0] = False
+        _emit({
+            'run': name, **fields, 'pid': os.getpid(), 'started_at': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(time.time() - wall)),
+            'wall': round(wall, 6), 'cpu': round(cpu, 6), **snapshot, 'worker_totals': _worker_totals(snapshot['workers']),
+        })
+
+@contextlib.contextmanager
+def capture():
+    """In a pool worker: collect one chunk's metrics on their own, to be sent back with its results.
+
+    The chunk itself is recorded as stage 'chunk'. With INSTRUMENT_PROFILE set,
+    each worker keeps one profile across its chunks in worker-<pid>.prof.
+    """
+    recorder = Recorder()
+    directory = os.environ.get(PROFILE_ENV)
+    if directory and 'profile' not in _worker_profile:
+        _worker_profile['profile'] = cProfile.Profile()
+    profiler = _worker_profile.get('profile') if directory else None
+    with _lock:
+        _stack.append(recorder)
+    wall, cpu = time.perf_counter(), time.thread_time()
+    if profiler is not None:
+        profiler.enable()
+    try:
+        yield recorder
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        recorder.add_stage('chunk', 1, time.perf_counter() - wall, time.thread_time() - cpu)
+        if profiler is not None:
+            os.makedirs(directory, exist_ok=True)
+            profiler.dump_stats(os.path.join(directory, f"worker-{os.getpid()}.prof"))
+        with _lock:
+            _stack.remove(recorder)
@@ -0,0 +1,163 @@
+import heapq
+
+import numpy as np
+
+from dtwengine import distance
+
+# Bounds are computed in NumPy and DTW in dtaidistance; a tiny slack keeps
+# rounding differences from pruning a candidate that exactly ties the threshold.
+_SLACK = 1 + 1e-9
+
+STAGES = ('candidates', 'cached', 'pruned_cluster', 'pruned_kim', 'pruned_keogh', 'abandoned', 'full_dtw')
+
+# --- Lower Bounds for Multivariate DTW (squared Euclidean local cost) ---
+def keogh_envelope(template):
+    """Per-dimension (lower, upper) envelope of a template.
+
+    dtw_ndim is run without a warping window, so any query bar may align with
+    any template bar and the envelope spans the whole template.
+    """
+    return template.min(axis=0), template.max(axis=0)
+
+def lb_kim(query, template):
+    """First and last bars must align in every warping path."""
+    first = ((query[0] - template[0]) ** 2).sum()
+    last = ((query[-1] - template[-1]) ** 2).sum()
+    return np.sqrt(first + last)
+
+def lb_keogh(query, lower, upper):
+    """Every query bar aligns with at least one template bar inside the envelope."""
+    above = np.clip(query - upper, 0, None)
+    below = np.clip(lower - query, 0, None)
+    return np.sqrt((above ** 2).sum() + (below ** 2).sum())
+
+# --- Top-k Search ---
+def empty_stats():
+    return dict.fromkeys(STAGES, 0)
+
+def merge_stats(stats_list):
+    total = empty_stats()
+    for stats in stats_list:
+        for stage in STAGES:
+            total[stage] += stats[stage]
+    return total
+
+def best_template(data, templates, envelopes, threshold=float('inf'), stats=None, options=None, use_bounds=True):
+    """(distance, template) of the template closest to one ticker's window, through the bound cascade.
+
+    Templates are tried in order, each against the best distance so far (capped
+    by `threshold`), so ties go to the earlier template. A best distance at or
+    beyond `threshold` is not exact.
+    """
+    stats = stats if stats is not None else empty_stats()
+    options = options or {}
+    best_distance = float('inf')
+    best_name = None
+    for name, template in templates.items():
+        if template.shape[0] < 2:
+            continue
+        stats['candidates'] += 1
+        bound = min(best_distance, threshold)
+
+        if use_bounds and lb_kim(data, template) > bound * _SLACK:
+            stats['pruned_kim'] += 1
+            continue
+        if use_bounds and lb_keogh(data, *envelopes[name]) > bound * _SLACK:
+            stats['pruned_keogh'] += 1
+            continue
+
+        if bound == float('inf'):
+            dist = distance(data, template, **options)
+        else:
+            dist = distance(data, template, max_dist=bound * _SLACK, **options)
+        if dist == float('inf'):
+            stats['abandoned'] += 1
+            continue
+        stats['full_dtw'] += 1
+        if dist < best_distance:
+            best_distance = dist
+            best_name = name
+    return best_distance, best_name
+
+def topk_template_search(items, templates, envelopes, k, threshold=float('inf'), observed=None, options=None, template_index=None):
+    """Best template per ticker, keeping only the k closest tickers.
+
+    `items` is a list of (index, ticker, data) in scan order. Candidates are
+    dropped by LB_Kim, then LB_Keogh, then DTW abandoned early against the
+    current k-th best distance. Ties resolve by template order and then by scan
+    index, so the result equals sorting an exhaustive scan and taking k rows.
+
+    `threshold` caps the k-th best distance from the start (any distance known to
+    be reached by k tickers outside `items`); tickers at exactly `threshold` are kept. If `observed` is a list, every
+    ticker is appended as (ticker, template, distance, exact): exact rows carry
+    the ticker's true best distance, the others a lower bound on it.
+
+    `options` are dtwengine scan options. A window only lengthens paths, so the
+    bounds still hold; psi lets either end go unmatched, so with psi set the
+    bounds are skipped. max_dist caps the threshold.
+
+    `template_index` is an optional TemplateIndex. If it was built over exactly
+    these templates, it finds the whole chunk's best templates in one clustered
+    search, instead of looping over every template for every ticker. The top
+    rows are the same. Templates ruled out by cluster count as 'pruned_cluster'.
+
+    Returns (top, stats) where top is a list of (distance, index, ticker, template).
+    """
+    stats = empty_stats()
+    heap = []  # max-heap on (distance, index) via negation
+    options = dict(options or {})
+    initial_threshold = min(threshold, options.pop('max_dist', float('inf')))
+    use_bounds = not options.get('psi')
+    use_index = template_index is not None and use_bounds and template_index.covers(templates)
+    cap = initial_threshold
+    if use_index:
+        cap, matches = template_index.best_matches([data for index, ticker, data in items if data.shape[0] >= 2], k, initial_threshold, stats, options)
+        matches = iter(matches)
+
+    for index, ticker, data in items:
+        if data.shape[0] < 2:
+            continue
+        kth = -heap[0][0] if len(heap) == k else float('inf')
+        threshold = min(initial_threshold, kth)
+        if use_index:
+            best_distance, best_name = next(matches)
+        else:
+            best_distance, best_name = best_template(data, templates, envelopes, threshold, stats, options, use_bounds)
+
+        # Items arrive in index order, so an equal distance never displaces an earlier ticker in the heap.
+        # The tickers behind `threshold` may come later in the scan, so a distance equal to it is kept
+        # and the caller's merge on (distance, index) decides the tie, as in an uncached scan.
+        if best_distance < kth and best_distance <= initial_threshold:
+            heapq.heappush(heap, (-best_distance, -index, ticker, best_name))
+            if len(heap) > k:
+                heapq.heappop(heap)
+            if observed is not None:
+                observed.append((ticker, best_name, best_distance, True))
+        elif observed is not None:
+            # Every template was pruned, abandoned or matched at no better than the threshold (or the index's cap)
+            observed.append((ticker, None, min(threshold, cap), False))
+
+    top = sorted((-d, -i, ticker, name) for d, i, ticker, name in heap)
+    return top, stats
+
+def merge_topk(tops, k):
+    """Merge per-chunk top-k lists into the global top k."""
+    return heapq.nsmallest(k, (row for top in tops for row in top), key=lambda row: (row[0], row[1]))
+
+class TopK:
+    """The k smallest (distance, index, ...) rows pushed so far, held in a bounded max-heap."""
+
+    def __init__(self, k):
+        self.k = k
+        self.heap = []
+
+    def push(self, row):
+        entry = ((-row[0], -row[1]), row)
+        if len(self.heap) < self.k:
+            heapq.heappush(self.heap, entry)
+        elif entry[0] > self.heap[0][0]:
+            heapq.heapreplace(self.heap, entry)
+
+    def rows(self):
+        """Closest first, ties by index."""
+        return sorted((row for key, row in self.heap), key=lambda row: (row[0], row[1]))
@@ -0,0 +1,70 @@
+import argparse
+import logging
+import time
+
+import instrument
+from scanner import (
+    open_database, get_all_tickers, get_all_templates, calculate_dtw_distances_to_selected_template,
+    calculate_dtw_distances_to_stocks, TARGET_BARS, STOCK_MIN_BARS, STOCK_MAX_BARS,
+)
+from scanpool import default_workers, shutdown_pool
+from dtwcache import evict
+from similaritymatrix import compute_matrix, cluster_matrix, save_similarity, CLUSTERS
+from scanresults import (
+    current_scan_date, save_scan_results, TEMPLATE_MODE, TEMPLATE_VARIABLE_MODE, STOCKS_MODE,
+)
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+def read_watchlist(tickers, path):
+    watchlist = [ticker.strip().upper() for ticker in tickers or [] if ticker.strip()]
+    if path:
+        with open(path) as f:
+            watchlist += [line.strip().upper() for line in f if line.strip() and not line.startswith('#')]
+    return list(dict.fromkeys(watchlist))
+
+def main():
+    parser = argparse.ArgumentParser(description="Score the ticker universe against every template (and a watchlist) into scan_results")
+    parser.add_argument('--watchlist', nargs='*', default=None, help="Target tickers to find similar stocks for")
+    parser.add_argument('--watchlist-file', default=None, help="File with one target ticker per line")
+    parser.add_argument('--variable-length', action='store_true', help="Match templates on the best 7-15 bar suffix")
+    parser.add_argument('--similarity', action='store_true', help="Also store the all-pairs Similar Stocks matrix and its clustering")
+    parser.add_argument('--clusters', type=int, default=CLUSTERS, help="k for the k-medoids clustering")
+    parser.add_argument('--processes', type=int, default=default_workers())
+    args = parser.parse_args()
+
+    start_time = time.time()
+    conn = open_database()
+    scan_date = current_scan_date(conn)
+    if scan_date is None:
+        logging.error("latest_snapshot is empty; run dailydata.py and rollingretun.py first")
+        return
+
+    stock_list = get_all_tickers(conn)
+    templates = get_all_templates(conn)
+    logging.info(f"Scanning {len(stock_list)} tickers for {scan_date}")
+
+    mode = TEMPLATE_VARIABLE_MODE if args.variable_length else TEMPLATE_MODE
+    for name in templates:
+        results = calculate_dtw_distances_to_selected_template(conn, templates, stock_list, name, args.processes, variable_length=args.variable_length)
+        stored = save_scan_results(conn, scan_date, mode, name, results)
+        logging.info(f"{name}: stored {stored} ranked rows ({time.time() - start_time:.1f}s)")
+
+    for target in read_watchlist(args.watchlist, args.watchlist_file):
+        results = calculate_dtw_distances_to_stocks(conn, templates, target, stock_list, args.processes)
+        stored = save_scan_results(conn, scan_date, STOCKS_MODE, target, results)
+        logging.info(f"{target}: stored {stored} ranked rows ({time.time() - start_time:.1f}s)")
+
+    if args.similarity:
+        matrix = compute_matrix(stock_list, TARGET_BARS, STOCK_MIN_BARS, STOCK_MAX_BARS, args.processes, templates)
+        medoids, assignment = cluster_matrix(matrix, args.clusters)
+        save_similarity(conn, scan_date, stock_list, matrix, medoids, assignment)
+        logging.info(f"Similarity matrix: {len(stock_list)}x{len(stock_list)}, {len(medoids)} clusters ({time.time() - start_time:.1f}s)")
+
+    shutdown_pool()
+    logging.info(f"Evicted {evict(conn)} stale dtw_cache rows")
+    logging.info(f"Nightly scan finished in {time.time() - start_time:.1f} seconds")
+
+if __name__ == "__main__":
+    with instrument.run('nightlyscan'):
+        main()
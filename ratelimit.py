@@ -0,0 +1,64 @@
+import threading
+import time
+
+class TokenBucket:
+    """Thread-safe token bucket: `rate` calls per `per` seconds with bursts up to `capacity`.
+
+    Unlike sleeping a fixed interval after every N calls, callers only wait when
+    the bucket is empty, so the quota is used as soon as it refills.
+    """
+
+    def __init__(self, rate: float, per: float = 60.0, capacity: float | None = None):
+        self.rate = rate
+        self.per = per
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate / self.per)
+        self.updated = now
+
+    def acquire(self) -> None:
+        """Block until a token is available, then take it."""
+        while True:
+            with self.lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) * self.per / self.rate
+            time.sleep(wait)
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket whose rate backs off when the server throttles and creeps back up on success.
+
+    Additive increase / multiplicative decrease: every `window` successes raise the
+    rate by `step`, up to `max_rate`; a throttled call halves it, down to `min_rate`.
+    """
+
+    def __init__(self, rate: float, per: float = 60.0, min_rate: float = 1.0, max_rate: float | None = None,
+                 step: float = 1.0, window: int = 20):
+        super().__init__(rate, per, capacity=max(1.0, rate / 10))
+        self.min_rate = min_rate
+        self.max_rate = max_rate if max_rate is not None else rate * 4
+        self.step = step
+        self.window = window
+        self.successes = 0
+
+    def succeeded(self) -> None:
+        with self.lock:
+            self.successes += 1
+            if self.successes >= self.window:
+                self.successes = 0
+                self._refill()
+                self.rate = min(self.max_rate, self.rate + self.step)
+
+    def throttled(self) -> None:
+        with self.lock:
+            self._refill()
+            self.successes = 0
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = min(self.tokens, 0)
@@ -1,9 +1,147 @@
-import sqlite3
 import pandas as pd
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import time
 import logging
+import argparse
 
-def calculate_indicators():
+import instrument
+from db import connect
+from schema import migrate, refresh_indicators
+
+# Bars of history needed before a new bar to compute every indicator (RollingReturn25)
+LOOKBACK_BARS = 25
+
+# --- Indicator Registry ---
+# Each kernel takes the dict of (bars x tickers) matrices built so far -- the raw
+# Close/High/Volume/VWAP columns plus every indicator registered before it -- and
+# returns one matrix of the same shape. Kernels run in registration order in a
+# single pass and each becomes a REAL column of rolling_returns.
+INDICATORS = {}
+
+def indicator(name):
+    def register(kernel):
+        INDICATORS[name] = kernel
+        return kernel
+    return register
+
+def pct_change(values, periods):
+    out = np.full_like(values, np.nan)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        out[periods:] = values[periods:] / values[:-periods] - 1
+    return out
+
+def rolling_mean(values, window):
+    out = np.full_like(values, np.nan)
+    out[window - 1:] = sliding_window_view(values, window, axis=0).mean(axis=-1)
+    return out
+
+@indicator('RollingReturn1')
+def rolling_return_1(m):
+    return pct_change(m['Close'], 1)
+
+@indicator('RollingReturn7')
+def rolling_return_7(m):
+    return pct_change(m['Close'], 7)
+
+@indicator('RollingReturn25')
+def rolling_return_25(m):
+    return pct_change(m['Close'], 25)
+
+@indicator('MA4_High')
+def ma4_high(m):
+    return rolling_mean(m['High'], 4)
+
+@indicator('Rank')
+def rank(m):
+    return (m['RollingReturn1'] * 0.40) + (m['RollingReturn7'] * 0.35) + (m['RollingReturn25'] * 0.25)
+
+def build_matrices(df):
+    """Pivot long (Ticker, Timestamp, ...) rows into (bars x tickers) matrices.
+
+    Columns are aligned on each ticker's own bar sequence, newest bar in the last
+    row, so shifts and windows match a per-ticker groupby even when a ticker has
+    missing sessions.
+    """
+    df = df.sort_values(['Ticker', 'Timestamp'])
+    tickers, column = np.unique(df['Ticker'].to_numpy(), return_inverse=True)
+    counts = np.bincount(column)
+    starts = np.cumsum(counts) - counts
+    n_bars = counts.max()
+    row = (n_bars - counts[column]) + (np.arange(len(df)) - starts[column])
+
+    matrices = {}
+    for field in ['Timestamp', 'LastTs', 'Close', 'High', 'Volume', 'VWAP']:
+        fill = -1 if field in ('Timestamp', 'LastTs') else np.nan
+        dtype = np.int64 if field in ('Timestamp', 'LastTs') else float
+        matrix = np.full((n_bars, len(tickers)), fill, dtype=dtype)
+        matrix[row, column] = df[field].to_numpy(dtype=dtype, na_value=fill)
+        matrices[field] = matrix
+    return tickers, matrices
+
+def compute_indicators(df):
+    """Run every registered kernel over one batch and return the rows to store."""
+    tickers, m = build_matrices(df)
+    for name, kernel in INDICATORS.items():
+        m[name] = kernel(m)
+
+    # Rows with every indicator defined, after the ticker's last computed bar
+    keep = m['Timestamp'] > m['LastTs']
+    for name in INDICATORS:
+        keep &= ~np.isnan(m[name])
+    rows, columns = np.nonzero(keep)
+
+    out = pd.DataFrame({
+        'Date': format_date(m['Timestamp'][rows, columns]),
+        'Ticker': tickers[columns],
+        **{field: m[field][rows, columns] for field in ['Close', 'Volume', 'VWAP', *INDICATORS]},
+    })
+    return out.astype(object).where(out.notna(), None)
+
+def format_date(timestamps):
+    """rolling_returns Date strings for bar Timestamps (ms)."""
+    return pd.to_datetime(timestamps, unit='ms').strftime('%Y-%m-%d %H:%M:%S')
+
+def load_checkpoints(conn, changes):
+    """Create a temp table with each ticker's last computed bar and the start of its lookback.
+
+    `changes` maps tickers to the earliest bar Timestamp written or deleted since
+    the last run (bar_changes). A ticker with a change at or before its last
+    computed bar is rewound to just before it. Returns the rewound tickers'
+    {ticker: Timestamp}.
+    """
+    cur = conn.cursor()
+    last_dates = pd.read_sql_query("SELECT Ticker, MAX(Date) AS Date FROM rolling_returns GROUP BY Ticker", conn)
+    last_dates['LastTs'] = (pd.to_datetime(last_dates['Date']) - pd.Timestamp(0)) // pd.Timedelta(milliseconds=1)
+    last_ts = dict(zip(last_dates['Ticker'], last_dates['LastTs'].astype(int).tolist()))
+    rewound = {ticker: from_ts for ticker, from_ts in changes.items() if ticker in last_ts and from_ts <= last_ts[ticker]}
+    for ticker, from_ts in rewound.items():
+        last_ts[ticker] = from_ts - 1
+
+    cur.execute("DROP TABLE IF EXISTS temp.indicator_checkpoint")
+    cur.execute("CREATE TEMP TABLE indicator_checkpoint (Ticker TEXT PRIMARY KEY, LastTs INTEGER, StartTs INTEGER)")
+    cur.executemany("INSERT INTO indicator_checkpoint (Ticker, LastTs) VALUES (?, ?)", last_ts.items())
+    # Lookback starts LOOKBACK_BARS bars back from the last computed bar (uses the (Ticker, Timestamp) key)
+    cur.execute(f'''
+        UPDATE indicator_checkpoint SET StartTs = (
+            SELECT Timestamp FROM grouped_daily_data g
+            WHERE g.Ticker = indicator_checkpoint.Ticker AND g.Timestamp <= indicator_checkpoint.LastTs
+            ORDER BY g.Timestamp DESC LIMIT 1 OFFSET {LOOKBACK_BARS - 1}
+        )
+    ''')
+    conn.commit()
+    return rewound
+
+@instrument.run('calculate_indicators')
+def calculate_indicators(full_rebuild=False):
+    """Compute rolling returns and rank into rolling_returns.
+
+    By default only bars after each ticker's last computed Date are appended,
+    loading just the LOOKBACK_BARS bars before them. A ticker whose bars were
+    backfilled or corrected at or before that Date (see schema.ensure_bar_changes)
+    is recomputed from the earliest changed bar. full_rebuild recomputes every
+    ticker's whole history.
+    """
     # Set up logging
     logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
     
@@ -11,7 +149,7 @@ def calculate_indicators():
     logging.info("Starting calculation of indicators")
     
     # Connect to the database
-    conn = sqlite3.connect('tradeapp.db')
+    conn = connect()
     cur = conn.cursor()
 
     # Check if the grouped_daily_data table exists
@@ -24,11 +162,6 @@ def calculate_indicators():
     # Load the data from grouped_daily_data table - process in chunks to avoid memory issues
     logging.info("Retrieving data from database")
     
-    # Get unique tickers first
-    cur.execute("SELECT DISTINCT Ticker FROM grouped_daily_data")
-    tickers = [row[0] for row in cur.fetchall()]
-    logging.info(f"Found {len(tickers)} unique tickers to process")
-    
     # Create the new table if it doesn't exist
     cur.execute('''
         CREATE TABLE IF NOT EXISTS rolling_returns (
@@ -45,73 +178,91 @@ def calculate_indicators():
             PRIMARY KEY (Date, Ticker)
         )
     ''')
-    
-    # Process tickers in batches
-    batch_size = 100
-    total_processed = 0
-    
-    for i in range(0, len(tickers), batch_size):
-        batch_tickers = tickers[i:i+batch_size]
-        placeholders = ','.join(['?'] * len(batch_tickers))
-        
-        logging.info(f"Processing batch {i//batch_size + 1} of {(len(tickers) + batch_size - 1)//batch_size}")
-        
-        query = f"""
-            SELECT Ticker, Timestamp, Close, High, Volume, VWAP 
-            FROM grouped_daily_data 
-            WHERE Ticker IN ({placeholders})
-        """
-        
-        df = pd.read_sql_query(query, conn, params=batch_tickers)
-        
-        if df.empty:
-            logging.warning(f"No data found for batch {i//batch_size + 1}")
-            continue
-            
-        # Convert timestamp to datetime
-        df['Date'] = pd.to_datetime(df['Timestamp'], unit='ms')
-        df.sort_values(by=['Ticker', 'Date'], inplace=True)
-
-        # Calculate the 1-day, 7-day, and 25-day rolling returns
-        df['RollingReturn1'] = df.groupby('Ticker')['Close'].pct_change(periods=1)
-        df['RollingReturn7'] = df.groupby('Ticker')['Close'].pct_change(periods=7)
-        df['RollingReturn25'] = df.groupby('Ticker')['Close'].pct_change(periods=25)
-        
-        # Calculate 4-day moving average on High
-        df['MA4_High'] = df.groupby('Ticker')['High'].rolling(window=4).mean().reset_index(level=0, drop=True)
-
-        # Calculate the Rank
-        df['Rank'] = ((df['RollingReturn1'] * 0.40) + (df['RollingReturn7'] * 0.35) + (df['RollingReturn25'] * 0.25))
-
-        # Remove rows with NaN values
-        df.dropna(subset=['RollingReturn1', 'RollingReturn7', 'RollingReturn25', 'Rank', 'MA4_High'], inplace=True)
-        
-        # Reset the index for inserting into the database
-        df.reset_index(drop=True, inplace=True)
-
-        # Insert the rolling returns into the new table
-        df_to_insert = df[['Date', 'Ticker', 'Close', 'Volume', 'VWAP', 'RollingReturn1', 'RollingReturn7', 'RollingReturn25', 'MA4_High', 'Rank']]
-        
-        # Use a temporary table to avoid duplicate key conflicts
-        temp_table_name = f'rolling_returns_temp_{i}'
-        df_to_insert.to_sql(temp_table_name, conn, if_exists='replace', index=False)
-        
-        # Insert or replace data from the temporary table into the main table
-        cur.execute(f'''
-            INSERT OR REPLACE INTO rolling_returns
-            SELECT Date, Ticker, Close, Volume, VWAP, RollingReturn1, RollingReturn7, RollingReturn25, MA4_High, Rank 
-            FROM {temp_table_name}
+
+    migrate(conn)
+    # Changes up to now; these rows are cleared in the same transaction that writes their indicators
+    changes = dict(cur.execute("SELECT Ticker, FromTs FROM bar_changes").fetchall())
+    rewound = {}
+
+    if full_rebuild:
+        # Get unique tickers first
+        cur.execute("SELECT DISTINCT Ticker FROM grouped_daily_data")
+        tickers = [row[0] for row in cur.fetchall()]
+        cur.execute("DROP TABLE IF EXISTS temp.indicator_checkpoint")
+        cur.execute("CREATE TEMP TABLE indicator_checkpoint (Ticker TEXT PRIMARY KEY, LastTs INTEGER, StartTs INTEGER)")
+    else:
+        rewound = load_checkpoints(conn, changes)
+        # Only tickers with bars newer than their last computed Date need work
+        cur.execute('''
+            SELECT g.Ticker FROM grouped_daily_data g
+            LEFT JOIN indicator_checkpoint c ON c.Ticker = g.Ticker
+            GROUP BY g.Ticker
+            HAVING MAX(g.Timestamp) > COALESCE(MAX(c.LastTs), -1)
         ''')
+        tickers = [row[0] for row in cur.fetchall()]
+    logging.info(f"Found {len(tickers)} tickers to process ({'full rebuild' if full_rebuild else 'incremental'}, {len(rewound)} rewound for changed bars)")
+
+    # Registered indicators without a column yet get one
+    existing = {row[1] for row in cur.execute("PRAGMA table_info(rolling_returns)")}
+    for name in INDICATORS:
+        if name not in existing:
+            cur.execute(f"ALTER TABLE rolling_returns ADD COLUMN {name} REAL")
+
+    columns = ['Date', 'Ticker', 'Close', 'Volume', 'VWAP', *INDICATORS]
+    insert_sql = f"INSERT OR REPLACE INTO rolling_returns ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})"
+
+    # Process tickers in batches to bound memory; all writes share one transaction
+    batch_size = 1000
+    total_processed = 0
+    total_rows = 0
+
+    with conn:
+        # A rewound ticker's rows are all rewritten below, except those of bars that were deleted
+        if full_rebuild:
+            cur.execute("DELETE FROM rolling_returns")
+        cur.executemany(
+            "DELETE FROM rolling_returns WHERE Ticker = ? AND Date >= ?",
+            zip(rewound, format_date(list(rewound.values()))),
+        )
+        cur.executemany("DELETE FROM bar_changes WHERE Ticker = ? AND FromTs = ?", changes.items())
+
+        for i in range(0, len(tickers), batch_size):
+            batch_tickers = tickers[i:i+batch_size]
+            placeholders = ','.join(['?'] * len(batch_tickers))
+
+            logging.info(f"Processing batch {i//batch_size + 1} of {(len(tickers) + batch_size - 1)//batch_size}")
+
+            query = f"""
+                SELECT g.Ticker, g.Timestamp, g.Close, g.High, g.Volume, g.VWAP, COALESCE(c.LastTs, -1) AS LastTs
+                FROM grouped_daily_data g
+                LEFT JOIN indicator_checkpoint c ON c.Ticker = g.Ticker
+                WHERE g.Ticker IN ({placeholders}) AND g.Timestamp >= COALESCE(c.StartTs, 0)
+            """
+
+            # Always the float64 bars: the float32 column store is only for scan windows
+            with instrument.stage('load'):
+                df = pd.read_sql_query(query, conn, params=batch_tickers)
+            instrument.count('queries')
+            instrument.count('rows_read', len(df))
+
+            if df.empty:
+                logging.warning(f"No data found for batch {i//batch_size + 1}")
+                continue
+
+            with instrument.stage('compute'):
+                df_to_insert = compute_indicators(df)
+            with instrument.stage('write'):
+                cur.executemany(insert_sql, df_to_insert[columns].itertuples(index=False, name=None))
+            instrument.count('rows_written', len(df_to_insert))
 
-        conn.commit()
+            total_processed += len(batch_tickers)
+            total_rows += len(df_to_insert)
+            elapsed_time = time.time() - start_time
+            logging.info(f"Processed {total_processed}/{len(tickers)} tickers ({total_rows} rows) in {elapsed_time:.2f} seconds")
 
-        # Drop the temporary table
-        cur.execute(f'DROP TABLE IF EXISTS {temp_table_name}')
-        conn.commit()
-        
-        total_processed += len(batch_tickers)
-        elapsed_time = time.time() - start_time
-        logging.info(f"Processed {total_processed}/{len(tickers)} tickers in {elapsed_time:.2f} seconds")
+        # Screening reads each ticker's newest indicators from latest_snapshot
+        with instrument.stage('refresh_snapshot'):
+            refresh_indicators(conn)
 
     logging.info(f"Successfully calculated rolling returns for {total_processed} tickers")
     logging.info(f"Total execution time: {time.time() - start_time:.2f} seconds")
@@ -120,4 +271,7 @@ def calculate_indicators():
     conn.close()
 
 if __name__ == "__main__":
-    calculate_indicators()
+    parser = argparse.ArgumentParser(description="Calculate rolling returns and rank into rolling_returns")
+    parser.add_argument('--full-rebuild', action='store_true', help="Recompute every ticker's full history")
+    args = parser.parse_args()
+    calculate_indicators(full_rebuild=args.full_rebuild)
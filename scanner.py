@@ -0,0 +1,314 @@
+import heapq
+
+import numpy as np
+
+import instrument
+from db import connect, DB_NAME
+from windowloader import load_windows, window_list
+from subsequence import best_suffix
+from dtwengine import one_to_many, many_to_many, best_suffixes
+from scanpool import get_pool, imap_chunks, chunked, worker_templates, worker_envelopes, worker_index, template_fingerprint
+from lowerbound import topk_template_search, merge_stats, empty_stats, TopK
+from schema import migrate, screen_tickers
+from scanresults import ensure_scan_results, load_scan_results
+from dtwcache import ensure_dtw_cache, array_key, params_key, last_timestamps, lookup, store, cached_results
+from featureindex import ensure_version_triggers
+from similaritymatrix import ensure_similarity_tables
+from templatebank import ensure_template_bank, bank_templates
+from backtest import ensure_backtest_results
+
+# --- Define MULTIPLE Template Patterns in a Dictionary ---
+pattern_templates = {
+  "Custom Pattern 1": [ # Added "Custom Pattern 1" template here
+        [-0.00911162,  0.        ,  0.02404057,  0.06775701,  0.01816411, -0.01630197],
+        [ 0.05977011,  0.23982869,  0.06666667,  0.23851204,  0.15947058, -0.07908127],
+        [ 0.17570499,  0.0164076 ,  0.20758929, -0.01060071,  0.09373801,  0.01803571],
+        [ 0.03505535, -0.02633815, -0.02016636, -0.025     , -0.03965971,  0.00272894],
+        [-0.03743316,  0.0052356 , -0.00756475, -0.02197802, -0.01110523,  0.0138764 ]
+    ],
+    "Custom Pattern 2": [ # Added "Custom Pattern 1" template here
+        [ 0.,          0.,          0.,          0.,          0.,          0.0219469 ],
+        [-0.08384458, -0.02816901, -0.01725843,  0.04646018,  0.00365864, -0.01985201],
+        [ 0.11830357,  0.13250518,  0.11017104,  0.14587738,  0.12870732, -0.03453875],
+        [ 0.08782435,  0.07129799,  0.10813594,  0.01291513,  0.0646499,   0.01477231],
+        [ 0.10550459,  0.21331058,  0.08178439,  0.29143898,  0.19985281, -0.05719323],
+        [ 0.41410788,  0.20675105,  0.32989691,  0.13117066,  0.2305782,   0.02566085],
+        [-0.11971831,  0.08391608, -0.06330749,  0.07605985,  0.03236159, -0.01599073],
+        [ 0.15333333, -0.03225806,  0.09393103, -0.03012746, -0.00927932,  0.00516129],
+        [-0.07052023, -0.07,       -0.11045265, -0.11708483, -0.09342462,  0.03209743],
+        [-0.19029851, -0.0776583,  -0.102764,    0.,         -0.04920548, -0.01868742],
+        [ 0.19047619,  0.13860104,  0.21169036,  0.18403248,  0.14543775, -0.05067429],
+        [ 0.11419355,  0.02730375,  0.07301173, -0.03085714,  0.02936219,  0.00831368],
+        [-0.00868558, -0.0166113,  -0.05224787, -0.05542453, -0.04247705,  0.02213483],
+        [-0.08060748, -0.09931306, -0.02820513, -0.00873908, -0.04637671, -0.01667506],
+        [-0.0184244,   0.06775359, -0.03627968,  0.06423174,  0.01499821, -0.06216568]
+    ],
+    "Custom Pattern 3": [ # Added "Custom Pattern 1" template here
+        [0.0, 0.0, 0.0, 0.0, 0.0, -0.00031362],
+        [0.01897395, -0.00356841, 0.02184744, -0.00248284, 0.00130654, 0.00348176],
+        [-0.00364911, 0.02910927, 0.00066043, 0.02391301, 0.02369512, 0.00326314],
+        [0.02391301, -0.00372466, 0.00934586, 0.00071362, 0.00031873, 0.00286703],
+        [0.11052278, 0.16982863, 0.10058167, 0.16283633, 0.15638937, -0.00357762],
+        [0.05105517, -0.00853202, 0.05572615, 0.00006062, 0.00388162, 0.00023699],
+        [0.00215383, -0.01138944, -0.01607203, -0.02852769, -0.02887132, -0.00010665],
+        [-0.03722997, -0.0339329, -0.0211616, -0.02731236, -0.02299333, 0.00422125]
+    ],
+    "Custom Pattern 4": [ # Added "Custom Pattern 1" template here
+        [0.0,         0.0,         0.0,         0.0,         0.0,         0.00213644],
+        [0.00191283,  0.00727434,  0.01263595,  0.01092184,  0.01203016,  0.00324775],
+        [0.00038213, -0.00075753, -0.01789235, -0.0064946,  -0.00756606,  0.00217338],
+        [0.14334824,  0.17916802,  0.13901086,  0.17298304,  0.16480889, -0.00598514],
+        [0.0258615,   0.02621564,  0.04400194, -0.00204575,  0.01719617,  0.01332682],
+        [-0.03875999, -0.06963539, -0.04463642, -0.03091129, -0.04648192, -0.00232911],
+        [0.00639865,  0.00047248,  0.0056958,   0.01486591,  0.0095265,  -0.00764188],
+        [0.01055856,  0.02158861,  0.01493644,  0.01138033,  0.0177227,  -0.00132797],
+        [0.0013179,  -0.00984863, -0.01173768, -0.01935758, -0.01896642, -0.00093726]
+    ]
+    }
+
+
+# Converted once per process; the apps re-run their script on every widget change, this module isn't re-imported
+pattern_template_arrays = {name: np.array(template) for name, template in pattern_templates.items()}
+
+TARGET_BARS = 9 # Bars compared against templates / the target ticker
+STOCK_MIN_BARS, STOCK_MAX_BARS = 7, 15 # Candidate window lengths for comparison tickers
+
+# --- Database Setup ---
+def open_database(path=DB_NAME):
+    """A connection to the database with every table the scans and apps use created and migrated."""
+    conn = connect(path)
+    ensure_template_bank(conn)
+    ensure_version_triggers(conn)
+    migrate(conn)
+    ensure_dtw_cache(conn)
+    ensure_scan_results(conn)
+    ensure_similarity_tables(conn)
+    ensure_backtest_results(conn)
+    return conn
+
+# --- Data Retrieval ---
+def get_all_templates(conn):
+    """Hard-coded templates plus every pattern archived in the template bank (cached)."""
+    return {**pattern_template_arrays, **bank_templates(conn)}
+
+def get_all_tickers(conn):
+    """Retrieve the scan universe from latest_snapshot: top 2000 by rank on the latest date, with Volume > 100000 and Close > 5 in the latest session."""
+    return screen_tickers(conn, top_n=2000, min_volume=100000, min_close=5)
+
+def get_data_for_target(conn, ticker):
+    windows, ticker_index, mask = load_windows(conn, [ticker], TARGET_BARS)
+    return window_list(windows, mask)[0]
+
+def get_data_for_stock(conn, ticker, reference):
+    """Return the suffix of the ticker's last STOCK_MAX_BARS bars that best matches `reference`."""
+    windows, ticker_index, mask = load_windows(conn, [ticker], STOCK_MAX_BARS)
+    return best_suffix(reference, window_list(windows, mask)[0], STOCK_MIN_BARS, STOCK_MAX_BARS)
+
+# --- DTW Distance Calculation Functions ---
+# `templates` is the bank the scan pool holds (and is keyed on); scans pick templates from it by name.
+def dtw_chunk_to_template(items, template_name, variable_length=False, options=None):
+    """Distances from a chunk of (ticker, window) to one resident template, in one batched DTW call.
+
+    With variable_length, each window is the ticker's STOCK_MAX_BARS tail and its
+    best-matching suffix of STOCK_MIN_BARS..STOCK_MAX_BARS bars is used.
+    """
+    template = worker_templates()[template_name]
+    windows = [data for ticker, data in items]
+    if variable_length:
+        distances = [distance for distance, length in best_suffixes(template, windows, STOCK_MIN_BARS, STOCK_MAX_BARS, **(options or {}))]
+    else:
+        distances = one_to_many(template, windows, **(options or {}))
+    return [(ticker, float(distance)) for (ticker, data), distance in zip(items, distances)]
+
+def topk_chunk_to_templates(items, template_names, k, threshold=float('inf'), options=None):
+    """Top-k search of a chunk of (index, ticker, data) against resident templates."""
+    templates = {name: worker_templates()[name] for name in template_names}
+    observed = []
+    with instrument.stage('topk_search'):
+        top, stats = topk_template_search(items, templates, worker_envelopes(), k, threshold, observed, options, worker_index())
+    return top, stats, observed, len(items)
+
+def calculate_topk_to_templates(conn, templates, stock_list, template_names, k, processes=None, on_progress=None, options=None):
+    """Top-k tickers by best distance to the given templates, using the lower-bound cascade.
+
+    Distances cached for the tickers' current bars are reused: exact hits skip the
+    search and their k-th best caps the threshold for the rest, and tickers whose
+    cached lower bound already exceeds that cap are skipped too.
+
+    Chunks are merged into a bounded top-k heap as they finish, and
+    on_progress(done, total, top) sees the best rows so far after each one.
+
+    Returns (results, stats): rows of (ticker, template, distance) identical to the
+    first k rows of an exhaustive scan, and per-stage pruning counts.
+    """
+    key = template_fingerprint({name: templates[name] for name in template_names})
+    params = params_key(scan='topk', bars=TARGET_BARS, **(options or {}))
+    last_ts = last_timestamps(conn, stock_list)
+    cached = lookup(conn, last_ts, key, params)
+
+    hits = [(cached[stock][0], i, stock, cached[stock][1]) for i, stock in enumerate(stock_list) if stock in cached and cached[stock][2]]
+    threshold = heapq.nsmallest(k, hits)[-1][0] if len(hits) >= k else float('inf')
+    remaining = [
+        (i, stock) for i, stock in enumerate(stock_list)
+        if stock not in cached or (not cached[stock][2] and not cached[stock][0] > threshold)
+    ]
+
+    windows, ticker_index, mask = load_windows(conn, [stock for i, stock in remaining], TARGET_BARS)
+    stock_data = window_list(windows, mask)
+    items = [(i, stock, stock_data[ticker_index[stock]]) for i, stock in remaining]
+    ranking = TopK(k)
+    for row in hits:
+        ranking.push(row)
+
+    def report(done):
+        if on_progress is not None:
+            on_progress(done, len(stock_list), [(ticker, name, distance) for distance, index, ticker, name in ranking.rows()])
+
+    done = len(stock_list) - len(remaining)
+    report(done)
+    pool = get_pool(templates, processes)
+    chunk_stats = []
+    tasks = [(chunk, template_names, k, threshold, options) for chunk in chunked(items, processes)]
+    for results in imap_chunks(pool, topk_chunk_to_templates, tasks, chunksize=1):
+        for top, stats, observed, scanned in results:
+            store(conn, last_ts, key, params, observed)
+            for row in top:
+                ranking.push(row)
+            chunk_stats.append(stats)
+            done += scanned
+        report(done)
+
+    stats = merge_stats(chunk_stats)
+    skipped = (len(stock_list) - len(remaining)) * len(template_names)
+    stats['cached'] += skipped
+    stats['candidates'] += skipped
+    return [(ticker, name, distance) for distance, index, ticker, name in ranking.rows()], stats
+
+def calculate_dtw_distances_to_selected_template(conn, templates, stock_list, selected_pattern_name, processes=None, top_k=None, variable_length=False, on_progress=None, options=None):
+    """Calculate DTW distances in parallel to a *specific* selected template.
+
+    With top_k set, only the k closest tickers are returned, found with the lower-bound cascade.
+    With variable_length, each ticker is matched on its best STOCK_MIN_BARS..STOCK_MAX_BARS suffix.
+    on_progress(done, total, top) is called as chunks of tickers finish; options are dtwengine scan options.
+    """
+    if top_k and not variable_length:
+        results, stats = calculate_topk_to_templates(conn, templates, stock_list, [selected_pattern_name], top_k, processes, on_progress, options)
+        return [(ticker, distance) for ticker, name, distance in results], stats
+
+    bars = STOCK_MAX_BARS if variable_length else TARGET_BARS
+
+    def compute(tickers):
+        windows, ticker_index, mask = load_windows(conn, tickers, bars)
+        stock_data = window_list(windows, mask)
+        pool = get_pool(templates, processes)
+        items = [(stock, stock_data[ticker_index[stock]]) for stock in tickers]
+        tasks = [(chunk, selected_pattern_name, variable_length, options) for chunk in chunked(items, processes)]
+        for results in imap_chunks(pool, dtw_chunk_to_template, tasks, chunksize=1):
+            for rows in results:
+                yield [(ticker, selected_pattern_name, distance) for ticker, distance in rows]
+
+    key = template_fingerprint({selected_pattern_name: templates[selected_pattern_name]})
+    params = params_key(scan='template', bars=bars, variable_length=variable_length, min_bars=STOCK_MIN_BARS, **(options or {}))
+    # Variable-length windows have no lower bounds here, so top_k ranks the exhaustive scan
+    stats = empty_stats()
+    results = cached_results(conn, stock_list, key, params, compute, top_k, on_progress, stats)
+    results = [(ticker, distance) for ticker, name, distance in results]
+    if top_k:
+        return results, stats
+    return results
+
+def dtw_chunk_to_target(target_data, items, options=None):
+    """Distances from the target's window to a chunk of (ticker, tail), each on the tail's best-matching suffix.
+
+    Every STOCK_MIN_BARS..STOCK_MAX_BARS suffix of every tail is scored in one batched DTW call.
+    """
+    best = best_suffixes(target_data, [tail for ticker, tail in items], STOCK_MIN_BARS, STOCK_MAX_BARS, **(options or {}))
+    return [(ticker, distance) for (ticker, tail), (distance, length) in zip(items, best)]
+
+def calculate_dtw_distances_to_stocks(conn, templates, target_ticker, stock_list, processes=None, top_k=None, on_progress=None, options=None):
+    """Calculate DTW distances in parallel to other stocks (ticker vs. ticker comparison).
+
+    With top_k set, only the k closest tickers are kept as results stream in, closest first.
+    """
+    target_data = get_data_for_target(conn, target_ticker) # Loaded once, not once per comparison
+
+    def compute(tickers):
+        windows, ticker_index, mask = load_windows(conn, tickers, STOCK_MAX_BARS)
+        tails = window_list(windows, mask)
+        pool = get_pool(templates, processes)
+        items = [(stock, tails[ticker_index[stock]]) for stock in tickers]
+        tasks = [(target_data, chunk, options) for chunk in chunked(items, processes)]
+        for results in imap_chunks(pool, dtw_chunk_to_target, tasks, chunksize=1):
+            for rows in results:
+                yield [(ticker, None, distance) for ticker, distance in rows]
+
+    # The target's window is the key, so a new bar for the target misses as well
+    params = params_key(scan='stocks', min_bars=STOCK_MIN_BARS, max_bars=STOCK_MAX_BARS, **(options or {}))
+    results = cached_results(conn, stock_list, array_key(target_data), params, compute, top_k, on_progress)
+    return [(ticker, distance) for ticker, name, distance in results]
+
+def dtw_chunk_to_templates(items, variable_length=False, options=None):
+    """Best resident template for each (ticker, window) of a chunk, from one batched templates x windows call.
+
+    Ties go to the earlier template. With variable_length, each window is the
+    ticker's STOCK_MAX_BARS tail and each template is matched against its best
+    STOCK_MIN_BARS..STOCK_MAX_BARS suffix.
+    """
+    names = list(worker_templates())
+    templates = [worker_templates()[name] for name in names]
+    windows = [data for ticker, data in items]
+    if not names:
+        return [(ticker, None, float('inf')) for ticker, data in items]
+    if variable_length:
+        distances = np.array([
+            [distance for distance, length in best_suffixes(template, windows, STOCK_MIN_BARS, STOCK_MAX_BARS, **(options or {}))]
+            for template in templates
+        ]).reshape(len(templates), len(windows))
+    else:
+        distances = many_to_many(templates, windows, **(options or {}))
+    best = distances.argmin(axis=0)
+    return [
+        (ticker, names[best[j]], float(distances[best[j], j])) if distances[best[j], j] != float('inf') else (ticker, None, float('inf'))
+        for j, (ticker, data) in enumerate(items)
+    ]
+
+def calculate_dtw_distances_to_all_templates(conn, templates, stock_list, processes=None, top_k=None, variable_length=False, on_progress=None, options=None):
+    """Calculate DTW distances for each stock to all templates and return best matches.
+
+    With top_k set, only the k closest tickers are returned, found with the lower-bound cascade.
+    With variable_length, each ticker is matched on its best STOCK_MIN_BARS..STOCK_MAX_BARS suffix.
+    on_progress(done, total, top) is called as chunks of tickers finish; options are dtwengine scan options.
+    """
+    if top_k and not variable_length:
+        return calculate_topk_to_templates(conn, templates, stock_list, list(templates), top_k, processes, on_progress, options)
+
+    bars = STOCK_MAX_BARS if variable_length else TARGET_BARS
+
+    def compute(tickers):
+        windows, ticker_index, mask = load_windows(conn, tickers, bars)
+        stock_data = window_list(windows, mask)
+        pool = get_pool(templates, processes)
+        items = [(stock, stock_data[ticker_index[stock]]) for stock in tickers]
+        tasks = [(chunk, variable_length, options) for chunk in chunked(items, processes)]
+        for results in imap_chunks(pool, dtw_chunk_to_templates, tasks, chunksize=1):
+            yield from results
+
+    params = params_key(scan='all_templates', bars=bars, variable_length=variable_length, min_bars=STOCK_MIN_BARS, **(options or {}))
+    # Variable-length windows have no lower bounds here, so top_k ranks the exhaustive scan
+    stats = empty_stats()
+    results = cached_results(conn, stock_list, template_fingerprint(templates), params, compute, top_k, on_progress, stats)
+    if top_k:
+        return results, {stage: count * len(templates) for stage, count in stats.items()}
+    return results
+
+# --- Snapshot and Nightly Results ---
+def snapshot_stamp(conn):
+    """Newest session and indicator date in latest_snapshot; cached scans are keyed on it."""
+    return tuple(conn.execute("SELECT MAX(Timestamp), MAX(Date) FROM latest_snapshot").fetchone())
+
+def nightly_results(conn, scan_date, mode, reference, stock_list):
+    """Rows the nightly scan stored for these inputs, limited to the current candidates ([] if it hasn't run)."""
+    if scan_date is None:
+        return []
+    candidates = set(stock_list)
+    return [row for row in load_scan_results(conn, scan_date, mode, reference) if row[0] in candidates]
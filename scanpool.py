@@ -0,0 +1,194 @@
+import atexit
+import hashlib
+import multiprocessing
+import os
+import sqlite3
+import threading
+
+import instrument
+from db import reader
+from lowerbound import keogh_envelope
+from templateindex import build_index
+
+DB_NAME = 'tradeapp.db'
+
+# Pools live in this (imported, hence cached) module so they survive Streamlit reruns.
+# One per (size, database, templates), least recently used first; past WARM_POOLS
+# the oldest idle one is shut down. A pool with a scan running is never shut down.
+WARM_POOLS = int(os.environ.get('SCAN_WARM_POOLS', 2))
+_pools = {}
+_lock = threading.Lock()
+# Every running scan holds one shared slot of its pool: 0 is free, the scan's id
+# while it runs, minus the id once cancelled. Workers check the slot before every
+# task, so cancelling one session's scan leaves the others running.
+CANCEL_SLOTS = 64
+_scan_ids = {}
+_slots = {}
+
+# Per-worker state, filled once by _init_worker when the worker process starts
+worker_state: dict = {}
+
+def default_workers() -> int:
+    """Worker count: SCAN_WORKERS if set, otherwise the machine's core count."""
+    return int(os.environ.get('SCAN_WORKERS', 0)) or os.cpu_count() or 1
+
+def template_fingerprint(templates: dict) -> str:
+    """Stable hash of a {name: array} template dict."""
+    digest = hashlib.sha1()
+    for name in sorted(templates):
+        digest.update(name.encode())
+        digest.update(templates[name].tobytes())
+    return digest.hexdigest()
+
+def _init_worker(db_path: str, templates: dict, index, slots) -> None:
+    instrument.reset()
+    worker_state['slots'] = slots
+    worker_state['conn'] = reader(db_path)
+    worker_state['templates'] = templates
+    worker_state['envelopes'] = {name: keogh_envelope(template) for name, template in templates.items()}
+    worker_state['index'] = index
+
+def worker_conn() -> sqlite3.Connection:
+    """Read-only DB handle opened once by this worker process."""
+    return worker_state['conn']
+
+def worker_templates() -> dict:
+    """Templates held resident in this worker process."""
+    return worker_state['templates']
+
+def worker_envelopes() -> dict:
+    """LB_Keogh envelopes, precomputed once per resident template."""
+    return worker_state['envelopes']
+
+def worker_index():
+    """Clustered TemplateIndex over the resident templates (None without any usable template)."""
+    return worker_state['index']
+
+def get_pool(templates: dict | None = None, processes: int | None = None, db_path: str = DB_NAME):
+    """Return the warm scan pool for this size, database and templates, creating it on first use."""
+    templates = templates or {}
+    processes = processes or default_workers()
+    key = (processes, db_path, template_fingerprint(templates))
+    with _lock:
+        if key in _pools:
+            _pools[key] = _pools.pop(key)
+            return _pools[key]
+
+        # fork keeps worker functions defined in the Streamlit script resolvable in the workers
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('fork' if 'fork' in methods else None)
+        slots = context.Array('q', CANCEL_SLOTS)
+        # Built once here rather than in every worker; forked workers inherit it
+        index = build_index(templates)
+        pool = context.Pool(processes=processes, initializer=_init_worker, initargs=(db_path, templates, index, slots))
+        _pools[key] = pool
+        _scan_ids[pool] = 0
+        _slots[pool] = slots
+        _retire_idle()
+        return pool
+
+def _running(pool) -> bool:
+    return any(_slots[pool])
+
+def _retire_idle() -> None:
+    """Shut down the least recently used idle pools past WARM_POOLS; call with _lock held."""
+    for key in list(_pools)[:-max(WARM_POOLS, 1)]:
+        if not _running(_pools[key]):
+            _close(_pools.pop(key))
+
+def _close(pool) -> None:
+    pool.terminate()
+    pool.join()
+    del _scan_ids[pool], _slots[pool]
+
+def chunksize_for(n_tasks: int, processes: int | None = None) -> int:
+    """Chunk tasks so each worker gets a few batches instead of one pickle round-trip per ticker."""
+    processes = processes or default_workers()
+    return max(1, n_tasks // (processes * 4))
+
+def chunked(items: list, processes: int | None = None) -> list:
+    """Split items into contiguous chunks, a few per worker."""
+    size = chunksize_for(len(items), processes)
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+def begin_scan(pool) -> tuple[int, int]:
+    """Register a new scan on `pool`: (scan id, slot).
+
+    Raises RuntimeError if all CANCEL_SLOTS scans of the pool are already running.
+    """
+    with _lock:
+        slots = _slots[pool]
+        free = [slot for slot, scan_id in enumerate(slots) if scan_id == 0]
+        if not free:
+            raise RuntimeError(f"{CANCEL_SLOTS} scans are already running on this pool; wait for one to finish")
+        _scan_ids[pool] += 1
+        slots[free[0]] = _scan_ids[pool]
+        return _scan_ids[pool], free[0]
+
+def cancel_scan(pool, scan: tuple[int, int]) -> None:
+    """Stop a running scan: its queued tasks return without doing any work."""
+    scan_id, slot = scan
+    with _lock:
+        if pool in _slots and _slots[pool][slot] == scan_id:
+            _slots[pool][slot] = -scan_id
+
+def end_scan(pool, scan: tuple[int, int]) -> None:
+    """Free the scan's slot; a pool already past WARM_POOLS is shut down once idle."""
+    scan_id, slot = scan
+    with _lock:
+        if pool in _slots and abs(_slots[pool][slot]) == scan_id:
+            _slots[pool][slot] = 0
+        _retire_idle()
+
+def scan_cancelled(scan: tuple[int, int]) -> bool:
+    """In a worker: whether `scan` has been cancelled."""
+    scan_id, slot = scan
+    return worker_state['slots'][slot] != scan_id
+
+def _run_chunk(task: tuple) -> tuple:
+    """Run one chunk of tasks in a worker; its instrumentation travels back with the results."""
+    function, scan, chunk = task
+    results = []
+    with instrument.capture() as metrics:
+        for args in chunk:
+            if scan_cancelled(scan):
+                break
+            results.append(function(*args))
+        metrics.count('tasks', len(results))
+    return results, os.getpid(), metrics.snapshot()
+
+def imap_chunks(pool, function, tasks: list, processes: int | None = None, chunksize: int | None = None):
+    """Run function(*args) for every task, yielding lists of results as each chunk completes.
+
+    Chunks finish in any order. If the caller stops iterating early (an
+    exception, a Streamlit rerun) the scan is cancelled and the workers skip
+    whatever is still queued.
+    """
+    size = chunksize or chunksize_for(len(tasks), processes)
+    scan = begin_scan(pool)
+    chunks = [(function, scan, tasks[i:i + size]) for i in range(0, len(tasks), size)]
+    finished = False
+    try:
+        iterator = pool.imap_unordered(_run_chunk, chunks)
+        while True:
+            # Time blocked here is the workers' compute plus pickling results back
+            with instrument.stage('pool_wait'):
+                item = next(iterator, None)
+            if item is None:
+                break
+            results, pid, metrics = item
+            instrument.add_worker(pid, metrics)
+            yield results
+        finished = True
+    finally:
+        if not finished:
+            cancel_scan(pool, scan)
+        end_scan(pool, scan)
+
+def shutdown_pool() -> None:
+    """Shut down every pool, running scans included (process exit, end of a batch job)."""
+    with _lock:
+        while _pools:
+            _close(_pools.popitem()[1])
+
+atexit.register(shutdown_pool)
@@ -0,0 +1,71 @@
+import sqlite3
+
+from tradingcalendar import session_date
+
+# Scan modes stored in scan_results; `reference` is the template name or target ticker
+TEMPLATE_MODE = 'template'
+TEMPLATE_VARIABLE_MODE = 'template_variable'
+STOCKS_MODE = 'stocks'
+
+def ensure_scan_results(conn: sqlite3.Connection) -> None:
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS scan_results (
+            scan_date TEXT,
+            mode TEXT,
+            reference TEXT,
+            ticker TEXT,
+            distance REAL,
+            rank INTEGER,
+            PRIMARY KEY (scan_date, mode, reference, ticker)
+        )
+        """
+    )
+    # Ranked rows for one scan, and a ticker's match history
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_rank ON scan_results (scan_date, mode, reference, rank)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_results_ticker ON scan_results (ticker, scan_date)")
+    conn.commit()
+
+def current_scan_date(conn: sqlite3.Connection) -> str | None:
+    """Date of the newest session in latest_snapshot, which names the scan run on it."""
+    newest = conn.execute("SELECT MAX(Timestamp) FROM latest_snapshot").fetchone()[0]
+    if newest is None:
+        return None
+    return session_date(newest).strftime('%Y-%m-%d')
+
+def save_scan_results(conn: sqlite3.Connection, scan_date: str, mode: str, reference: str, results) -> int:
+    """Replace one scan's rows with (ticker, distance) results ranked by distance. Returns rows stored."""
+    ranked = sorted(((ticker, distance) for ticker, distance in results if distance != float('inf')), key=lambda row: row[1])
+    with conn:
+        conn.execute("DELETE FROM scan_results WHERE scan_date = ? AND mode = ? AND reference = ?", (scan_date, mode, reference))
+        conn.executemany(
+            "INSERT INTO scan_results (scan_date, mode, reference, ticker, distance, rank) VALUES (?, ?, ?, ?, ?, ?)",
+            [(scan_date, mode, reference, ticker, distance, rank) for rank, (ticker, distance) in enumerate(ranked, start=1)],
+        )
+    return len(ranked)
+
+def load_scan_results(conn: sqlite3.Connection, scan_date: str, mode: str, reference: str) -> list[tuple[str, float]]:
+    """(ticker, distance) rows of one stored scan in rank order."""
+    return conn.execute(
+        "SELECT ticker, distance FROM scan_results WHERE scan_date = ? AND mode = ? AND reference = ? ORDER BY rank",
+        (scan_date, mode, reference),
+    ).fetchall()
+
+def load_best_matches(conn: sqlite3.Connection, scan_date: str, mode: str) -> list[tuple[str, str, float]]:
+    """(ticker, template, distance) with each ticker's closest template in one stored run, closest first.
+
+    A distance tie between templates goes to the first template name, and one between tickers to the first ticker.
+    """
+    return conn.execute(
+        """
+        SELECT ticker, reference, distance FROM (
+            SELECT ticker, reference, distance,
+                   ROW_NUMBER() OVER (PARTITION BY ticker ORDER BY distance, reference) AS position
+            FROM scan_results
+            WHERE scan_date = ? AND mode = ?
+        )
+        WHERE position = 1
+        ORDER BY distance, ticker
+        """,
+        (scan_date, mode),
+    ).fetchall()
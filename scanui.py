@@ -0,0 +1,120 @@
+import time
+
+import pandas as pd
+import streamlit as st
+
+import instrument
+from db import DB_NAME
+from dtwcache import evict
+from dtwengine import dtw_options, engine_name
+from featureindex import get_feature_index, MARKET_CAP_LABELS
+from scanner import open_database, get_all_tickers
+
+PROGRESS_INTERVAL = 0.25 # Seconds between redraws of the live results table
+
+# --- Database Setup ---
+@st.cache_resource(show_spinner=False)
+def prepare_database(path=DB_NAME):
+    """open_database and a dtw_cache eviction, once per server process rather than on every rerun.
+
+    Only the setup is cached: each rerun still opens its own connection, since
+    Streamlit runs sessions on separate threads.
+    """
+    conn = open_database(path)
+    evict(conn)
+    conn.close()
+    return path
+
+# --- Streamlit Controls ---
+def prefilter_candidates(conn, stock_list, target_ticker=None):
+    """Narrow (and, with a target, pre-rank) the scan universe by fundamentals before any DTW runs."""
+    index = get_feature_index(conn)
+    st.sidebar.subheader("Fundamentals prefilter")
+    if target_ticker:
+        if target_ticker not in index:
+            st.sidebar.caption(f"No encoded fundamentals for {target_ticker}; scanning the full universe.")
+            return stock_list
+        same = [name for name, label in (('Sector', "Same sector"), ('Industry', "Same industry")) if st.sidebar.checkbox(label)]
+        tolerance = st.sidebar.selectbox("Market cap bucket", ("Any", "Same", "±1", "±2"))
+        near = {} if tolerance == "Any" else {'market_cap': ("Same", "±1", "±2").index(tolerance)}
+        candidates = index.restrict(stock_list, like=target_ticker, same=same, near=near) if same or near else stock_list
+        candidates = index.rank(candidates, target_ticker) # Ties in distance go to the closest fundamentals
+    else:
+        sectors = st.sidebar.multiselect("Sectors", sorted(value for value in index.vocabulary['Sector'] if value))
+        caps = st.sidebar.multiselect("Market cap buckets", list(MARKET_CAP_LABELS), format_func=MARKET_CAP_LABELS.get)
+        conditions = {}
+        if sectors:
+            conditions['Sector'] = [index.vocabulary['Sector'][sector] for sector in sectors]
+        if caps:
+            conditions['market_cap'] = caps
+        candidates = index.restrict(stock_list, **conditions) if conditions else stock_list
+    st.sidebar.caption(f"{len(candidates)} of {len(stock_list)} candidates after prefilter")
+    return candidates
+
+def dtw_option_controls():
+    """Sidebar DTW options for the engine; all zero (the default) is plain DTW."""
+    with st.sidebar.expander("DTW options"):
+        window = st.number_input("Sakoe-Chiba window (bars, 0 = none)", min_value=0, value=0, step=1)
+        max_dist = st.number_input("Max distance (0 = none)", min_value=0.0, value=0.0, step=0.05)
+        psi = st.number_input("Psi relaxation (bars, 0 = none)", min_value=0, value=0, step=1, help="Lets either end skip this many bars; turns off lower-bound pruning")
+        st.caption(f"Engine: {engine_name()}")
+    return dtw_options(window, max_dist, psi)
+
+# --- Rerun Caching ---
+@st.cache_data(show_spinner=False)
+def cached_universe(_conn, stamp):
+    """get_all_tickers, recomputed only when new bars or indicators land."""
+    return get_all_tickers(_conn)
+
+def run_scan(key, scan, rescan=False, cancel=False):
+    """Result of scan() for these inputs, kept in session_state so widget reruns reuse it.
+
+    Returns (value, fresh), fresh being True when the scan actually ran. Pressing
+    Cancel stops the running script, which cancels the scan's queued work; the
+    rerun that follows records these inputs as cancelled (value None) until Rescan.
+    """
+    saved = st.session_state.get('scan')
+    if saved is not None and saved['key'] == key and not rescan:
+        return saved['value'], False
+    if cancel:
+        st.session_state['scan'] = {'key': key, 'value': None}
+        return None, False
+    with instrument.run(f"scan.{key[0]}"):
+        value = scan()
+    st.session_state['scan'] = {'key': key, 'value': value}
+    return value, True
+
+def scan_progress(columns):
+    """Progress bar and live table of the best rows so far, for a scan's on_progress.
+
+    Returns (update, clear). Redraws are throttled to PROGRESS_INTERVAL seconds.
+    """
+    bar = st.progress(0.0, text="Scanning...")
+    table = st.empty()
+    last_draw = [0.0]
+
+    def update(done, total, top):
+        now = time.time()
+        if done < total and now - last_draw[0] < PROGRESS_INTERVAL:
+            return
+        last_draw[0] = now
+        with instrument.stage('render'):
+            bar.progress(done / total if total else 1.0, text=f"Scanned {done} of {total} tickers")
+            if top:
+                rows = top if len(columns) == 3 else [(ticker, distance) for ticker, template, distance in top]
+                table.dataframe(pd.DataFrame(rows, columns=columns))
+
+    def clear():
+        bar.empty()
+        table.empty()
+
+    return update, clear
+
+def show_scan_stats(stats, scan_date):
+    if stats is None:
+        st.caption(f"Precomputed by the nightly scan for {scan_date}; press Rescan for a live scan.")
+        return
+    st.caption(
+        f"Lower-bound cascade: {stats['candidates']} candidates, {stats['cached']} from cache, {stats['pruned_cluster']} skipped by template cluster, {stats['pruned_kim']} pruned by LB_Kim, "
+        f"{stats['pruned_keogh']} by LB_Keogh, {stats['abandoned']} abandoned early, {stats['full_dtw']} full DTW"
+    )
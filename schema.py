@@ -0,0 +1,202 @@
+import sqlite3
+
+from db import connect
+
+DB_NAME = 'tradeapp.db'
+
+BAR_COLUMNS = ['Open', 'High', 'Low', 'Close', 'Volume', 'VWAP']
+
+# Secondary indexes, created once their table exists
+INDEXES = {
+    'grouped_daily_data': [
+        # Per-ticker newest-first windows read straight from the index (window loader, lookbacks)
+        "CREATE INDEX IF NOT EXISTS idx_daily_ticker_ts ON grouped_daily_data (Ticker, Timestamp DESC, Open, High, Low, Close, VWAP)",
+        # Per-session reads: MAX(Timestamp), one day's bars, checkpoint seeding
+        "CREATE INDEX IF NOT EXISTS idx_daily_ts ON grouped_daily_data (Timestamp, Volume, Close)",
+    ],
+    'rolling_returns': [
+        # The primary key is (Date, Ticker); per-ticker history needs the other order
+        "CREATE INDEX IF NOT EXISTS idx_returns_ticker_date ON rolling_returns (Ticker, Date)",
+        # Top-ranked tickers on a given date
+        "CREATE INDEX IF NOT EXISTS idx_returns_date_rank ON rolling_returns (Date, Rank DESC, Ticker)",
+    ],
+    'latest_snapshot': [
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_date_rank ON latest_snapshot (Date, Rank DESC)",
+        "CREATE INDEX IF NOT EXISTS idx_snapshot_ts ON latest_snapshot (Timestamp)",
+    ],
+}
+
+def _table_columns(conn: sqlite3.Connection, table: str) -> list[str]:
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+def _indicator_columns(conn: sqlite3.Connection) -> list[str]:
+    """Indicator columns of rolling_returns (everything but the key and the raw bar fields)."""
+    return [name for name in _table_columns(conn, 'rolling_returns') if name not in ('Date', 'Ticker', *BAR_COLUMNS)]
+
+def ensure_table_version(conn: sqlite3.Connection, table: str) -> None:
+    """Maintain a change counter for `table` in table_versions, bumped by a trigger on every row written or deleted."""
+    if not _table_columns(conn, table):
+        return
+    conn.execute("CREATE TABLE IF NOT EXISTS table_versions (name TEXT PRIMARY KEY, version INTEGER)")
+    # Checked first so a start-up while an ingest holds the write lock doesn't wait on it
+    if conn.execute("SELECT 1 FROM table_versions WHERE name = ?", (table,)).fetchone() is None:
+        conn.execute("INSERT INTO table_versions (name, version) VALUES (?, 0)", (table,))
+    for event in ('INSERT', 'UPDATE', 'DELETE'):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS {table}_version_{event.lower()} AFTER {event} ON {table}
+            BEGIN
+                UPDATE table_versions SET version = version + 1 WHERE name = '{table}';
+            END
+            """
+        )
+
+def table_version(conn: sqlite3.Connection, table: str) -> int | None:
+    """The change counter of `table`, or None when its triggers are not installed."""
+    installed = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'trigger' AND name = ?", (f"{table}_version_update",)
+    ).fetchone()
+    if installed is None:
+        return None
+    return conn.execute("SELECT version FROM table_versions WHERE name = ?", (table,)).fetchone()[0]
+
+def ensure_bar_changes(conn: sqlite3.Connection) -> None:
+    """Track, per ticker, the earliest grouped_daily_data Timestamp written or deleted since the last indicator run.
+
+    rollingretun.py moves a ticker's checkpoint back to it, so a backfilled or
+    corrected session is recomputed along with every later bar it feeds.
+    """
+    if not _table_columns(conn, 'grouped_daily_data'):
+        return
+    conn.execute("CREATE TABLE IF NOT EXISTS bar_changes (Ticker TEXT PRIMARY KEY, FromTs INTEGER)")
+    for event, ticker, timestamp in (
+        ('INSERT', 'NEW.Ticker', 'NEW.Timestamp'),
+        ('UPDATE', 'NEW.Ticker', 'MIN(OLD.Timestamp, NEW.Timestamp)'),
+        ('DELETE', 'OLD.Ticker', 'OLD.Timestamp'),
+    ):
+        conn.execute(
+            f"""
+            CREATE TRIGGER IF NOT EXISTS grouped_daily_data_changes_{event.lower()} AFTER {event} ON grouped_daily_data
+            BEGIN
+                INSERT INTO bar_changes (Ticker, FromTs) VALUES ({ticker}, {timestamp})
+                ON CONFLICT(Ticker) DO UPDATE SET FromTs = MIN(FromTs, excluded.FromTs);
+            END
+            """
+        )
+
+def migrate(conn: sqlite3.Connection) -> None:
+    """Create latest_snapshot, every index whose table exists and the bar change tracking; safe to run on every start.
+
+    An empty snapshot over a populated database is rebuilt in full.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS latest_snapshot (
+            Ticker TEXT PRIMARY KEY,
+            Timestamp INTEGER,
+            Open REAL,
+            High REAL,
+            Low REAL,
+            Close REAL,
+            Volume REAL,
+            VWAP REAL,
+            Date TEXT,
+            Rank REAL
+        )
+        """
+    )
+    existing = _table_columns(conn, 'latest_snapshot')
+    for name in _indicator_columns(conn):
+        if name not in existing:
+            conn.execute(f"ALTER TABLE latest_snapshot ADD COLUMN {name} REAL")
+
+    for table, statements in INDEXES.items():
+        if _table_columns(conn, table):
+            for statement in statements:
+                conn.execute(statement)
+
+    # The column store compares this counter with the one it last mirrored
+    ensure_table_version(conn, 'grouped_daily_data')
+    ensure_bar_changes(conn)
+
+    if conn.execute("SELECT 1 FROM latest_snapshot LIMIT 1").fetchone() is None:
+        rebuild_snapshot(conn)
+    conn.commit()
+
+def upsert_bars(conn: sqlite3.Connection, rows) -> None:
+    """Fold freshly ingested (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP) rows into the snapshot.
+
+    A row only replaces the stored bar if it is newer, so sessions may arrive in any order.
+    """
+    conn.executemany(
+        """
+        INSERT INTO latest_snapshot (Ticker, Close, High, Low, Open, Timestamp, Volume, VWAP)
+        VALUES (?1, ?2, ?3, ?4, ?6, ?7, ?8, ?9)
+        ON CONFLICT(Ticker) DO UPDATE SET
+            Timestamp = excluded.Timestamp, Open = excluded.Open, High = excluded.High, Low = excluded.Low,
+            Close = excluded.Close, Volume = excluded.Volume, VWAP = excluded.VWAP
+        WHERE excluded.Timestamp > latest_snapshot.Timestamp
+        """,
+        rows,
+    )
+
+def refresh_bars(conn: sqlite3.Connection) -> None:
+    """Reload every ticker's newest bar from grouped_daily_data."""
+    if not _table_columns(conn, 'grouped_daily_data'):
+        return
+    columns = ', '.join(BAR_COLUMNS)
+    updates = ', '.join(f"{name} = excluded.{name}" for name in ['Timestamp', *BAR_COLUMNS])
+    # SQLite fills bare columns of a MAX() aggregate from the row holding the maximum
+    conn.execute(
+        f"""
+        INSERT INTO latest_snapshot (Ticker, Timestamp, {columns})
+        SELECT Ticker, MAX(Timestamp), {columns} FROM grouped_daily_data WHERE true GROUP BY Ticker
+        ON CONFLICT(Ticker) DO UPDATE SET {updates}
+        """
+    )
+
+def refresh_indicators(conn: sqlite3.Connection) -> None:
+    """Copy each ticker's newest rolling_returns row into the snapshot (one indexed lookup per ticker)."""
+    indicators = _indicator_columns(conn)
+    if not indicators:
+        return
+    existing = _table_columns(conn, 'latest_snapshot')
+    for name in indicators:
+        if name not in existing:
+            conn.execute(f"ALTER TABLE latest_snapshot ADD COLUMN {name} REAL")
+    columns = ', '.join(['Date', *indicators])
+    conn.execute(
+        f"""
+        UPDATE latest_snapshot SET ({columns}) = (
+            SELECT {columns} FROM rolling_returns r
+            WHERE r.Ticker = latest_snapshot.Ticker
+            ORDER BY r.Date DESC LIMIT 1
+        )
+        """
+    )
+
+def rebuild_snapshot(conn: sqlite3.Connection) -> None:
+    refresh_bars(conn)
+    refresh_indicators(conn)
+
+def screen_tickers(conn: sqlite3.Connection, top_n: int = 2000, min_volume: float = 100000, min_close: float = 5) -> list[str]:
+    """Top `top_n` tickers by Rank on the latest indicator date whose bar in the latest session clears the volume and price floors."""
+    rows = conn.execute(
+        """
+        SELECT Ticker FROM (
+            SELECT Ticker, Timestamp, Volume, Close FROM latest_snapshot
+            WHERE Date = (SELECT MAX(Date) FROM latest_snapshot)
+            ORDER BY Rank DESC LIMIT ?
+        )
+        WHERE Timestamp = (SELECT MAX(Timestamp) FROM latest_snapshot) AND Volume > ? AND Close > ?
+        ORDER BY Ticker
+        """,
+        (top_n, min_volume, min_close),
+    ).fetchall()
+    return [row[0] for row in rows]
+
+if __name__ == '__main__':
+    with connect(DB_NAME) as conn:
+        migrate(conn)
+        rebuild_snapshot(conn)
+        conn.commit()
@@ -0,0 +1,175 @@
+import sqlite3
+
+import numpy as np
+
+from dtwengine import many_to_many
+from scanpool import get_pool, imap_chunks, chunked, worker_conn
+from windowloader import load_windows, window_list, suffix_window
+
+CLUSTERS = 20 # k for the k-medoids clustering of the universe
+MAX_ITERATIONS = 50
+
+# Reader cache of the stored universe's ticker order, keyed on scan_date
+_cache: dict = {'scan_date': None, 'positions': None}
+# Per-worker windows of the universe being scored, loaded once per build
+_worker_windows: dict = {'key': None}
+
+def ensure_similarity_tables(conn: sqlite3.Connection) -> None:
+    """Row i of a matrix holds the distances from ticker i's window to every ticker at that position.
+
+    The "Similar Stocks" distance compares the target's window with each
+    candidate's best-matching suffix, so it is not symmetric. Rows are kept whole
+    as float32 BLOBs rather than as a condensed upper triangle.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS similarity_matrix (
+            scan_date TEXT,
+            ticker TEXT,
+            position INTEGER,
+            cluster INTEGER,
+            distances BLOB,
+            PRIMARY KEY (scan_date, ticker)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS similarity_medoids (
+            scan_date TEXT,
+            cluster INTEGER,
+            medoid TEXT,
+            size INTEGER,
+            PRIMARY KEY (scan_date, cluster)
+        )
+        """
+    )
+    conn.commit()
+
+# --- Matrix ---
+def _universe_windows(tickers, target_bars, min_bars, max_bars):
+    """Targets' windows and every candidate suffix of every tail, grouped by ticker (cached per worker)."""
+    key = (tuple(tickers), target_bars, min_bars, max_bars)
+    if _worker_windows['key'] != key:
+        conn = worker_conn()
+        windows, ticker_index, mask = load_windows(conn, tickers, target_bars)
+        targets = window_list(windows, mask)
+        windows, ticker_index, mask = load_windows(conn, tickers, max_bars)
+        suffixes, owners = [], []
+        for i, tail in enumerate(window_list(windows, mask)):
+            m = min(len(tail), max_bars)
+            for length in range(max(min(min_bars, m), 2), m + 1):
+                suffixes.append(suffix_window(tail, length))
+                owners.append(i)
+        _worker_windows.update(key=key, targets=targets, suffixes=suffixes, owners=np.array(owners, dtype=np.int64))
+    return _worker_windows['targets'], _worker_windows['suffixes'], _worker_windows['owners']
+
+def similarity_rows(tickers, rows, target_bars, min_bars, max_bars, options=None):
+    """Matrix rows for the targets at `rows`, computed in a pool worker with one batched DTW call.
+
+    Each entry is the distance from the target's window to the candidate's best
+    min_bars..max_bars suffix, as in a live "Similar Stocks" scan.
+    """
+    targets, suffixes, owners = _universe_windows(tickers, target_bars, min_bars, max_bars)
+    block = np.full((len(rows), len(tickers)), np.inf)
+    if len(suffixes):
+        distances = many_to_many([targets[i] for i in rows], suffixes, **(options or {}))
+        # Suffixes are grouped by owner, so each ticker's best is a min over one contiguous run
+        starts = np.flatnonzero(np.r_[True, owners[1:] != owners[:-1]])
+        block[:, owners[starts]] = np.minimum.reduceat(distances, starts, axis=1)
+    return rows, block.astype(np.float32)
+
+def compute_matrix(tickers, target_bars, min_bars, max_bars, processes=None, templates=None, options=None) -> np.ndarray:
+    """The full (tickers x tickers) float32 distance matrix, rows computed in parallel on the scan pool."""
+    pool = get_pool(templates, processes)
+    matrix = np.full((len(tickers), len(tickers)), np.inf, dtype=np.float32)
+    tasks = [(list(tickers), chunk, target_bars, min_bars, max_bars, options) for chunk in chunked(list(range(len(tickers))), processes)]
+    for results in imap_chunks(pool, similarity_rows, tasks, chunksize=1):
+        for rows, block in results:
+            matrix[rows] = block
+    return matrix
+
+# --- Clustering ---
+def k_medoids(distances: np.ndarray, k: int = CLUSTERS, max_iterations: int = MAX_ITERATIONS, seed: int = 0) -> tuple[np.ndarray, np.ndarray]:
+    """Cluster a symmetric distance matrix: (medoid indices, cluster of every point).
+
+    k-medoids++ seeding, then alternating assignment to the nearest medoid and
+    moving each medoid to the member with the smallest total distance to its
+    cluster, until the medoids stop changing.
+    """
+    n = len(distances)
+    k = min(k, n)
+    rng = np.random.default_rng(seed)
+    medoids = [int(rng.integers(n))]
+    for _ in range(1, k):
+        nearest = distances[:, medoids].min(axis=1)
+        weights = nearest ** 2
+        total = weights.sum()
+        medoids.append(int(rng.choice(n, p=weights / total)) if total > 0 else int(np.argmax(nearest)))
+    medoids = np.array(medoids)
+
+    for _ in range(max_iterations):
+        assignment = distances[:, medoids].argmin(axis=1)
+        updated = medoids.copy()
+        for cluster in range(k):
+            members = np.flatnonzero(assignment == cluster)
+            if len(members):
+                updated[cluster] = members[distances[np.ix_(members, members)].sum(axis=1).argmin()]
+        if np.array_equal(updated, medoids):
+            break
+        medoids = updated
+    return medoids, distances[:, medoids].argmin(axis=1)
+
+def cluster_matrix(matrix: np.ndarray, k: int = CLUSTERS) -> tuple[np.ndarray, np.ndarray]:
+    """k-medoids over the symmetrised matrix; missing (inf) distances count as twice the largest real one."""
+    symmetric = np.minimum(matrix, matrix.T).astype(float)
+    finite = np.isfinite(symmetric)
+    symmetric[~finite] = 2 * symmetric[finite].max() if finite.any() else 1.0
+    np.fill_diagonal(symmetric, 0)
+    return k_medoids(symmetric, k)
+
+# --- Storage and Lookups ---
+def save_similarity(conn: sqlite3.Connection, scan_date: str, tickers, matrix: np.ndarray, medoids, assignment) -> None:
+    """Replace the stored matrix and clusters with this run's; older dates are dropped."""
+    sizes = np.bincount(assignment, minlength=len(medoids))
+    with conn:
+        conn.execute("DELETE FROM similarity_matrix")
+        conn.execute("DELETE FROM similarity_medoids")
+        conn.executemany(
+            "INSERT INTO similarity_matrix (scan_date, ticker, position, cluster, distances) VALUES (?, ?, ?, ?, ?)",
+            [(scan_date, ticker, i, int(assignment[i]), matrix[i].tobytes()) for i, ticker in enumerate(tickers)],
+        )
+        conn.executemany(
+            "INSERT INTO similarity_medoids (scan_date, cluster, medoid, size) VALUES (?, ?, ?, ?)",
+            [(scan_date, cluster, tickers[medoid], int(sizes[cluster])) for cluster, medoid in enumerate(medoids)],
+        )
+    _cache['scan_date'] = None
+
+def _positions(conn: sqlite3.Connection, scan_date: str) -> list[str]:
+    if _cache['scan_date'] != scan_date:
+        _cache['positions'] = [row[0] for row in conn.execute("SELECT ticker FROM similarity_matrix WHERE scan_date = ? ORDER BY position", (scan_date,))]
+        _cache['scan_date'] = scan_date
+    return _cache['positions']
+
+def similar_stocks(conn: sqlite3.Connection, scan_date: str, target: str, stock_list) -> list[tuple[str, float]] | None:
+    """(ticker, distance) from the stored row of `target` for the candidates it covers, or None if it has no row."""
+    row = conn.execute("SELECT distances FROM similarity_matrix WHERE scan_date = ? AND ticker = ?", (scan_date, target)).fetchone()
+    if row is None:
+        return None
+    distances = np.frombuffer(row[0], dtype=np.float32)
+    column = {ticker: i for i, ticker in enumerate(_positions(conn, scan_date))}
+    return [(ticker, float(distances[column[ticker]])) for ticker in stock_list if ticker in column]
+
+def ticker_cluster(conn: sqlite3.Connection, scan_date: str, ticker: str) -> tuple[int, str, int] | None:
+    """(cluster, medoid, cluster size) of a ticker in the stored clustering."""
+    return conn.execute(
+        """
+        SELECT m.cluster, d.medoid, d.size FROM similarity_matrix m
+        JOIN similarity_medoids d ON d.scan_date = m.scan_date AND d.cluster = m.cluster
+        WHERE m.scan_date = ? AND m.ticker = ?
+        """,
+        (scan_date, ticker),
+    ).fetchone()
+
+def cluster_members(conn: sqlite3.Connection, scan_date: str, cluster: int) -> list[str]:
+    return [row[0] for row in conn.execute("SELECT ticker FROM similarity_matrix WHERE scan_date = ? AND cluster = ? ORDER BY ticker", (scan_date, cluster))]
@@ -0,0 +1,67 @@
+import numpy as np
+
+from windowloader import PRICE_COLUMNS, suffix_window
+
+# --- Open-Begin (Subsequence) DTW ---
+def _cost_matrix(query, series):
+    return ((query[:, None, :] - series[None, :, :]) ** 2).sum(axis=2)
+
+def open_begin_distance(query, tail, min_length, max_length):
+    """Best DTW distance between `query` and any suffix of `tail` from one cost matrix.
+
+    A suffix of length L is the window LIMIT L would load: its first bar has its
+    log returns reset to 0. Both series are reversed so every suffix becomes a
+    prefix, one DTW matrix is filled over the whole tail, and each candidate
+    length only needs its final column recomputed with the reset first bar.
+
+    Lengths run from min_length to max_length, clipped to the bars available.
+    Returns (distance, length); (inf, 0) if no suffix has at least 2 bars.
+    """
+    n, m = len(query), min(len(tail), max_length)
+    lengths = range(max(min(min_length, m), 2), m + 1)
+    if n < 2 or not lengths:
+        return float('inf'), 0
+
+    query_r = query[::-1]
+    tail_r = tail[::-1][:m]
+    reset_r = tail_r.copy()
+    reset_r[:, :len(PRICE_COLUMNS)] = 0
+
+    cost = _cost_matrix(query_r, tail_r).tolist()
+    reset_cost = _cost_matrix(query_r, reset_r).tolist()
+
+    # dtw[i][j]: cost of aligning query_r[:i+1] with tail_r[:j+1] (no reset bar)
+    inf = float('inf')
+    dtw = [[inf] * m for _ in range(n)]
+    for i in range(n):
+        for j in range(m):
+            if i == 0 and j == 0:
+                prev = 0.0
+            else:
+                prev = min(
+                    dtw[i - 1][j - 1] if i and j else inf,
+                    dtw[i - 1][j] if i else inf,
+                    dtw[i][j - 1] if j else inf,
+                )
+            dtw[i][j] = cost[i][j] + prev
+
+    best_distance, best_length = inf, 0
+    for length in lengths:
+        j = length - 1
+        column = inf
+        for i in range(n):
+            prev = min(
+                dtw[i - 1][j - 1] if i and j else inf,
+                dtw[i][j - 1] if j else inf,
+                column if i else inf,
+            )
+            column = reset_cost[i][j] + (0.0 if i == 0 and j == 0 else prev)
+        if column < best_distance:
+            best_distance, best_length = column, length
+
+    return float(np.sqrt(best_distance)), best_length
+
+def best_suffix(query, tail, min_length, max_length):
+    """Return the suffix window of `tail` that open_begin_distance matched, or an empty array."""
+    distance, length = open_begin_distance(query, tail, min_length, max_length)
+    return suffix_window(tail, length) if length else np.array([])
@@ -0,0 +1,281 @@
+import argparse
+import os
+import sqlite3
+import time
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from db import connect
+from featureindex import ensure_version_triggers
+from rollingretun import INDICATORS, compute_indicators
+from schema import migrate
+from templatebank import ensure_template_bank
+from tradingcalendar import trading_days
+from windowloader import PRICE_COLUMNS, transform_windows
+
+DB_NAME = 'tradeapp.db'
+
+END_DATE = date(2025, 12, 31) # Fixed so a given scale and seed always build the same database
+TEMPLATE_BARS = 9
+BATCH_SIZE = 500 # Tickers generated and written per transaction
+
+SECTORS = {
+    'Technology': ['Software', 'Semiconductors', 'Computer Hardware', 'IT Services'],
+    'Healthcare': ['Biotechnology', 'Medical Devices', 'Drug Manufacturers'],
+    'Financial Services': ['Banks', 'Asset Management', 'Insurance'],
+    'Consumer Cyclical': ['Retail', 'Auto Manufacturers', 'Restaurants'],
+    'Energy': ['Oil & Gas E&P', 'Oil & Gas Midstream'],
+    'Industrials': ['Aerospace & Defense', 'Machinery', 'Airlines'],
+    'Utilities': ['Utilities - Regulated'],
+    'Real Estate': ['REIT - Residential', 'REIT - Office'],
+}
+
+def ticker_names(n: int) -> list[str]:
+    """AAAA, AAAB, ... -- n distinct four-letter symbols."""
+    names = []
+    for i in range(n):
+        letters = ''
+        for _ in range(4):
+            i, r = divmod(i, 26)
+            letters = chr(ord('A') + r) + letters
+        names.append(letters)
+    return names
+
+def session_timestamps(years: float, end: date = END_DATE) -> np.ndarray:
+    """Unix ms of every NYSE session in the `years` before `end`."""
+    return close_timestamps(trading_days(end - timedelta(days=round(365.25 * years)), end))
+
+def close_timestamps(days) -> np.ndarray:
+    """Unix ms of each session's 16:00 New York close."""
+    closes = pd.DatetimeIndex([pd.Timestamp(day) + pd.Timedelta(hours=16) for day in days]).tz_localize('America/New_York')
+    return ((closes - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(milliseconds=1)).to_numpy(dtype=np.int64)
+
+# --- Bars ---
+def ticker_bars(ticker: str, position: int, timestamps: np.ndarray, seed: int) -> list[tuple]:
+    """One ticker's history as grouped_daily_data rows (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP).
+
+    Closes follow a geometric random walk with a per-ticker drift and volatility;
+    about a tenth of the tickers list partway through the period. Each ticker
+    draws from its own seeded generator, so its bars don't depend on the scale.
+    """
+    rng = np.random.default_rng([seed, position])
+    listed = int(rng.integers(len(timestamps))) if rng.random() < 0.1 else 0
+    n = len(timestamps) - listed
+    if n <= 0:
+        return []
+    volatility = rng.uniform(0.01, 0.05)
+    log_returns = rng.normal(rng.normal(0.0003, 0.0005), volatility, n)
+    close = rng.lognormal(3.3, 1.0) * np.exp(np.cumsum(log_returns))
+    open_ = np.r_[close[0], close[:-1]] * np.exp(rng.normal(0, volatility / 3, n))
+    high = np.maximum(open_, close) * (1 + np.abs(rng.normal(0, volatility / 2, n)))
+    low = np.minimum(open_, close) * (1 - np.abs(rng.normal(0, volatility / 2, n)))
+    vwap = (high + low + close) / 3
+    volume = np.round(rng.lognormal(13.5, 1.2) * rng.lognormal(0, 0.4, n))
+    transactions = np.maximum(volume // rng.uniform(50, 300), 1).astype(int)
+    return list(zip(
+        [ticker] * n, close.tolist(), high.tolist(), low.tolist(), transactions.tolist(),
+        open_.tolist(), timestamps[listed:].tolist(), volume.tolist(), vwap.tolist(),
+    ))
+
+def session_bars(tickers, timestamp: int, seed: int) -> list[tuple]:
+    """One extra session of grouped_daily_data rows for `tickers`, shaped like a Polygon grouped daily response."""
+    rng = np.random.default_rng([seed, timestamp])
+    close = rng.lognormal(3.3, 1.0, len(tickers))
+    open_ = close * np.exp(rng.normal(0, 0.01, len(tickers)))
+    high = np.maximum(open_, close) * 1.01
+    low = np.minimum(open_, close) * 0.99
+    volume = np.round(rng.lognormal(13.5, 1.2, len(tickers)))
+    return [
+        (ticker, close[i], high[i], low[i], int(volume[i] // 100) + 1, open_[i], int(timestamp), volume[i], (high[i] + low[i] + close[i]) / 3)
+        for i, ticker in enumerate(tickers)
+    ]
+
+# --- Fundamentals ---
+def stock_rows(tickers, seed: int) -> list[dict]:
+    """stock_data rows keyed like companydata.STOCK_COLUMNS."""
+    rng = np.random.default_rng([seed, len(tickers)])
+    industries = [(sector, industry) for sector, names in SECTORS.items() for industry in names]
+    rows = []
+    for ticker in tickers:
+        sector, industry = industries[int(rng.integers(len(industries)))]
+        market_cap = int(rng.lognormal(21.5, 2.0))
+        rows.append({
+            'Ticker': ticker,
+            'short_interest': float(rng.uniform(0, 0.3)),
+            'Industry': industry,
+            'Sector': sector,
+            'market_cap': market_cap,
+            'company_name': f"{ticker.title()} Holdings",
+            'summary': f"{ticker.title()} Holdings operates in the {industry.lower()} industry.",
+            'analyst_opinions': int(rng.integers(0, 40)),
+            'share_float': int(market_cap / rng.uniform(5, 200)),
+            'revenue_growth': float(rng.normal(0.05, 0.2)),
+            'earnings_growth': float(rng.normal(0.05, 0.4)),
+            'last_updated': END_DATE.isoformat(),
+        })
+    return rows
+
+# --- Tables ---
+def create_tables(conn: sqlite3.Connection) -> None:
+    """The tables the ingest scripts create, laid out as they lay them out.
+
+    dailydata.py and companydata.py need the Polygon and yfinance clients just to
+    import, so their DDL is repeated here.
+    """
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS grouped_daily_data (
+            Ticker TEXT,
+            Close REAL,
+            High REAL,
+            Low REAL,
+            Transactions INTEGER,
+            Open REAL,
+            Timestamp INTEGER,
+            Volume REAL,
+            VWAP REAL,
+            PRIMARY KEY (Ticker, Timestamp)
+        )
+        """
+    )
+    indicator_columns = ''.join(f"{name} REAL, " for name in INDICATORS)
+    conn.execute(
+        f"""
+        CREATE TABLE IF NOT EXISTS rolling_returns (
+            Date DATE,
+            Ticker TEXT,
+            Close REAL,
+            Volume REAL,
+            VWAP REAL,
+            {indicator_columns}
+            PRIMARY KEY (Date, Ticker)
+        )
+        """
+    )
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS stock_data (
+            Ticker TEXT,
+            short_interest REAL,
+            Industry TEXT,
+            Sector TEXT,
+            market_cap INTEGER,
+            company_name TEXT,
+            summary TEXT,
+            analyst_opinions INTEGER,
+            share_float INTEGER,
+            revenue_growth REAL,
+            earnings_growth REAL,
+            feature_vector TEXT,
+            last_updated TEXT,
+            PRIMARY KEY (Ticker)
+        )
+        """
+    )
+    ensure_template_bank(conn)
+    ensure_version_triggers(conn)
+    conn.commit()
+
+def write_batch(conn: sqlite3.Connection, rows: list[tuple]) -> int:
+    """Store one batch of bars and their rolling_returns rows. Returns indicator rows written."""
+    conn.executemany(
+        """
+        INSERT OR IGNORE INTO grouped_daily_data (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        rows,
+    )
+    df = pd.DataFrame(rows, columns=['Ticker', 'Close', 'High', 'Low', 'Transactions', 'Open', 'Timestamp', 'Volume', 'VWAP'])
+    df['LastTs'] = -1
+    indicators = compute_indicators(df)
+    columns = ['Date', 'Ticker', 'Close', 'Volume', 'VWAP', *INDICATORS]
+    conn.executemany(
+        f"INSERT OR REPLACE INTO rolling_returns ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})",
+        indicators[columns].itertuples(index=False, name=None),
+    )
+    return len(indicators)
+
+def sample_templates(conn: sqlite3.Connection, tickers, n: int, seed: int, bars: int = TEMPLATE_BARS) -> list[tuple]:
+    """n template_bank rows cut from random tickers' histories, transformed as the scans transform windows."""
+    rng = np.random.default_rng([seed, n])
+    rows = []
+    for _ in range(20 * n if tickers else 0):
+        if len(rows) == n:
+            break
+        ticker = tickers[int(rng.integers(len(tickers)))]
+        history = conn.execute(
+            f"SELECT {', '.join(PRICE_COLUMNS)} FROM grouped_daily_data WHERE Ticker = ? ORDER BY Timestamp", (ticker,)
+        ).fetchall()
+        if len(history) < bars:
+            continue
+        start = int(rng.integers(len(history) - bars + 1))
+        prices = np.array(history[start:start + bars], dtype=float)
+        features, mask = transform_windows(prices[None], np.ones((1, bars), dtype=bool))
+        array = np.ascontiguousarray(features[0][mask[0]], dtype=np.float32)
+        rows.append((ticker, array.tobytes(), array.shape[0], array.shape[1]))
+    return rows
+
+def build_database(path: str = DB_NAME, tickers: int = 2000, years: float = 2, templates: int = 50, seed: int = 0, overwrite: bool = False) -> dict:
+    """Build a synthetic tradeapp.db at `path` with the given scale. Returns row counts.
+
+    Fills grouped_daily_data, rolling_returns (computed with the production
+    kernels), stock_data, template_bank and latest_snapshot. The same arguments
+    always produce the same data.
+    """
+    if os.path.exists(path):
+        if not overwrite:
+            raise FileExistsError(f"{path} already exists")
+        os.remove(path)
+    names = ticker_names(tickers)
+    timestamps = session_timestamps(years)
+
+    counts = {'tickers': tickers, 'sessions': len(timestamps), 'bars': 0, 'indicator_rows': 0}
+    with connect(path) as conn:
+        create_tables(conn)
+        for start in range(0, tickers, BATCH_SIZE):
+            rows = []
+            for position in range(start, min(start + BATCH_SIZE, tickers)):
+                rows += ticker_bars(names[position], position, timestamps, seed)
+            with conn:
+                counts['indicator_rows'] += write_batch(conn, rows)
+            counts['bars'] += len(rows)
+        with conn:
+            conn.executemany(
+                """
+                INSERT OR REPLACE INTO stock_data (Ticker, short_interest, Industry, Sector, market_cap, company_name, summary,
+                    analyst_opinions, share_float, revenue_growth, earnings_growth, last_updated)
+                VALUES (:Ticker, :short_interest, :Industry, :Sector, :market_cap, :company_name, :summary,
+                    :analyst_opinions, :share_float, :revenue_growth, :earnings_growth, :last_updated)
+                """,
+                stock_rows(names, seed),
+            )
+            conn.executemany(
+                "INSERT INTO template_bank (ticker, data, n_rows, n_cols) VALUES (?, ?, ?, ?)",
+                sample_templates(conn, names, templates, seed),
+            )
+        counts['templates'] = templates
+        # The snapshot is empty, so migrate builds it and the indexes in one go
+        migrate(conn)
+    return counts
+
+def main():
+    parser = argparse.ArgumentParser(description="Build a deterministic synthetic tradeapp.db for benchmarks and offline testing")
+    parser.add_argument('--db', default=DB_NAME)
+    parser.add_argument('--tickers', type=int, default=2000)
+    parser.add_argument('--years', type=float, default=2)
+    parser.add_argument('--templates', type=int, default=50, help="Rows written to template_bank")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--overwrite', action='store_true', help="Replace the database if it exists")
+    args = parser.parse_args()
+
+    start_time = time.time()
+    counts = build_database(args.db, args.tickers, args.years, args.templates, args.seed, args.overwrite)
+    print(
+        f"Built {args.db}: {counts['tickers']} tickers x {counts['sessions']} sessions ({counts['bars']} bars, "
+        f"{counts['indicator_rows']} indicator rows), {counts['templates']} templates in {time.time() - start_time:.1f} seconds"
+    )
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import json
+import sqlite3
+
+import numpy as np
+
+# Cached padded template matrix, keyed on the bank's (MAX(id), COUNT(*))
+_cache: dict = {'key': None, 'bank': None}
+
+def ensure_template_bank(conn: sqlite3.Connection) -> None:
+    """Create template_bank with float32 BLOB storage, migrating any JSON rows in place."""
+    conn.execute(
+        """
+        CREATE TABLE IF NOT EXISTS template_bank (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticker TEXT,
+            data BLOB,
+            n_rows INTEGER,
+            n_cols INTEGER
+        )
+        """
+    )
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(template_bank)")}
+    if 'n_rows' not in columns:
+        conn.execute("ALTER TABLE template_bank ADD COLUMN n_rows INTEGER")
+        conn.execute("ALTER TABLE template_bank ADD COLUMN n_cols INTEGER")
+
+    legacy = conn.execute("SELECT id, data FROM template_bank WHERE n_rows IS NULL").fetchall()
+    if legacy:
+        updates = []
+        for template_id, data in legacy:
+            array = np.asarray(json.loads(data), dtype=np.float32)
+            updates.append((array.tobytes(), array.shape[0], array.shape[1] if array.ndim == 2 else 0, template_id))
+        conn.executemany("UPDATE template_bank SET data = ?, n_rows = ?, n_cols = ? WHERE id = ?", updates)
+    conn.commit()
+
+def save_template(conn: sqlite3.Connection, ticker: str, data: np.ndarray) -> None:
+    array = np.ascontiguousarray(data, dtype=np.float32)
+    conn.execute(
+        "INSERT INTO template_bank (ticker, data, n_rows, n_cols) VALUES (?, ?, ?, ?)",
+        (ticker, array.tobytes(), array.shape[0], array.shape[1]),
+    )
+    conn.commit()
+    invalidate_cache()
+
+def invalidate_cache() -> None:
+    _cache['key'] = None
+    _cache['bank'] = None
+
+def load_template_matrix(conn: sqlite3.Connection) -> dict:
+    """Load the whole bank with one read into a padded (templates x max_rows x cols) matrix.
+
+    Returns a dict with 'ids', 'names', 'matrix' (float32, NaN padded) and 'lengths'.
+    The result is cached until a template is saved or the bank changes on disk.
+    """
+    key = conn.execute("SELECT MAX(id), COUNT(*) FROM template_bank").fetchone()
+    if _cache['bank'] is not None and _cache['key'] == key:
+        return _cache['bank']
+
+    rows = conn.execute(
+        "SELECT id, ticker, n_rows, n_cols, data FROM template_bank WHERE n_rows > 0 ORDER BY id"
+    ).fetchall()
+    n_cols = max((row[3] for row in rows), default=0)
+    rows = [row for row in rows if row[3] == n_cols]
+
+    ids = np.array([row[0] for row in rows], dtype=np.int64)
+    names = [f"Bank #{row[0]} ({row[1]})" for row in rows]
+    lengths = np.array([row[2] for row in rows], dtype=np.int64)
+
+    # Decode every BLOB in one frombuffer call, then scatter the bars into the padded matrix
+    flat = np.frombuffer(b''.join(row[4] for row in rows), dtype=np.float32).reshape(-1, max(n_cols, 1))
+    matrix = np.full((len(rows), lengths.max(initial=0), n_cols), np.nan, dtype=np.float32)
+    template_rows = np.repeat(np.arange(len(rows)), lengths)
+    offsets = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    matrix[template_rows, np.arange(len(flat)) - offsets] = flat
+
+    bank = {'ids': ids, 'names': names, 'matrix': matrix, 'lengths': lengths}
+    _cache['key'] = key
+    _cache['bank'] = bank
+    return bank
+
+def bank_templates(conn: sqlite3.Connection) -> dict:
+    """The bank as a {name: (bars x cols) float64 array} dict, ready for DTW."""
+    bank = load_template_matrix(conn)
+    if 'templates' not in bank:
+        bank['templates'] = {
+            name: bank['matrix'][i, :length].astype(np.float64)
+            for i, (name, length) in enumerate(zip(bank['names'], bank['lengths']))
+        }
+    return bank['templates']
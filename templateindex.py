@@ -0,0 +1,233 @@
+import argparse
+import time
+
+import numpy as np
+
+from dtwengine import many_to_many
+from lowerbound import keogh_envelope, best_template, empty_stats, _SLACK
+
+MAX_ITERATIONS = 5 # k-medoids refinement passes when building
+BATCH = 64 # Members of a cluster scored per batched DTW call; bounds tighten between calls
+
+class TemplateIndex:
+    """A template bank clustered around medoid templates, for an exact best-match search of a chunk of windows.
+
+    Each window is first scored against every medoid. Each cluster keeps the
+    union of its members' LB_Keogh envelopes and the box of their first and
+    last bars. Either bound can rule out the whole cluster for a window against
+    its best distance so far. The members of clusters that aren't ruled out are
+    scored in batched DTW calls that abandon early past that distance.
+    Per-member LB_Kim / LB_Keogh checks are left out: on windows this short
+    they cost about as much as the batched DTW they would save.
+
+    DTW is not a metric, so the precomputed template-to-medoid distances never
+    prune anything; only the bounds do. They set the search order instead:
+    within a cluster, members nearest the medoid are scored first. A window
+    close to the medoid finds its match early, and later calls run against a
+    tighter bound.
+    """
+
+    def __init__(self, templates: dict, clusters: int | None = None, seed: int = 0):
+        # Same skip as the linear cascade; positions keep the bank's order for ties
+        self.names = [name for name, template in templates.items() if template.shape[0] >= 2]
+        self.templates = [np.ascontiguousarray(templates[name], dtype=np.double) for name in self.names]
+        n = len(self.templates)
+        if not n:
+            self.medoids, self.members, self.medoid_distance = np.array([], dtype=int), [], np.array([])
+            return
+
+        self.medoids, assignment, self.medoid_distance = self._cluster(min(clusters or max(1, int(np.sqrt(n))), n), seed)
+        groups = [np.flatnonzero(assignment == cluster) for cluster in range(len(self.medoids))]
+        # Members exclude the medoid itself (always scored) and are kept nearest-to-medoid first
+        self.members = [
+            members[np.argsort(self.medoid_distance[members], kind='stable')]
+            for members in (group[group != m] for group, m in zip(groups, self.medoids))
+        ]
+        envelopes = [keogh_envelope(template) for template in self.templates]
+        lowers = np.array([lower for lower, upper in envelopes])
+        uppers = np.array([upper for lower, upper in envelopes])
+        firsts = np.array([template[0] for template in self.templates])
+        lasts = np.array([template[-1] for template in self.templates])
+        self.cluster_lowers = np.array([lowers[g].min(axis=0) for g in groups])
+        self.cluster_uppers = np.array([uppers[g].max(axis=0) for g in groups])
+        self.first_boxes = np.array([(firsts[g].min(axis=0), firsts[g].max(axis=0)) for g in groups])
+        self.last_boxes = np.array([(lasts[g].min(axis=0), lasts[g].max(axis=0)) for g in groups])
+
+    def _cluster(self, k: int, seed: int) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """k-medoids on plain DTW: (medoid positions, cluster of every template, distance to its medoid).
+
+        Only the rows of medoid distances and each cluster's own block are
+        computed, never the full template x template matrix. Medoids come back
+        distinct and in bank order, so the first of equally close medoids is
+        the earliest template.
+        """
+        templates, n = self.templates, len(self.templates)
+        rng = np.random.default_rng(seed)
+        medoids = [int(rng.integers(n))]
+        rows = [many_to_many([templates[medoids[0]]], templates)[0]]
+        for _ in range(1, k):
+            nearest = np.min(rows, axis=0)
+            weights = nearest ** 2
+            total = weights.sum()
+            medoids.append(int(rng.choice(n, p=weights / total)) if total > 0 else int(np.argmax(nearest)))
+            rows.append(many_to_many([templates[medoids[-1]]], templates)[0])
+        to_medoids = np.array(rows)
+
+        for _ in range(MAX_ITERATIONS):
+            assignment = to_medoids.argmin(axis=0)
+            updated = list(medoids)
+            for cluster in range(k):
+                members = np.flatnonzero(assignment == cluster)
+                if len(members) > 2:
+                    block = many_to_many([templates[i] for i in members], [templates[i] for i in members])
+                    updated[cluster] = int(members[block.sum(axis=1).argmin()])
+            if updated == medoids:
+                break
+            for cluster in range(k):
+                if updated[cluster] != medoids[cluster]:
+                    to_medoids[cluster] = many_to_many([templates[updated[cluster]]], templates)[0]
+            medoids = updated
+        rows = {medoid: row for medoid, row in zip(medoids, to_medoids)}
+        medoids = np.array(sorted(rows))
+        to_medoids = np.array([rows[medoid] for medoid in medoids])
+        assignment = to_medoids.argmin(axis=0)
+        return medoids, assignment, to_medoids[assignment, np.arange(n)]
+
+    def covers(self, templates: dict) -> bool:
+        """Whether `templates` is the bank this index was built over, in the same order."""
+        return self.names == [name for name, template in templates.items() if template.shape[0] >= 2]
+
+    def best_matches(self, windows: list, k: int | None = None, threshold: float = float('inf'), stats: dict | None = None, options: dict | None = None) -> tuple[float, list]:
+        """Closest template to every window (all of at least 2 bars): (cap, [(distance, template), ...]).
+
+        cap is `threshold`, lowered with k to the k-th smallest of the windows'
+        best medoid distances, since k windows are at least that close to some
+        template. A window whose best distance is at most cap gets the template
+        and distance the linear cascade over the whole bank finds, ties going
+        to the earlier template. Any other window comes back (inf, None): its
+        best distance is only known to exceed cap.
+
+        `stats` counts per window and template: whole clusters ruled out under
+        'pruned_cluster', and members abandoned past the window's bound under
+        'abandoned'. `options` are dtwengine scan options without psi or
+        max_dist.
+        """
+        stats = stats if stats is not None else empty_stats()
+        options = options or {}
+        stats['candidates'] += len(windows) * len(self.names)
+        if not self.names or not windows:
+            return threshold, [(float('inf'), None)] * len(windows)
+
+        to_medoids = many_to_many([self.templates[m] for m in self.medoids], windows, **options)
+        stats['full_dtw'] += to_medoids.size
+        best_distance = to_medoids.min(axis=0)
+        best_position = self.medoids[to_medoids.argmin(axis=0)]
+        cap = threshold
+        if k and len(windows) >= k:
+            cap = min(cap, float(np.partition(best_distance, k - 1)[k - 1]))
+
+        # Padded to one length; the mask drops the padding from LB_Keogh
+        length = max(len(window) for window in windows)
+        queries = np.zeros((len(windows), length, self.cluster_lowers.shape[1]))
+        mask = np.zeros((len(windows), length))
+        for i, window in enumerate(windows):
+            queries[i, :len(window)] = window
+            mask[i, :len(window)] = 1
+        firsts = np.array([window[0] for window in windows])
+        lasts = np.array([window[-1] for window in windows])
+
+        first = np.clip(firsts[:, None] - self.first_boxes[None, :, 1], 0, None) + np.clip(self.first_boxes[None, :, 0] - firsts[:, None], 0, None)
+        last = np.clip(lasts[:, None] - self.last_boxes[None, :, 1], 0, None) + np.clip(self.last_boxes[None, :, 0] - lasts[:, None], 0, None)
+        cluster_kim = np.sqrt((first ** 2).sum(axis=2) + (last ** 2).sum(axis=2))
+        cluster_bounds = np.maximum(cluster_kim, _keogh(queries, mask, self.cluster_lowers, self.cluster_uppers))
+
+        # Clusters whose medoid is typically nearest go first
+        for cluster in np.argsort(np.median(to_medoids, axis=1), kind='stable'):
+            members = self.members[cluster]
+            if not len(members):
+                continue
+            ruled_out = cluster_bounds[:, cluster] > np.minimum(best_distance, cap) * _SLACK
+            stats['pruned_cluster'] += int(ruled_out.sum()) * len(members)
+            rows = np.flatnonzero(~ruled_out)
+            for start in range(0, len(members), BATCH):
+                part = members[start:start + BATCH]
+                if not len(rows):
+                    break
+                bound = np.minimum(best_distance[rows], cap) * _SLACK
+                limit = bound.max()
+                distances = many_to_many(
+                    [self.templates[i] for i in part], [windows[i] for i in rows],
+                    **options, **({} if limit == float('inf') else {'max_dist': limit}),
+                ).T
+                within = np.isfinite(distances) & (distances <= bound[:, None])
+                stats['full_dtw'] += int(within.sum())
+                stats['abandoned'] += int((~within).sum())
+
+                # Fold each window's closest new template (earliest on a tie) into its best
+                distances = np.where(within, distances, np.inf)
+                closest = distances.min(axis=1)
+                positions = np.where(distances == closest[:, None], part[None, :], len(self.names)).min(axis=1)
+                better = (closest < best_distance[rows]) | ((closest == best_distance[rows]) & (positions < best_position[rows]))
+                best_distance[rows[better]] = closest[better]
+                best_position[rows[better]] = positions[better]
+
+        return cap, [
+            (float(distance), self.names[position]) if np.isfinite(distance) and distance <= cap else (float('inf'), None)
+            for distance, position in zip(best_distance, best_position)
+        ]
+
+def _keogh(queries: np.ndarray, mask: np.ndarray, lowers: np.ndarray, uppers: np.ndarray) -> np.ndarray:
+    """lb_keogh of every padded query (windows x bars x dims) against every (lower, upper) envelope: windows x envelopes."""
+    above = np.clip(queries[:, None] - uppers[None, :, None], 0, None)
+    below = np.clip(lowers[None, :, None] - queries[:, None], 0, None)
+    return np.sqrt(((above ** 2 + below ** 2) * mask[:, None, :, None]).sum(axis=(2, 3)))
+
+def build_index(templates: dict) -> TemplateIndex | None:
+    """An index over the bank, or None if it has no usable template."""
+    if not any(template.shape[0] >= 2 for template in templates.values()):
+        return None
+    return TemplateIndex(templates)
+
+# --- Benchmark ---
+def benchmark(n_templates: int = 1000, n_windows: int = 200, bars: int = 9, seed: int = 0) -> dict:
+    """Build time, and the linear cascade, the index and an exhaustive batched matrix on random-walk windows.
+
+    Also checks that the index finds the same best template as the cascade.
+    """
+    rng = np.random.default_rng(seed)
+    templates = {f"T{i}": np.cumsum(rng.normal(0, 0.03, (int(rng.integers(5, 16)), 6)), axis=0) for i in range(n_templates)}
+    windows = [np.cumsum(rng.normal(0, 0.03, (bars, 6)), axis=0) for _ in range(n_windows)]
+
+    timings = {}
+    start = time.perf_counter()
+    index = TemplateIndex(templates)
+    timings['build'] = time.perf_counter() - start
+
+    envelopes = {name: keogh_envelope(template) for name, template in templates.items()}
+    start = time.perf_counter()
+    linear = [best_template(window, templates, envelopes) for window in windows]
+    timings['linear'] = time.perf_counter() - start
+
+    stats = empty_stats()
+    start = time.perf_counter()
+    cap, indexed = index.best_matches(windows, stats=stats)
+    timings['indexed'] = time.perf_counter() - start
+    timings['mismatches'] = sum(a != b for a, b in zip(linear, indexed))
+
+    start = time.perf_counter()
+    many_to_many(list(templates.values()), windows)
+    timings['exhaustive'] = time.perf_counter() - start
+    timings['skipped_share'] = (stats['pruned_cluster'] + stats['abandoned']) / stats['candidates']
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the clustered template index against the linear cascade")
+    parser.add_argument('--templates', type=int, default=1000)
+    parser.add_argument('--windows', type=int, default=200)
+    args = parser.parse_args()
+
+    for name, value in benchmark(args.templates, args.windows).items():
+        print(f"  {name:<14} {value:.6f}" + (" s" if name in ('build', 'linear', 'indexed', 'exhaustive') else ""))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+import os
+import shutil
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import columnstore
+from columnstore import FIELDS, ColumnStore, build_from_sqlite, last_bars, open_store
+from db import connect
+from schema import table_version
+from syntheticdb import DB_NAME, build_database
+from windowloader import load_windows
+
+STORE = 'columnstore'
+BAR_COLUMNS = ['Ticker', 'Close', 'High', 'Low', 'Transactions', 'Open', 'Timestamp', 'Volume', 'VWAP']
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setitem(columnstore._cache, 'key', None)
+    build_database(DB_NAME, tickers=30, years=0.3, templates=0, overwrite=True)
+    with connect(DB_NAME) as conn:
+        # Gaps, so some tickers' last bars reach further back than others'
+        conn.execute("DELETE FROM grouped_daily_data WHERE Ticker IN ('AAAB', 'AAAC') AND Timestamp IN (SELECT DISTINCT Timestamp FROM grouped_daily_data ORDER BY Timestamp DESC LIMIT 3)")
+        conn.commit()
+        yield conn
+
+def take_session(conn, position):
+    """Delete every bar of one session (by position in time) and return them as dailydata rows."""
+    timestamps = [row[0] for row in conn.execute("SELECT DISTINCT Timestamp FROM grouped_daily_data ORDER BY Timestamp")]
+    rows = conn.execute(f"SELECT {', '.join(BAR_COLUMNS)} FROM grouped_daily_data WHERE Timestamp = ?", (timestamps[position],)).fetchall()
+    conn.execute("DELETE FROM grouped_daily_data WHERE Timestamp = ?", (timestamps[position],))
+    conn.commit()
+    return rows
+
+def ingest(conn, store, rows):
+    """Store rows the way dailydata does: one transaction, then mirror them with the counter before and after it."""
+    with conn:
+        cursor = conn.executemany(f"INSERT OR IGNORE INTO grouped_daily_data ({', '.join(BAR_COLUMNS)}) VALUES ({', '.join(['?'] * len(BAR_COLUMNS))})", rows)
+        after = table_version(conn, 'grouped_daily_data')
+        versions = (after - max(cursor.rowcount, 0), after)
+    store.write_bars(rows, versions)
+
+def assert_matches_sqlite(conn, store):
+    bars = pd.read_sql_query(f"SELECT Ticker, Timestamp, {', '.join(FIELDS)} FROM grouped_daily_data", conn)
+    assert store.dates.tolist() == sorted(bars['Timestamp'].unique().tolist())
+    assert sorted(store.tickers) == sorted(bars['Ticker'].unique().tolist())
+    for field in FIELDS:
+        expected = bars.pivot(index='Timestamp', columns='Ticker', values=field).reindex(index=store.dates, columns=store.tickers)
+        np.testing.assert_allclose(store.field(field), expected.to_numpy(dtype=np.float32), rtol=1e-6, equal_nan=True)
+
+def test_last_bars_match_sqlite(conn):
+    build_from_sqlite(conn, STORE)
+    store = open_store(conn)
+    assert store is not None
+    tickers = [*sorted(store.tickers), 'ZZZZ']
+
+    values, mask = last_bars(store, tickers, 9)
+    for row, ticker in enumerate(tickers):
+        expected = conn.execute(
+            f"SELECT {', '.join(FIELDS)} FROM (SELECT * FROM grouped_daily_data WHERE Ticker = ? ORDER BY Timestamp DESC LIMIT 9) ORDER BY Timestamp",
+            (ticker,),
+        ).fetchall()
+        assert mask[row].sum() == len(expected) and mask[row, :len(expected)].all()
+        np.testing.assert_allclose(values[row, :len(expected)], np.array(expected, dtype=np.float32).reshape(-1, len(FIELDS)), rtol=1e-6)
+
+    # The same windows through load_windows, from the store and then from SQLite
+    from_store = load_windows(conn, tickers, 9)
+    shutil.rmtree(STORE)
+    from_sqlite = load_windows(conn, tickers, 9)
+    assert from_store[1] == from_sqlite[1]
+    np.testing.assert_array_equal(from_store[2], from_sqlite[2])
+    np.testing.assert_allclose(from_store[0], from_sqlite[0], atol=1e-5)
+
+@pytest.mark.parametrize('change', [
+    "DELETE FROM grouped_daily_data WHERE Ticker = 'AAAA' AND Timestamp = (SELECT MIN(Timestamp) FROM grouped_daily_data)",
+    "UPDATE grouped_daily_data SET Close = Close * 1.01 WHERE Ticker = 'AAAD' AND Timestamp = (SELECT MIN(Timestamp) FROM grouped_daily_data)",
+])
+def test_changed_bars_make_store_stale(conn, change):
+    build_from_sqlite(conn, STORE)
+    version = table_version(conn, 'grouped_daily_data')
+    assert open_store(conn) is not None
+
+    conn.execute(change)
+    conn.commit()
+
+    assert table_version(conn, 'grouped_daily_data') > version
+    assert open_store(conn) is None
+    build_from_sqlite(conn, STORE)
+    assert open_store(conn) is not None
+
+def test_new_session_is_appended(conn):
+    rows = take_session(conn, -1)
+    build_from_sqlite(conn, STORE)
+    store = ColumnStore(STORE, mode='r+')
+
+    ingest(conn, store, rows)
+
+    assert store.generation == 0
+    assert_matches_sqlite(conn, store)
+    assert open_store(conn) is not None
+
+def test_out_of_order_session_rewrites_generation(conn):
+    rows = take_session(conn, 20)
+    build_from_sqlite(conn, STORE)
+    reader = open_store(conn)
+    old_dates = reader.dates.copy()
+    old_close = np.array(reader.field('Close'))
+    store = ColumnStore(STORE, mode='r+')
+
+    ingest(conn, store, rows)
+
+    assert store.generation == 1
+    assert sorted(os.listdir(STORE)) == sorted(['meta.json', *(f'{field}.1.f32' for field in FIELDS)])
+    assert_matches_sqlite(conn, store)
+    # A reader that mapped the old generation still sees it unchanged
+    np.testing.assert_array_equal(reader.dates, old_dates)
+    np.testing.assert_array_equal(reader.field('Close'), old_close)
+
+    current = open_store(conn)
+    assert current is not None and current.generation == 1
+    assert_matches_sqlite(conn, current)
+
+def test_write_after_missed_change_stays_stale(conn):
+    rows = take_session(conn, -1)
+    build_from_sqlite(conn, STORE)
+    store = ColumnStore(STORE, mode='r+')
+    # A correction the store never saw, then a normal ingest
+    conn.execute("UPDATE grouped_daily_data SET Close = Close * 1.01 WHERE Ticker = 'AAAD'")
+    conn.commit()
+
+    ingest(conn, store, rows)
+
+    assert open_store(conn) is None
@@ -0,0 +1,85 @@
+import pytest
+
+import dtwcache
+from db import connect
+from dtwcache import cached_results, ensure_dtw_cache, last_timestamps, lookup, params_key, store
+from schema import upsert_bars
+from syntheticdb import DB_NAME, build_database
+
+KEY = 'template:T0'
+PARAMS = params_key(bars=9)
+
+@pytest.fixture
+def conn(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(dtwcache, '_skip_writes_until', [0.0])
+    build_database(DB_NAME, tickers=6, years=0.2, templates=0, overwrite=True)
+    with connect(DB_NAME) as conn:
+        ensure_dtw_cache(conn)
+        yield conn
+
+def tickers(conn):
+    return [row[0] for row in conn.execute("SELECT Ticker FROM latest_snapshot ORDER BY Ticker")]
+
+class Compute:
+    """A compute() for cached_results that records the tickers it was asked for."""
+
+    def __init__(self, distance):
+        self.distance = distance
+        self.requested = []
+
+    def __call__(self, misses):
+        self.requested += misses
+        yield [(ticker, 'T0', self.distance) for ticker in misses]
+
+def test_lookup_reads_current_last_bar_only(conn):
+    names = tickers(conn)
+    last_ts = last_timestamps(conn, names)
+    store(conn, last_ts, KEY, PARAMS, [(ticker, 'T0', 1.0, True) for ticker in names])
+    assert set(lookup(conn, last_ts, KEY, PARAMS)) == set(names)
+
+    # A new bar for one ticker moves its window on, so its entry no longer applies
+    ticker = names[0]
+    bar = conn.execute("SELECT Ticker, Close, High, Low, 0, Open, Timestamp, Volume, VWAP FROM latest_snapshot WHERE Ticker = ?", (ticker,)).fetchone()
+    newer = (*bar[:6], bar[6] + 86_400_000, *bar[7:])
+    conn.execute("INSERT INTO grouped_daily_data (Ticker, Close, High, Low, Transactions, Open, Timestamp, Volume, VWAP) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", newer)
+    upsert_bars(conn, [newer])
+    conn.commit()
+
+    assert set(lookup(conn, last_timestamps(conn, names), KEY, PARAMS)) == set(names[1:])
+    compute = Compute(2.0)
+    rows = cached_results(conn, names, KEY, PARAMS, compute)
+    assert compute.requested == [ticker]
+    assert dict((name, distance) for name, template, distance in rows) == {name: 2.0 if name == ticker else 1.0 for name in names}
+
+@pytest.mark.parametrize('top_k', [None, 2])
+def test_lower_bounds_are_never_final(conn, top_k):
+    names = tickers(conn)
+    last_ts = last_timestamps(conn, names)
+    # A top-k scan left a lower bound of 0 for the first ticker and exact distances for the rest
+    store(conn, last_ts, KEY, PARAMS, [(names[0], None, 0.0, False), *((ticker, 'T0', 1.0, True) for ticker in names[1:])])
+    assert lookup(conn, last_ts, KEY, PARAMS)[names[0]] == (0.0, None, False)
+
+    compute = Compute(0.5)
+    rows = cached_results(conn, names, KEY, PARAMS, compute, top_k=top_k)
+
+    assert compute.requested == [names[0]]
+    assert (names[0], 'T0', 0.5) in rows
+    assert (names[0], None, 0.0) not in rows
+    # The computed distance replaced the bound
+    assert lookup(conn, last_ts, KEY, PARAMS)[names[0]] == (0.5, 'T0', True)
+
+def test_lookup_leaves_caller_transaction_open(conn, monkeypatch):
+    monkeypatch.setattr(dtwcache, 'WRITE_TIMEOUT', 0.05)
+    names = tickers(conn)
+    last_ts = last_timestamps(conn, names)
+    store(conn, last_ts, KEY, PARAMS, [(ticker, 'T0', 1.0, True) for ticker in names])
+    conn.execute("CREATE TABLE scratch (x INTEGER)")
+    conn.commit()
+
+    conn.execute("INSERT INTO scratch VALUES (1)")
+    assert set(lookup(conn, last_ts, KEY, PARAMS)) == set(names)
+    assert conn.in_transaction
+    conn.rollback()
+
+    assert conn.execute("SELECT COUNT(*) FROM scratch").fetchone()[0] == 0
@@ -0,0 +1,12 @@
+import subprocess
+import sys
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+def test_batch_jobs_import_without_streamlit():
+    # None in sys.modules makes `import streamlit` fail, as on a host without it installed
+    code = "import sys; sys.modules['streamlit'] = None; import nightlyscan, historysearch, benchmark"
+    result = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True)
+    assert result.returncode == 0, result.stderr
+    assert 'No runtime found' not in result.stderr
@@ -0,0 +1,53 @@
+import sqlite3
+
+import pandas as pd
+import pytest
+
+from rollingretun import calculate_indicators
+from syntheticdb import DB_NAME, build_database
+
+TICKER = 'AAAA'
+
+def indicator_rows(ticker):
+    with sqlite3.connect(DB_NAME) as conn:
+        return pd.read_sql_query("SELECT * FROM rolling_returns WHERE Ticker = ? ORDER BY Date", conn, params=(ticker,))
+
+@pytest.fixture
+def database(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    build_database(DB_NAME, tickers=5, years=0.5, templates=0, overwrite=True)
+
+def test_backfilled_session_is_recomputed(database):
+    with sqlite3.connect(DB_NAME) as conn:
+        timestamps = [row[0] for row in conn.execute(
+            "SELECT Timestamp FROM grouped_daily_data WHERE Ticker = ? ORDER BY Timestamp", (TICKER,)
+        )]
+        # An older session that arrives late, after the indicators were computed without it
+        late = timestamps[len(timestamps) // 2]
+        bar = conn.execute("SELECT * FROM grouped_daily_data WHERE Ticker = ? AND Timestamp = ?", (TICKER, late)).fetchone()
+        conn.execute("DELETE FROM grouped_daily_data WHERE Ticker = ? AND Timestamp = ?", (TICKER, late))
+    calculate_indicators(full_rebuild=True)
+    date = pd.to_datetime(late, unit='ms').strftime('%Y-%m-%d %H:%M:%S')
+    assert date not in set(indicator_rows(TICKER)['Date'])
+
+    with sqlite3.connect(DB_NAME) as conn:
+        conn.execute(f"INSERT INTO grouped_daily_data VALUES ({', '.join(['?'] * len(bar))})", bar)
+    calculate_indicators()
+    incremental = indicator_rows(TICKER)
+    assert date in set(incremental['Date'])
+
+    calculate_indicators(full_rebuild=True)
+    pd.testing.assert_frame_equal(incremental, indicator_rows(TICKER))
+
+def test_deleted_session_is_dropped(database):
+    calculate_indicators(full_rebuild=True)
+    with sqlite3.connect(DB_NAME) as conn:
+        timestamps = [row[0] for row in conn.execute(
+            "SELECT Timestamp FROM grouped_daily_data WHERE Ticker = ? ORDER BY Timestamp", (TICKER,)
+        )]
+        conn.execute("DELETE FROM grouped_daily_data WHERE Ticker = ? AND Timestamp = ?", (TICKER, timestamps[len(timestamps) // 2]))
+    calculate_indicators()
+    incremental = indicator_rows(TICKER)
+
+    calculate_indicators(full_rebuild=True)
+    pd.testing.assert_frame_equal(incremental, indicator_rows(TICKER))
@@ -0,0 +1,68 @@
+import numpy as np
+import pytest
+from dtaidistance import dtw_ndim
+
+import dtwengine
+from dtwengine import best_suffixes
+from subsequence import open_begin_distance
+from windowloader import suffix_window
+
+MIN_LENGTH, MAX_LENGTH = 7, 15
+
+@pytest.fixture(scope='module')
+def series():
+    rng = np.random.default_rng(11)
+    query = rng.normal(0, 0.03, (9, 6))
+    tails = [rng.normal(0, 0.03, (int(length), 6)) for length in rng.integers(8, 20, 40)]
+    # Shorter than MIN_LENGTH (only the whole tail is tried), too short for any suffix, and empty
+    tails += [rng.normal(0, 0.03, (length, 6)) for length in (5, 3, 2, 1)] + [np.zeros((0, 6))]
+    # Every suffix of a zero tail is a zero window, so all lengths tie and the shortest must win
+    tails += [np.zeros((12, 6))]
+    return query, tails
+
+def brute_force(query, tails, **options):
+    """(distance, length) of each tail's best suffix from one DTW call per suffix, shortest length on ties."""
+    best = []
+    for tail in tails:
+        m = min(len(tail), MAX_LENGTH)
+        candidates = [
+            (dtw_ndim.distance(query, suffix_window(tail, length), **options), length)
+            for length in range(max(min(MIN_LENGTH, m), 2), m + 1)
+        ]
+        distance, length = min(candidates, default=(float('inf'), 0))
+        best.append((distance, length) if distance != float('inf') else (float('inf'), 0))
+    return best
+
+def assert_same(actual, expected):
+    assert [length for distance, length in actual] == [length for distance, length in expected]
+    assert [distance for distance, length in actual] == pytest.approx([distance for distance, length in expected])
+
+def test_single_pass_dp(series):
+    query, tails = series
+    assert_same([open_begin_distance(query, tail, MIN_LENGTH, MAX_LENGTH) for tail in tails], brute_force(query, tails))
+
+@pytest.mark.parametrize('c_available', [True, False])
+@pytest.mark.parametrize('options', [{}, {'window': 2}, {'max_dist': 0.2}, {'window': 3, 'max_dist': 0.25}])
+def test_best_suffixes(series, monkeypatch, c_available, options):
+    """Batched in C, and in Python: the single-pass DP for plain DTW, per-suffix DTW with options."""
+    if c_available and not dtwengine.C_AVAILABLE:
+        pytest.skip("dtaidistance C extension not built")
+    monkeypatch.setattr(dtwengine, 'C_AVAILABLE', c_available)
+    query, tails = series
+    expected = brute_force(query, tails, **options)
+    if 'max_dist' in options:
+        # Some tails must be cut off entirely, and some kept
+        assert 0 < sum(distance == float('inf') for distance, length in expected) < len(tails)
+
+    assert_same(best_suffixes(query, tails, MIN_LENGTH, MAX_LENGTH, **options), expected)
+
+@pytest.mark.parametrize('c_available', [True, False])
+@pytest.mark.parametrize('options', [{}, {'window': 2}])
+def test_ties_pick_shortest(series, monkeypatch, c_available, options):
+    if c_available and not dtwengine.C_AVAILABLE:
+        pytest.skip("dtaidistance C extension not built")
+    monkeypatch.setattr(dtwengine, 'C_AVAILABLE', c_available)
+    query, tails = series
+    flat = tails[-1]
+    assert open_begin_distance(np.zeros((9, 6)), flat, MIN_LENGTH, MAX_LENGTH) == (0.0, MIN_LENGTH)
+    assert best_suffixes(np.zeros((9, 6)), [flat], MIN_LENGTH, MAX_LENGTH, **options) == [(0.0, MIN_LENGTH)]
@@ -0,0 +1,70 @@
+import numpy as np
+import pytest
+
+from dtwengine import one_to_many
+from templateindex import build_index
+
+@pytest.fixture(scope='module')
+def bank():
+    rng = np.random.default_rng(3)
+    # Eight families of random walks, each around its own level, so whole clusters can be ruled out
+    levels = rng.normal(0, 0.5, (8, 6))
+    arrays = [levels[i % 8] + np.cumsum(rng.normal(0, 0.03, (int(rng.integers(5, 16)), 6)), axis=0) for i in range(200)]
+    # Copies tie with an earlier template, which must win
+    for i in range(0, 180, 37):
+        arrays[i + 20] = arrays[i].copy()
+    # Flat windows exactly as far from a template above them as from its mirror below (binary-exact steps)
+    flats = [np.full((9, 6), 0.5 * level) for level in range(-3, 3)]
+    for j, flat in enumerate(flats):
+        step = rng.choice([-0.0625, 0.0625], (9, 6))
+        arrays[10 + j], arrays[190 - 17 * j] = flat - step, flat + step
+        arrays[40 + j], arrays[60 + 7 * j] = flat + step[::-1], flat - step[::-1]
+    templates = {f"T{i}": array for i, array in enumerate(arrays)}
+    windows = [levels[i % 8] + np.cumsum(rng.normal(0, 0.03, (9, 6)), axis=0) for i in range(120)]
+    windows += [arrays[i][-9:].copy() for i in range(0, 200, 13) if len(arrays[i]) >= 9]
+    windows += flats
+    return templates, windows, build_index(templates)
+
+def brute_force(templates, window, options=None):
+    """(distance, template) of the closest template, earliest on a tie."""
+    names = list(templates)
+    distances = one_to_many(window, [templates[name] for name in names], **(options or {}))
+    position = int(np.argmin(distances))
+    return float(distances[position]), names[position]
+
+@pytest.mark.parametrize('options', [None, {'window': 3}])
+def test_best_matches_equal_brute_force(bank, options):
+    templates, windows, index = bank
+    cap, matches = index.best_matches(windows, options=options)
+
+    assert cap == float('inf')
+    for window, (distance, name) in zip(windows, matches):
+        expected = brute_force(templates, window, options)
+        assert name == expected[1]
+        assert distance == pytest.approx(expected[0])
+
+@pytest.mark.parametrize('k', [1, 10, 50])
+def test_windows_beyond_cap(bank, k):
+    templates, windows, index = bank
+    threshold = np.median([brute_force(templates, window)[0] for window in windows])
+    cap, matches = index.best_matches(windows, k, threshold)
+
+    assert cap <= threshold
+    for window, (distance, name) in zip(windows, matches):
+        expected = brute_force(templates, window)
+        if name is None:
+            # Left out only when the window's best match is known to lie past cap
+            assert distance == float('inf') and expected[0] > cap
+        else:
+            assert (name, distance) == (expected[1], pytest.approx(expected[0]))
+            assert distance <= cap
+    # cap is the k-th best medoid distance, so at least k windows are within it
+    assert sum(name is not None for distance, name in matches) >= min(k, len(windows))
+
+def test_pruning_skips_work(bank):
+    templates, windows, index = bank
+    stats = dict.fromkeys(('candidates', 'pruned_cluster', 'abandoned', 'full_dtw'), 0)
+    index.best_matches(windows, stats=stats)
+
+    assert stats['candidates'] == len(windows) * len(templates)
+    assert stats['pruned_cluster'] + stats['abandoned'] > 0
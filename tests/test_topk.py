@@ -0,0 +1,111 @@
+import numpy as np
+import pytest
+
+from lowerbound import best_template, keogh_envelope, merge_topk, topk_template_search
+from templateindex import build_index
+
+def random_walks(rng, count, low, high):
+    return [np.cumsum(rng.normal(0, 0.03, (int(rng.integers(low, high + 1)), 6)), axis=0) for _ in range(count)]
+
+@pytest.fixture(scope='module')
+def scan():
+    rng = np.random.default_rng(7)
+    arrays = random_walks(rng, 40, 5, 15)
+    # The same template under two names: ties go to the earlier one
+    arrays[25] = arrays[10].copy()
+    templates = {f"T{i}": array for i, array in enumerate(arrays)}
+    templates['T-short'] = arrays[0][:1]
+
+    windows = random_walks(rng, 150, 9, 9)
+    # Tickers with the same window tie on distance and template; the earlier index wins
+    for i in range(0, 150, 11):
+        windows[i + 5] = windows[i].copy()
+    windows[3] = windows[3][:1]
+    items = [(i, f"S{i}", window) for i, window in enumerate(windows)]
+    envelopes = {name: keogh_envelope(template) for name, template in templates.items()}
+    return items, templates, envelopes
+
+def exhaustive(items, templates, envelopes, options=None):
+    """(distance, index, ticker, template) of every ticker, closest first, with every template scored in full."""
+    rows = []
+    for index, ticker, data in items:
+        if data.shape[0] < 2:
+            continue
+        distance, name = best_template(data, templates, envelopes, options=options, use_bounds=False)
+        rows.append((distance, index, ticker, name))
+    return sorted(rows, key=lambda row: (row[0], row[1]))
+
+def assert_same_rows(actual, expected):
+    assert [row[1:] for row in actual] == [row[1:] for row in expected]
+    assert [row[0] for row in actual] == pytest.approx([row[0] for row in expected])
+
+def assert_observed(observed, truth):
+    for ticker, name, distance, exact in observed:
+        if exact:
+            assert name == truth[ticker][1] and distance == pytest.approx(truth[ticker][0])
+        else:
+            assert name is None and distance <= truth[ticker][0] * (1 + 1e-9)
+
+@pytest.mark.parametrize('indexed', [False, True])
+@pytest.mark.parametrize('options', [None, {'window': 3}])
+@pytest.mark.parametrize('k', [1, 5, 30, 500])
+def test_topk_equals_exhaustive(scan, k, options, indexed):
+    items, templates, envelopes = scan
+    index = build_index(templates) if indexed else None
+    expected = exhaustive(items, templates, envelopes, options)
+    truth = {ticker: (distance, name) for distance, index_, ticker, name in expected}
+
+    observed = [('PRIOR', None, 0.0, False)]
+    top, stats = topk_template_search(items, templates, envelopes, k, observed=observed, options=options, template_index=index)
+
+    assert_same_rows(top, expected[:k])
+    assert observed[0] == ('PRIOR', None, 0.0, False)
+    assert {row[0] for row in observed[1:]} == set(truth)
+    assert_observed(observed[1:], truth)
+
+@pytest.mark.parametrize('indexed', [False, True])
+@pytest.mark.parametrize('k', [1, 5, 30])
+def test_cached_threshold(scan, k, indexed):
+    """A scan split like the cached path: exact hits set the threshold for the rest, then the two merge."""
+    items, templates, envelopes = scan
+    index = build_index(templates) if indexed else None
+    expected = exhaustive(items, templates, envelopes)
+    truth = {ticker: (distance, name) for distance, index_, ticker, name in expected}
+
+    # Hits include one ticker of each duplicated pair, so the threshold ties with a ticker still to scan
+    hit_rows = [row for row in expected if row[1] % 11 == 0]
+    threshold = sorted(row[0] for row in hit_rows)[k - 1] if len(hit_rows) >= k else float('inf')
+    rest = [item for item in items if item[0] % 11 != 0]
+
+    observed = [('PRIOR', 'T0', 1.0, True)]
+    top, stats = topk_template_search(rest, templates, envelopes, k, threshold, observed, template_index=index)
+
+    assert_same_rows(merge_topk([hit_rows, top], k), expected[:k])
+    assert observed[0] == ('PRIOR', 'T0', 1.0, True)
+    # Lower bounds stored for the pruned tickers never exceed their true distance
+    assert_observed(observed[1:], truth)
+    assert any(not exact for ticker, name, distance, exact in observed[1:])
+
+@pytest.mark.parametrize('indexed', [False, True])
+def test_finite_threshold_keeps_ties(scan, indexed):
+    items, templates, envelopes = scan
+    index = build_index(templates) if indexed else None
+    expected = exhaustive(items, templates, envelopes)
+    # The threshold is exactly the distance of the first ticker of a duplicated pair
+    tied = next(row for row in expected if row[1] % 11 == 0 and row[1] + 5 < len(items))
+    threshold = tied[0]
+    within = [row for row in expected if row[0] <= threshold]
+
+    top, stats = topk_template_search(items, templates, envelopes, 500, threshold, template_index=index)
+
+    assert_same_rows(top, within)
+    assert {tied[1], tied[1] + 5} <= {row[1] for row in top}
+
+def test_max_dist_caps_threshold(scan):
+    items, templates, envelopes = scan
+    expected = exhaustive(items, templates, envelopes)
+    cap = expected[20][0]
+
+    top, stats = topk_template_search(items, templates, envelopes, 500, options={'max_dist': cap})
+
+    assert_same_rows(top, [row for row in expected if row[0] <= cap])
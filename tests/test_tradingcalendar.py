@@ -0,0 +1,23 @@
+import time
+from datetime import date
+
+import pandas as pd
+import pytest
+
+from tradingcalendar import session_date, trading_days
+
+@pytest.fixture(params=['Asia/Tokyo', 'Pacific/Auckland', 'America/Los_Angeles', 'UTC'])
+def host_timezone(request, monkeypatch):
+    monkeypatch.setenv('TZ', request.param)
+    time.tzset()
+    yield request.param
+    monkeypatch.undo()
+    time.tzset()
+
+def timestamp(day, hour):
+    return int(pd.Timestamp(day).replace(hour=hour).tz_localize('America/New_York').timestamp() * 1000)
+
+@pytest.mark.parametrize('hour', [0, 9, 16, 23])
+def test_session_date_ignores_host_timezone(host_timezone, hour):
+    for day in trading_days(date(2024, 3, 1), date(2024, 3, 15)) + [date(2024, 11, 4)]:
+        assert session_date(timestamp(day, hour)) == day
@@ -0,0 +1,80 @@
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
+
+# NYSE full-day closures. Weekends are never sessions; early closes still are.
+
+# Session dates are New York dates, whatever the host's timezone
+NEW_YORK = ZoneInfo('America/New_York')
+
+def _observed(day: date) -> date:
+    """Holidays on Saturday are observed Friday, on Sunday the following Monday."""
+    if day.weekday() == 5:
+        return day - timedelta(days=1)
+    if day.weekday() == 6:
+        return day + timedelta(days=1)
+    return day
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    first = date(year, month, 1)
+    return first + timedelta(days=(weekday - first.weekday()) % 7 + 7 * (n - 1))
+
+def _last_weekday(year: int, month: int, weekday: int) -> date:
+    last = date(year + month // 12, month % 12 + 1, 1) - timedelta(days=1)
+    return last - timedelta(days=(last.weekday() - weekday) % 7)
+
+def _easter(year: int) -> date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b + 8) // 25
+    g = (b - f + 1) // 3
+    h = (19 * a + b - d - g + 15) % 30
+    i, k = c // 4, c % 4
+    l = (32 + 2 * e + 2 * i - h - k) % 7
+    m = (a + 11 * h + 22 * l) // 451
+    month = (h + l - 7 * m + 114) // 31
+    day = (h + l - 7 * m + 114) % 31 + 1
+    return date(year, month, day)
+
+def market_holidays(year: int) -> set[date]:
+    holidays = {
+        _nth_weekday(year, 1, 0, 3),               # Martin Luther King Jr. Day
+        _nth_weekday(year, 2, 0, 3),               # Washington's Birthday
+        _easter(year) - timedelta(days=2),         # Good Friday
+        _last_weekday(year, 5, 0),                 # Memorial Day
+        _observed(date(year, 7, 4)),               # Independence Day
+        _nth_weekday(year, 9, 0, 1),               # Labor Day
+        _nth_weekday(year, 11, 3, 4),              # Thanksgiving
+        _observed(date(year, 12, 25)),             # Christmas
+    }
+    # New Year's Day on a Saturday is not observed on the prior Friday
+    new_year = date(year, 1, 1)
+    if new_year.weekday() != 5:
+        holidays.add(_observed(new_year))
+    if year >= 2022:
+        holidays.add(_observed(date(year, 6, 19)))  # Juneteenth
+    return holidays
+
+def is_trading_day(day: date) -> bool:
+    return day.weekday() < 5 and day not in market_holidays(day.year)
+
+def trading_days(start: date, end: date) -> list[date]:
+    """Every session from start to end inclusive."""
+    days = []
+    holidays = {}
+    day = start
+    while day <= end:
+        if day.year not in holidays:
+            holidays[day.year] = market_holidays(day.year)
+        if day.weekday() < 5 and day not in holidays[day.year]:
+            days.append(day)
+        day += timedelta(days=1)
+    return days
+
+def session_date(timestamp: int) -> date:
+    """Session of a bar Timestamp (Unix ms) in New York time."""
+    return datetime.fromtimestamp(timestamp / 1000, tz=NEW_YORK).date()
+
+def market_today() -> date:
+    """Today's date in New York."""
+    return datetime.now(NEW_YORK).date()
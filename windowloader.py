@@ -0,0 +1,113 @@
+import json
+
+import numpy as np
+import pandas as pd
+
+import instrument
+from columnstore import FIELDS, open_store, last_bars
+
+PRICE_COLUMNS = ['Open', 'High', 'Low', 'Close', 'VWAP']
+FEATURE_COLUMNS = PRICE_COLUMNS + ['Vdiff']
+
+# --- Vectorized Feature Transform ---
+def transform_windows(prices, present):
+    """Turn raw (tickers x bars x 5) price windows into log-return + Vdiff features.
+
+    Mirrors the per-ticker pandas transform: log returns with the first bar set
+    to 0, NaN returns filled with 0 and bars without a Vdiff dropped. Kept bars
+    are packed to the front of each row; the returned mask marks them.
+    """
+    with np.errstate(divide='ignore', invalid='ignore'):
+        returns = np.zeros_like(prices)
+        returns[:, 1:] = np.log(prices[:, 1:] / prices[:, :-1])
+        returns[np.isnan(returns)] = 0
+        vdiff = (prices[..., 4] - prices[..., 3]) / prices[..., 3]
+
+    features = np.concatenate([returns, vdiff[..., None]], axis=2)
+    keep = present & ~np.isnan(vdiff)
+
+    # Stable sort puts kept bars first without reordering them (same as dropna)
+    order = np.argsort(~keep, axis=1, kind='stable')
+    features = np.take_along_axis(features, order[..., None], axis=1)
+    mask = np.take_along_axis(keep, order, axis=1)
+    features[~mask] = np.nan
+    return features, mask
+
+def suffix_window(window, length):
+    """Re-transform the last `length` bars of a feature window as if loaded with LIMIT `length`."""
+    suffix = window[-length:].copy()
+    if len(suffix):
+        suffix[0, :len(PRICE_COLUMNS)] = 0
+    return suffix
+
+# --- Bulk Loader ---
+def load_windows(conn, tickers=None, bars=9):
+    """Load the last `bars` bars of every ticker in one query.
+
+    Returns (windows, ticker_index, mask): a (tickers x bars x 6) float array of
+    Open/High/Low/Close/VWAP log returns and Vdiff, a dict mapping ticker to its
+    row, and a boolean mask of valid bars (packed to the front of each row).
+    Reads from the column store when it is present and current.
+    """
+    store = open_store(conn)
+    if store is not None:
+        return load_windows_from_store(store, tickers, bars)
+
+    if tickers is None:
+        where, params = "", []
+    else:
+        tickers = list(tickers)
+        # One statement whatever the ticker count, so it is prepared once per connection and has no bound-variable limit
+        where = "WHERE Ticker IN (SELECT value FROM json_each(?))"
+        params = [json.dumps(tickers)]
+
+    query = f"""
+        SELECT Ticker, Open, High, Low, Close, VWAP, rn FROM (
+            SELECT Ticker, Open, High, Low, Close, VWAP,
+                   ROW_NUMBER() OVER (PARTITION BY Ticker ORDER BY Timestamp DESC) AS rn
+            FROM grouped_daily_data {where}
+        ) WHERE rn <= ?
+    """
+    with instrument.stage('sql'):
+        df = pd.read_sql_query(query, conn, params=params + [bars])
+    instrument.count('queries')
+    instrument.count('rows_read', len(df))
+
+    if tickers is None:
+        tickers = sorted(df['Ticker'].unique().tolist())
+    ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+
+    rows = df['Ticker'].map(ticker_index).to_numpy(dtype=np.int64)
+    rn = df['rn'].to_numpy(dtype=np.int64)
+    counts = np.bincount(rows, minlength=len(tickers))
+
+    with instrument.stage('transform'):
+        # Place each bar oldest-first: the newest bar (rn=1) goes last in the row
+        prices = np.full((len(tickers), bars, len(PRICE_COLUMNS)), np.nan)
+        present = np.zeros((len(tickers), bars), dtype=bool)
+        positions = counts[rows] - rn
+        prices[rows, positions] = df[PRICE_COLUMNS].to_numpy(dtype=float)
+        present[rows, positions] = True
+        windows, mask = transform_windows(prices, present)
+    return windows, ticker_index, mask
+
+def load_windows_from_store(store, tickers=None, bars=9):
+    """load_windows over the memory-mapped column store instead of a SQL query."""
+    tickers = sorted(store.tickers) if tickers is None else list(tickers)
+    ticker_index = {ticker: i for i, ticker in enumerate(tickers)}
+    with instrument.stage('store_read'):
+        values, present = last_bars(store, tickers, bars)
+    instrument.count('rows_read', int(present.sum()))
+    with instrument.stage('transform'):
+        prices = values[..., [FIELDS.index(column) for column in PRICE_COLUMNS]]
+        windows, mask = transform_windows(prices, present)
+    return windows, ticker_index, mask
+
+def window_for(windows, mask, row):
+    """Return the valid bars of one row of a window tensor as a (bars x 6) array."""
+    return windows[row, :mask[row].sum()]
+
+def window_list(windows, mask):
+    """Split a window tensor into a list of per-ticker (bars x 6) arrays."""
+    lengths = mask.sum(axis=1)
+    return [windows[i, :lengths[i]] for i in range(len(windows))]